@@ -8,7 +8,16 @@ from PIL import Image
 import io
 import pandas as pd
 import json
+import csv
 import pytz
+import zlib
+import threading
+import random
+import itertools
+import sys
+import numpy as np
+from contextlib import contextmanager
+from time import monotonic, perf_counter
 
 # Ensure 'data' directory exists before any DB connection
 os.makedirs("data", exist_ok=True)
@@ -29,8 +38,6 @@ def ensure_break_templates_column():
     finally:
         conn.close()
 
-ensure_break_templates_column()
-
 def ensure_group_messages_reactions_column():
     conn = sqlite3.connect("data/requests.db")
     try:
@@ -46,8 +53,6 @@ def ensure_group_messages_reactions_column():
     finally:
         conn.close()
 
-ensure_group_messages_reactions_column()
-
 def ensure_dropdown_options_table():
     conn = sqlite3.connect("data/requests.db")
     try:
@@ -114,22 +119,76 @@ def ensure_dropdown_options_table():
     finally:
         conn.close()
 
-ensure_dropdown_options_table()
-
 # --------------------------
 # Timezone Utility Functions
 # --------------------------
 
+CASABLANCA_TZ = pytz.timezone('Africa/Casablanca')
+
+class SystemClock:
+    """Wall clock reading Casablanca time as naive datetimes, like every timestamp we store"""
+
+    def now(self):
+        return datetime.now(CASABLANCA_TZ).replace(tzinfo=None)
+
+class FakeClock:
+    """Clock that only moves when told to, for replaying a shift faster than real time.
+
+    With speed set it also runs on its own at that multiple of wall time.
+    """
+
+    def __init__(self, start, speed=0):
+        self.start = start
+        self.speed = speed
+        self._offset = timedelta(0)
+        self._anchor = monotonic()
+        self._lock = threading.Lock()
+
+    def now(self):
+        with self._lock:
+            elapsed = (monotonic() - self._anchor) * self.speed
+            return self.start + self._offset + timedelta(seconds=elapsed)
+
+    def advance(self, **delta):
+        with self._lock:
+            self._offset += timedelta(**delta)
+
+    def set(self, moment):
+        with self._lock:
+            self.start, self._offset, self._anchor = moment, timedelta(0), monotonic()
+
+clock = SystemClock()
+# "now" is read once per rerun on the script thread; other threads always ask the clock
+_rerun_time = threading.local()
+
+def capture_rerun_now():
+    """Fix "now" for the rest of this rerun, so every part of the page agrees on it"""
+    _rerun_time.now = clock.now()
+    return _rerun_time.now
+
+def casablanca_now():
+    """Current Casablanca time as a naive datetime"""
+    return getattr(_rerun_time, "now", None) or clock.now()
+
+@contextmanager
+def use_clock(replacement):
+    """Run a block against another clock, e.g. a FakeClock in a replay"""
+    global clock
+    previous, previous_now = clock, getattr(_rerun_time, "now", None)
+    clock, _rerun_time.now = replacement, None
+    try:
+        yield replacement
+    finally:
+        clock, _rerun_time.now = previous, previous_now
+
 def get_casablanca_time():
     """Get current time in Casablanca, Morocco timezone"""
-    morocco_tz = pytz.timezone('Africa/Casablanca')
-    return datetime.now(morocco_tz).strftime("%Y-%m-%d %H:%M:%S")
+    return casablanca_now().strftime("%Y-%m-%d %H:%M:%S")
 
 def convert_to_casablanca_date(date_str):
     """Convert a date string to Casablanca timezone"""
     try:
         dt = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-        morocco_tz = pytz.timezone('Africa/Casablanca')
         return dt.date()  # Simplified since stored times are already in Casablanca time
     except:
         return None
@@ -249,6 +308,19 @@ def init_db():
             cursor.execute("ALTER TABLE group_messages ADD COLUMN reactions TEXT DEFAULT '{}' ")
         except Exception:
             pass
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_messages_group_ts ON group_messages (group_name, timestamp)")
+        # CHAT ARCHIVE: one zlib-compressed JSON payload per group and day
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS group_messages_archive (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_name TEXT NOT NULL,
+                day TEXT NOT NULL,
+                message_count INTEGER DEFAULT 0,
+                payload BLOB,
+                archived_at TEXT,
+                UNIQUE (group_name, day)
+            )
+        """)
         # HOLD TABLE: Add hold_tables table if not exists
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS hold_tables (
@@ -258,6 +330,16 @@ def init_db():
                 timestamp TEXT
             )
         """)
+        # MIGRATION: KPI tables are stored parsed, as a columnar blob
+        try:
+            cursor.execute("ALTER TABLE hold_tables ADD COLUMN table_blob BLOB")
+        except Exception:
+            pass
+        # MIGRATION: each upload is kept as a snapshot, stored as a delta against base_id
+        try:
+            cursor.execute("ALTER TABLE hold_tables ADD COLUMN base_id INTEGER")
+        except Exception:
+            pass
 
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS system_settings (
@@ -322,7 +404,24 @@ def init_db():
                 timestamp TEXT
             )
         """)
-        
+
+        cursor.execute(PRESENCE_TABLE_SQL)
+        cursor.execute(SCHEDULED_JOBS_SQL)
+
+        # BREAK BOOKINGS: one row per (date, agent, break type), plus per-slot counters
+        for statement in BREAK_BOOKING_SCHEMA_SQL:
+            cursor.execute(statement)
+
+        # BREAK TEMPLATE REGISTRY: templates, their slots and limits, agent assignments
+        for statement in BREAK_REGISTRY_SCHEMA_SQL:
+            cursor.execute(statement)
+        cursor.execute("""
+            SELECT EXISTS (SELECT 1 FROM break_bookings)
+               AND NOT EXISTS (SELECT 1 FROM break_slot_occupancy)
+        """)
+        if cursor.fetchone()[0]:
+            cursor.execute(REBUILD_SLOT_OCCUPANCY_SQL)
+
         # Create default admin account
         cursor.execute("""
             INSERT OR IGNORE INTO users (username, password, role) 
@@ -399,10 +498,124 @@ def toggle_chat_killswitch(enable):
     finally:
         conn.close()
 
+# --------------------------
+# Write Rate Limiting
+# --------------------------
+
+# action: (per-user burst, per-user refill per second, coalesce window in seconds)
+WRITE_RATE_LIMITS = {
+    "chat": (5, 0.5, 5),
+    "reaction": (10, 1.0, 1),
+    "request": (3, 0.05, 30),
+    "issue": (3, 0.05, 30),
+    "punch": (4, 0.2, 5),
+}
+GLOBAL_WRITE_RATE_LIMIT = (60, 20.0)  # burst and refill per second across all users
+
+class TokenBucket:
+    """Classic token bucket: holds up to `capacity` tokens, refilled at `refill_rate` per second"""
+
+    def __init__(self, capacity, refill_rate, clock=monotonic):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+
+    def has_token(self):
+        self._refill()
+        return self._tokens >= 1
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+class WriteRateLimiter:
+    """Per-user and global token buckets in front of user-triggered writes.
+
+    admit() returns "allowed", "coalesced" (an identical write from the same user
+    landed within the coalesce window, so the duplicate is dropped) or "rejected".
+    A write only counts as landed once the caller confirm()s it after committing,
+    so a retry of a failed write is never reported as a duplicate.
+    """
+
+    def __init__(self, limits=WRITE_RATE_LIMITS, global_limit=GLOBAL_WRITE_RATE_LIMIT, clock=monotonic):
+        self._limits = limits
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._global = TokenBucket(*global_limit, clock=clock)
+        self._buckets = {}
+        self._recent = {}
+        self._counters = {action: {"allowed": 0, "coalesced": 0, "rejected_user": 0, "rejected_global": 0}
+                          for action in limits}
+
+    def admit(self, action, username, payload=None):
+        capacity, refill_rate, coalesce_window = self._limits[action]
+        counters = self._counters[action]
+        with self._lock:
+            now = self._clock()
+            if payload is not None:
+                last = self._recent.get((action, username, payload))
+                if last is not None and now - last < coalesce_window:
+                    counters["coalesced"] += 1
+                    return "coalesced"
+
+            bucket = self._buckets.get((action, username))
+            if bucket is None:
+                bucket = self._buckets[(action, username)] = TokenBucket(capacity, refill_rate, clock=self._clock)
+            if not bucket.has_token():
+                counters["rejected_user"] += 1
+                return "rejected"
+            if not self._global.has_token():
+                counters["rejected_global"] += 1
+                return "rejected"
+            bucket.take()
+            self._global.take()
+            counters["allowed"] += 1
+            return "allowed"
+
+    def confirm(self, action, username, payload):
+        """Record an admitted write as committed, opening its coalesce window"""
+        with self._lock:
+            now = self._clock()
+            if len(self._recent) > 10000:
+                self._recent = {k: t for k, t in self._recent.items() if now - t < 60}
+            self._recent[(action, username, payload)] = now
+
+    def stats(self):
+        with self._lock:
+            return [{"Action": action, **counts} for action, counts in self._counters.items()]
+
+@st.cache_resource
+def get_write_rate_limiter():
+    """Process-wide write limiter shared by every session"""
+    return WriteRateLimiter()
+
+def rate_limit_write(action, username, payload=None):
+    """Admit a write through the limiter, warning the user when it is rejected"""
+    decision = get_write_rate_limiter().admit(action, username, payload)
+    if decision == "rejected":
+        st.warning("You're submitting too quickly. Please wait a few seconds and try again.")
+    return decision
+
+def confirm_write(action, username, payload):
+    """Tell the limiter a write admitted by rate_limit_write has been committed"""
+    get_write_rate_limiter().confirm(action, username, payload)
+
 def add_request(agent_name, request_type, identifier, comment, group_name=None):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
+
+    payload = (request_type, identifier, comment, group_name)
+    decision = rate_limit_write("request", agent_name, payload)
+    if decision != "allowed":
+        return decision == "coalesced"
         
     conn = get_db_connection()
     try:
@@ -427,6 +640,7 @@ def add_request(agent_name, request_type, identifier, comment, group_name=None):
         """, (request_id, agent_name, f"Request created: {comment}", timestamp))
         
         conn.commit()
+        confirm_write("request", agent_name, payload)
         return True
     finally:
         conn.close()
@@ -548,6 +762,11 @@ def send_group_message(sender, message, group_name=None):
     if is_killswitch_enabled() or is_chat_killswitch_enabled():
         st.error("Chat is currently locked. Please contact the developer.")
         return False
+
+    payload = (group_name, message)
+    decision = rate_limit_write("chat", sender, payload)
+    if decision != "allowed":
+        return decision == "coalesced"
         
     conn = get_db_connection()
     try:
@@ -565,6 +784,7 @@ def send_group_message(sender, message, group_name=None):
                 VALUES (?, ?, ?, ?, ?)
             """, (sender, message, get_casablanca_time(), ','.join(mentions), reactions_json))
         conn.commit()
+        confirm_write("chat", sender, payload)
         return True
     finally:
         conn.close()
@@ -595,6 +815,10 @@ def get_group_messages(group_name=None):
         conn.close()
 
 def add_reaction_to_message(message_id, emoji, username):
+    payload = (message_id, emoji)
+    decision = rate_limit_write("reaction", username, payload)
+    if decision != "allowed":
+        return decision == "coalesced"
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
@@ -613,6 +837,7 @@ def add_reaction_to_message(message_id, emoji, username):
             reactions[emoji].append(username)
         cursor.execute("UPDATE group_messages SET reactions = ? WHERE id = ?", (json.dumps(reactions), message_id))
         conn.commit()
+        confirm_write("reaction", username, payload)
         return True
     finally:
         conn.close()
@@ -622,7 +847,13 @@ def get_all_users(include_templates=False):
     try:
         cursor = conn.cursor()
         if include_templates:
-            cursor.execute("SELECT id, username, role, group_name, break_templates FROM users")
+            cursor.execute("""
+                SELECT u.id, u.username, u.role, u.group_name, GROUP_CONCAT(t.name, ',')
+                FROM users u
+                LEFT JOIN agent_templates a ON a.user_id = u.id
+                LEFT JOIN break_templates t ON t.id = a.template_id
+                GROUP BY u.id
+            """)
         else:
             cursor.execute("SELECT id, username, role, group_name FROM users")
         return cursor.fetchall()
@@ -660,21 +891,14 @@ def add_user(username, password, role, group_name=None, break_templates=None):
             pass
         try:
             if group_name is not None:
-                if break_templates is not None:
-                    break_templates_str = ','.join(break_templates) if isinstance(break_templates, list) else str(break_templates)
-                    cursor.execute("INSERT INTO users (username, password, role, group_name, break_templates) VALUES (?, ?, ?, ?, ?)",
-                                   (username, hash_password(password), role, group_name, break_templates_str))
-                else:
-                    cursor.execute("INSERT INTO users (username, password, role, group_name) VALUES (?, ?, ?, ?)",
-                                   (username, hash_password(password), role, group_name))
+                cursor.execute("INSERT INTO users (username, password, role, group_name) VALUES (?, ?, ?, ?)",
+                               (username, hash_password(password), role, group_name))
             else:
-                if break_templates is not None:
-                    break_templates_str = ','.join(break_templates) if isinstance(break_templates, list) else str(break_templates)
-                    cursor.execute("INSERT INTO users (username, password, role, break_templates) VALUES (?, ?, ?, ?)",
-                                   (username, hash_password(password), role, break_templates_str))
-                else:
-                    cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                                   (username, hash_password(password), role))
+                cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                               (username, hash_password(password), role))
+            if break_templates:
+                names = break_templates if isinstance(break_templates, list) else str(break_templates).split(',')
+                _assign_templates(cursor, cursor.lastrowid, [t.strip() for t in names if t.strip()])
             conn.commit()
             return True
         except sqlite3.IntegrityError:
@@ -691,6 +915,7 @@ def delete_user(user_id):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
+        cursor.execute("DELETE FROM agent_templates WHERE user_id = ?", (user_id,))
         cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
         conn.commit()
         return True
@@ -770,6 +995,351 @@ def clear_hold_images():
     finally:
         conn.close()
 
+# --------------------------
+# Live KPI Tables
+# --------------------------
+
+KPI_SNAPSHOT_KEYFRAME_EVERY = 10
+
+def _kpi_column_arrays(series):
+    """(kind, values, missing) for one column, in the form the blob stores"""
+    if pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+        return "number", series.to_numpy(), None
+    missing = series.isna().to_numpy()
+    values = series.to_numpy(dtype=str, na_value="")
+    return "text", values, missing
+
+def _kpi_changed_rows(kind, values, missing, base):
+    """Positions where a column differs from the same column of the base, or None if not comparable"""
+    base_kind, base_values, base_missing = base
+    if kind != base_kind or len(values) != len(base_values):
+        return None
+    if kind == "number":
+        if values.dtype != base_values.dtype:
+            return None
+        differs = values != base_values
+        if values.dtype.kind == "f":
+            differs &= ~(np.isnan(values) & np.isnan(base_values))
+    else:
+        differs = (values != base_values) | (missing != base_missing)
+    return np.flatnonzero(differs)
+
+def encode_kpi_table(df, base=None):
+    """Pack a parsed KPI table into a compressed columnar blob (np.savez_compressed).
+
+    Numeric and boolean columns keep their dtype; everything else is stored as
+    fixed-width unicode plus a missing-value mask, so the blob loads without pickle.
+    Given the previous snapshot as base, a column identical to the base column
+    of the same name is stored as a reference, and one with few changed rows as
+    just those rows, so a re-paste costs about what changed.
+    """
+    arrays = {"columns": np.array([str(column) for column in df.columns], dtype=str)}
+    kinds, modes = [], []
+    for i, column in enumerate(df.columns):
+        kind, values, missing = _kpi_column_arrays(df[column])
+        kinds.append(kind)
+        changed = None
+        if base is not None and column in base.columns:
+            changed = _kpi_changed_rows(kind, values, missing, _kpi_column_arrays(base[column]))
+        if changed is not None and len(changed) == 0:
+            modes.append("same")
+            continue
+        if changed is not None and len(changed) * 2 < len(values):
+            modes.append("patch")
+            arrays[f"p{i}"] = changed
+            values = values[changed]
+            missing = None if missing is None else missing[changed]
+        else:
+            modes.append("full")
+        arrays[f"c{i}"] = values
+        if missing is not None:
+            arrays[f"m{i}"] = missing
+    arrays["kinds"] = np.array(kinds, dtype=str)
+    arrays["modes"] = np.array(modes, dtype=str)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+def decode_kpi_table(blob, base=None):
+    """Rebuild the DataFrame stored by encode_kpi_table; base is required for delta blobs"""
+    with np.load(io.BytesIO(blob), allow_pickle=False) as arrays:
+        names = arrays["columns"].tolist()
+        kinds = arrays["kinds"].tolist()
+        modes = arrays["modes"].tolist() if "modes" in arrays.files else ["full"] * len(names)
+        columns = {}
+        for i, (column, kind, mode) in enumerate(zip(names, kinds, modes)):
+            if mode == "same":
+                columns[column] = base[column]
+                continue
+            values = arrays[f"c{i}"]
+            missing = arrays[f"m{i}"] if kind == "text" else None
+            if mode == "patch":
+                positions = arrays[f"p{i}"]
+                _, base_values, base_missing = _kpi_column_arrays(base[column])
+                values, patch = base_values.astype(np.result_type(base_values, values)), values
+                values[positions] = patch
+                if missing is not None:
+                    missing, patch = base_missing.copy(), missing
+                    missing[positions] = patch
+            if kind == "number":
+                columns[column] = values
+            else:
+                series = pd.Series(values.tolist(), dtype="str")
+                columns[column] = series.mask(missing) if missing.any() else series
+    return pd.DataFrame(columns)
+
+def add_hold_table(uploader, df):
+    """Store a parsed KPI table as a new snapshot; earlier snapshots are kept for trends.
+
+    Each snapshot is a delta against the previous one, except every
+    KPI_SNAPSHOT_KEYFRAME_EVERY-th, which is stored whole to keep the chain
+    a reader has to replay short.
+    """
+    latest = get_latest_hold_table()
+    base = load_hold_table(latest[0]) if latest else None
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT MAX(id) FROM hold_tables")
+        latest_id = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT COUNT(*) FROM hold_tables
+            WHERE id > COALESCE((SELECT MAX(id) FROM hold_tables WHERE base_id IS NULL), 0)
+        """)
+        chain_length = cursor.fetchone()[0]
+        if latest is None or latest_id != latest[0] or chain_length + 1 >= KPI_SNAPSHOT_KEYFRAME_EVERY:
+            base_id, blob = None, encode_kpi_table(df)
+        else:
+            base_id, blob = latest[0], encode_kpi_table(df, base)
+        cursor.execute(
+            "INSERT INTO hold_tables (uploader, table_blob, base_id, timestamp) VALUES (?, ?, ?, ?)",
+            (uploader, blob, base_id, get_casablanca_time())
+        )
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+KPI_UPLOAD_MAX_BYTES = 25 * 1024 * 1024
+KPI_UPLOAD_MAX_ROWS = 250_000
+KPI_SNIFF_BYTES = 64 * 1024
+KPI_CHUNK_ROWS = 20_000
+
+def sniff_kpi_delimiter(sample):
+    """Guess the delimiter of a pasted or uploaded table from its first lines"""
+    lines = sample.splitlines()[:50]
+    if len(lines) > 1 and not sample.endswith(("\n", "\r")):
+        lines = lines[:-1]  # the sample may stop mid-line
+    try:
+        return csv.Sniffer().sniff("\n".join(lines), delimiters="\t,;|").delimiter
+    except csv.Error:
+        header = lines[0] if lines else ""
+        return max("\t,;|", key=header.count) if any(d in header for d in "\t,;|") else ","
+
+def ingest_kpi_table(source, size=None, progress=None):
+    """Parse a pasted (str) or uploaded (binary file) KPI table in chunks with the C parser.
+
+    The delimiter is sniffed from the first KPI_SNIFF_BYTES; size and row
+    limits are enforced before and while parsing, and progress(fraction) is
+    called after each chunk. Columns that mix numbers and text end up as text.
+    Raises ValueError for empty or oversized input.
+    """
+    if isinstance(source, str):
+        size = len(source.encode("utf-8"))
+        total = len(source)
+        sample = source[:KPI_SNIFF_BYTES]
+        stream = io.StringIO(source)
+        options = {}
+    else:
+        size = total = size if size is not None else len(source.getbuffer())
+        sample = source.read(KPI_SNIFF_BYTES).decode("utf-8-sig", errors="replace")
+        source.seek(0)
+        stream = source
+        options = {"encoding": "utf-8-sig", "encoding_errors": "replace"}
+    if not sample.strip():
+        raise ValueError("The table is empty.")
+    if size > KPI_UPLOAD_MAX_BYTES:
+        raise ValueError(f"The table is {size / 1024 / 1024:.1f} MB; the limit is {KPI_UPLOAD_MAX_BYTES // 1024 // 1024} MB.")
+
+    chunks = []
+    rows = 0
+    reader = pd.read_csv(stream, sep=sniff_kpi_delimiter(sample), engine="c", chunksize=KPI_CHUNK_ROWS,
+                         skip_blank_lines=True, **options)
+    with reader:
+        for chunk in reader:
+            rows += len(chunk)
+            if rows > KPI_UPLOAD_MAX_ROWS:
+                raise ValueError(f"The table has more than {KPI_UPLOAD_MAX_ROWS:,} rows.")
+            chunks.append(chunk)
+            if progress:
+                progress(min(stream.tell() / max(total, 1), 1.0))
+    if rows == 0:
+        raise ValueError("The table has a header but no rows.")
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype("str")
+    return df
+
+def get_latest_hold_table():
+    """(id, uploader, timestamp) of the current KPI table, or None"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, uploader, timestamp FROM hold_tables ORDER BY id DESC LIMIT 1")
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+@st.cache_resource(max_entries=KPI_SNAPSHOT_KEYFRAME_EVERY + 2)
+def load_hold_table(table_id):
+    """Parsed KPI table for an id, decoded once per process and shared by every session.
+
+    A stored snapshot never changes under its id, so the cache needs no
+    invalidation. Delta snapshots are applied to their base, which is served
+    from this same cache. Sessions get the same frame and must treat it as
+    read-only; with copy-on-write, anything they derive from it is their own.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT table_blob, base_id, table_data FROM hold_tables WHERE id = ?", (table_id,))
+        row = cursor.fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    table_blob, base_id, table_data = row
+    if table_blob is not None:
+        return decode_kpi_table(table_blob, load_hold_table(base_id) if base_id else None)
+    # Tables saved before the columnar format are still CSV text
+    return pd.read_csv(io.StringIO(table_data or ""))
+
+def get_hold_table_snapshots():
+    """[(id, uploader, timestamp)] for every stored KPI snapshot, oldest first"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, uploader, timestamp FROM hold_tables ORDER BY id")
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def get_hold_table_storage():
+    """(snapshots, stored bytes) of the KPI snapshot store"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(LENGTH(table_blob)), 0) + COALESCE(SUM(LENGTH(table_data)), 0)
+            FROM hold_tables
+        """)
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+def kpi_key_column(df):
+    """The column naming the agent on each row: the first header mentioning agent or name, else the first text column"""
+    text_columns = [column for column in df.columns if not pd.api.types.is_numeric_dtype(df[column].dtype)]
+    for column in text_columns:
+        if "agent" in str(column).lower() or "name" in str(column).lower():
+            return column
+    return text_columns[0] if text_columns else None
+
+def kpi_trend(snapshots, metric, agents=None, load=load_hold_table):
+    """One metric per agent across snapshots, a row per snapshot time and a column per agent.
+
+    snapshots is [(id, timestamp)]. Each one contributes its (agent, value)
+    pairs from the shared cache; a single concat and pivot line them up.
+    """
+    parts = []
+    for table_id, timestamp in snapshots:
+        df = load(table_id)
+        key = None if df is None else kpi_key_column(df)
+        if key is None or metric not in df.columns:
+            continue
+        parts.append(pd.DataFrame({
+            "Snapshot": timestamp,
+            "Agent": df[key],
+            metric: pd.to_numeric(df[metric], errors="coerce")
+        }))
+    if not parts:
+        return pd.DataFrame()
+    history = pd.concat(parts, ignore_index=True)
+    if agents:
+        history = history[history["Agent"].isin(agents)]
+    return history.pivot_table(index="Snapshot", columns="Agent", values=metric, aggfunc="mean")
+
+KPI_SEARCH_SEPARATOR = "\x1f"
+
+class KpiSearchIndex:
+    """Search structures for one KPI table, built once and shared like the table.
+
+    Every row is joined into one lowercase string, so a substring search is a
+    single vectorized str.contains. Text cells also go into an exact-match map
+    that find_rows uses to pick out one agent's own row by name.
+    """
+
+    def __init__(self, df):
+        texts = [df[column].astype(str).str.lower().where(df[column].notna(), "") for column in df.columns]
+        if texts:
+            self.rows = texts[0].str.cat(texts[1:], sep=KPI_SEARCH_SEPARATOR)
+        else:
+            self.rows = pd.Series([], dtype="str")
+        self.exact = {}
+        for column, text in zip(df.columns, texts):
+            if pd.api.types.is_numeric_dtype(df[column].dtype):
+                continue
+            keys = text.str.strip().reset_index(drop=True)
+            for value, positions in keys.groupby(keys).indices.items():
+                if value:
+                    known = self.exact.get(value)
+                    self.exact[value] = positions if known is None else np.union1d(known, positions)
+
+    def search(self, query):
+        """Row positions with query anywhere in a cell, case-insensitive"""
+        needle = query.lower()
+        if not needle.strip():
+            return np.arange(len(self.rows))
+        return np.flatnonzero(self.rows.str.contains(needle, regex=False).to_numpy())
+
+    def find_rows(self, value):
+        """Row positions with a text cell equal to value, case-insensitive"""
+        return self.exact.get(str(value).strip().lower(), np.array([], dtype=np.intp))
+
+@st.cache_resource(max_entries=4)
+def get_kpi_search_index(table_id):
+    df = load_hold_table(table_id)
+    return None if df is None else KpiSearchIndex(df)
+
+def search_hold_table(table_id, query):
+    """Rows of a KPI table matching a search box query; empty if the table was cleared"""
+    df = load_hold_table(table_id)
+    if df is None:
+        return pd.DataFrame()
+    return df.iloc[get_kpi_search_index(table_id).search(query)]
+
+def find_own_kpi_rows(table_id, username):
+    """Rows of a KPI table whose agent cell is exactly username; empty if the table was cleared"""
+    df = load_hold_table(table_id)
+    if df is None:
+        return pd.DataFrame()
+    return df.iloc[get_kpi_search_index(table_id).find_rows(username)]
+
+def clear_hold_tables():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM hold_tables")
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
 def clear_all_requests():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
@@ -808,15 +1378,309 @@ def clear_all_group_messages():
     try:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM group_messages")
+        cursor.execute("DELETE FROM group_messages_archive")
         conn.commit()
         return True
     finally:
         conn.close()
 
+# --------------------------
+# Chat Archive (cold storage)
+# --------------------------
+
+CHAT_RETENTION_DAYS = 7
+ARCHIVE_MESSAGE_FIELDS = ["id", "sender", "message", "timestamp", "mentions", "group_name", "reactions"]
+
+def compress_archive_payload(rows):
+    """Serialize a list of row lists into a compact zlib-compressed JSON blob"""
+    return zlib.compress(json.dumps(rows, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 6)
+
+def decompress_archive_payload(blob):
+    """Inverse of compress_archive_payload; returns [] for empty or corrupt blobs"""
+    if not blob:
+        return []
+    try:
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+    except Exception:
+        return []
+
+def archive_old_group_messages(max_age_days=CHAT_RETENTION_DAYS):
+    """Move messages older than max_age_days out of group_messages into the per-day archive.
+
+    Runs as a single transaction so a message is always in exactly one of the two tables.
+    Returns the number of messages archived.
+    """
+    cutoff = (casablanca_now() - timedelta(days=max_age_days)).strftime("%Y-%m-%d 00:00:00")
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"""
+            SELECT {', '.join(ARCHIVE_MESSAGE_FIELDS)} FROM group_messages
+            WHERE timestamp < ?
+            ORDER BY timestamp ASC, id ASC
+        """, (cutoff,))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+
+        buckets = {}
+        for row in rows:
+            key = (row[5] or "", (row[3] or "")[:10])
+            buckets.setdefault(key, []).append(list(row))
+
+        archived_at = get_casablanca_time()
+        for (group_name, day), day_rows in buckets.items():
+            cursor.execute(
+                "SELECT payload FROM group_messages_archive WHERE group_name = ? AND day = ?",
+                (group_name, day)
+            )
+            existing = cursor.fetchone()
+            merged = (decompress_archive_payload(existing[0]) if existing else []) + day_rows
+            cursor.execute("""
+                INSERT INTO group_messages_archive (group_name, day, message_count, payload, archived_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(group_name, day) DO UPDATE SET
+                    message_count = excluded.message_count,
+                    payload = excluded.payload,
+                    archived_at = excluded.archived_at
+            """, (group_name, day, len(merged), compress_archive_payload(merged), archived_at))
+
+        cursor.execute("DELETE FROM group_messages WHERE timestamp < ?", (cutoff,))
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _archive_row_to_message(row):
+    msg = dict(zip(ARCHIVE_MESSAGE_FIELDS, row))
+    try:
+        msg['reactions'] = json.loads(msg['reactions']) if msg.get('reactions') else {}
+    except Exception:
+        msg['reactions'] = {}
+    return msg
+
+def get_chat_history_days(group_name):
+    """List the days (newest first) with messages for a group, hot or archived"""
+    if group_name is None or str(group_name).strip() == "":
+        return []
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT substr(timestamp, 1, 10) FROM group_messages WHERE group_name = ?
+            UNION
+            SELECT day FROM group_messages_archive WHERE group_name = ?
+            ORDER BY 1 DESC
+        """, (group_name, group_name))
+        return [row[0] for row in cursor.fetchall() if row[0]]
+    finally:
+        conn.close()
+
+def get_group_message_history(group_name, day):
+    """Get all messages of a group for one day (oldest first), from the hot table or the archive"""
+    if group_name is None or str(group_name).strip() == "":
+        return []
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT payload FROM group_messages_archive WHERE group_name = ? AND day = ?",
+            (group_name, day)
+        )
+        row = cursor.fetchone()
+        messages = [_archive_row_to_message(r) for r in decompress_archive_payload(row[0])] if row else []
+        cursor.execute(f"""
+            SELECT {', '.join(ARCHIVE_MESSAGE_FIELDS)} FROM group_messages
+            WHERE group_name = ? AND timestamp BETWEEN ? AND ?
+            ORDER BY timestamp ASC, id ASC
+        """, (group_name, f"{day} 00:00:00", f"{day} 23:59:59"))
+        messages.extend(_archive_row_to_message(r) for r in cursor.fetchall())
+        return messages
+    finally:
+        conn.close()
+
+def search_group_message_history(group_name, query, limit=100):
+    """Case-insensitive search over a group's hot and archived messages (newest first)"""
+    if group_name is None or str(group_name).strip() == "" or not query:
+        return []
+    needle = query.lower()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join(ARCHIVE_MESSAGE_FIELDS)} FROM group_messages
+            WHERE group_name = ? AND (LOWER(message) LIKE ? OR LOWER(sender) LIKE ?)
+            ORDER BY timestamp DESC LIMIT ?
+        """, (group_name, f"%{needle}%", f"%{needle}%", limit))
+        results = [_archive_row_to_message(r) for r in cursor.fetchall()]
+        if len(results) >= limit:
+            return results
+
+        cursor.execute(
+            "SELECT payload FROM group_messages_archive WHERE group_name = ? ORDER BY day DESC",
+            (group_name,)
+        )
+        for (payload,) in cursor:
+            for r in reversed(decompress_archive_payload(payload)):
+                if needle in (r[2] or "").lower() or needle in (r[1] or "").lower():
+                    results.append(_archive_row_to_message(r))
+                    if len(results) >= limit:
+                        return results
+        return results
+    finally:
+        conn.close()
+
+def get_chat_archive_stats():
+    """Return (hot message count, archived message count, archived compressed bytes)"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM group_messages")
+        hot = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(SUM(message_count), 0), COALESCE(SUM(LENGTH(payload)), 0) FROM group_messages_archive")
+        archived, archived_bytes = cursor.fetchone()
+        return hot, archived, archived_bytes
+    finally:
+        conn.close()
+
+# --------------------------
+# Presence Tracking
+# --------------------------
+
+PRESENCE_FLUSH_INTERVAL = 5   # seconds between batched presence writes
+PRESENCE_ONLINE_WINDOW = 90   # seconds; agents rerun every 60 s, admins every 15 s
+PRESENCE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS user_presence (
+        username TEXT NOT NULL,
+        section TEXT NOT NULL,
+        group_name TEXT,
+        last_seen TEXT,
+        PRIMARY KEY (username, section)
+    )
+"""
+
+class PresenceTracker:
+    """Coalesces session heartbeats in memory and flushes them in one batched write.
+
+    Each (username, section) keeps only its latest heartbeat, so the number of
+    writes depends on the flush interval rather than on the number of sessions.
+    """
+
+    def __init__(self, connect=None, flush_interval=PRESENCE_FLUSH_INTERVAL, clock=monotonic):
+        self._connect = connect or get_db_connection
+        self._flush_interval = flush_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = clock()
+        self.heartbeat_count = 0
+        self.flush_count = 0
+
+    def heartbeat(self, username, section, group_name=None, seen_at=None):
+        if not username:
+            return
+        with self._lock:
+            self._pending[(username, section)] = (group_name, seen_at or get_casablanca_time())
+            self.heartbeat_count += 1
+            due = self._clock() - self._last_flush >= self._flush_interval
+        if due:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Write all pending heartbeats in a single transaction; returns rows written"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._last_flush = self._clock()
+        if not batch:
+            return 0
+        conn = self._connect()
+        try:
+            conn.executemany("""
+                INSERT INTO user_presence (username, section, group_name, last_seen)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(username, section) DO UPDATE SET
+                    group_name = excluded.group_name,
+                    last_seen = MAX(user_presence.last_seen, excluded.last_seen)
+            """, [(u, sec, g, seen) for (u, sec), (g, seen) in batch.items()])
+            conn.commit()
+            with self._lock:
+                self.flush_count += 1
+            return len(batch)
+        except Exception:
+            # Put the batch back so the next flush retries it (newer heartbeats win)
+            with self._lock:
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+            return 0
+        finally:
+            conn.close()
+
+@st.cache_resource
+def get_presence_tracker():
+    """Process-wide presence tracker shared by every session"""
+    return PresenceTracker()
+
+def get_user_group(username):
+    """Look up a user's group name"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT group_name FROM users WHERE username = ?", (username,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def get_online_users_by_group(window_seconds=PRESENCE_ONLINE_WINDOW):
+    """Return {group_name: [(username, section, last_seen), ...]} for users seen within the window.
+
+    Heartbeats still waiting for the next flush are merged in, so the view is never stale.
+    """
+    cutoff = (casablanca_now() - timedelta(seconds=window_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+    latest = {}
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT username, section, group_name, last_seen FROM user_presence WHERE last_seen >= ?",
+            (cutoff,)
+        )
+        for username, section, group_name, last_seen in cursor.fetchall():
+            latest[(username, section)] = (group_name, last_seen)
+    finally:
+        conn.close()
+    for key, (group_name, last_seen) in get_presence_tracker().pending().items():
+        if last_seen >= cutoff and last_seen >= latest.get(key, (None, ""))[1]:
+            latest[key] = (group_name, last_seen)
+
+    # Keep only the most recent section per user
+    per_user = {}
+    for (username, section), (group_name, last_seen) in latest.items():
+        if username not in per_user or last_seen > per_user[username][2]:
+            per_user[username] = (group_name, section, last_seen)
+    online = {}
+    for username, (group_name, section, last_seen) in sorted(per_user.items()):
+        online.setdefault(group_name or "No group", []).append((username, section, last_seen))
+    return online
+
 def add_late_login(agent_name, presence_time, login_time, reason):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
+
+    payload = ("late_login", presence_time, login_time, reason)
+    decision = rate_limit_write("issue", agent_name, payload)
+    if decision != "allowed":
+        return decision == "coalesced"
         
     conn = get_db_connection()
     try:
@@ -826,6 +1690,7 @@ def add_late_login(agent_name, presence_time, login_time, reason):
             VALUES (?, ?, ?, ?, ?)
         """, (agent_name, presence_time, login_time, reason, get_casablanca_time()))
         conn.commit()
+        confirm_write("issue", agent_name, payload)
         return True
     finally:
         conn.close()
@@ -843,6 +1708,11 @@ def add_quality_issue(agent_name, issue_type, timing, mobile_number, product):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
+
+    payload = ("quality", issue_type, timing, mobile_number, product)
+    decision = rate_limit_write("issue", agent_name, payload)
+    if decision != "allowed":
+        return decision == "coalesced"
         
     conn = get_db_connection()
     try:
@@ -852,6 +1722,7 @@ def add_quality_issue(agent_name, issue_type, timing, mobile_number, product):
             VALUES (?, ?, ?, ?, ?, ?)
         """, (agent_name, issue_type, timing, mobile_number, product, get_casablanca_time()))
         conn.commit()
+        confirm_write("issue", agent_name, payload)
         return True
     finally:
         conn.close()
@@ -871,6 +1742,11 @@ def add_midshift_issue(agent_name, issue_type, start_time, end_time):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
+
+    payload = ("midshift", issue_type, start_time, end_time)
+    decision = rate_limit_write("issue", agent_name, payload)
+    if decision != "allowed":
+        return decision == "coalesced"
         
     conn = get_db_connection()
     try:
@@ -880,6 +1756,7 @@ def add_midshift_issue(agent_name, issue_type, start_time, end_time):
             VALUES (?, ?, ?, ?, ?)
         """, (agent_name, issue_type, start_time, end_time, get_casablanca_time()))
         conn.commit()
+        confirm_write("issue", agent_name, payload)
         return True
     finally:
         conn.close()
@@ -1057,15 +1934,107 @@ def get_vip_messages():
 # Break Scheduling Functions (from first code)
 # --------------------------
 
+BREAK_TYPES = ["lunch", "early_tea", "late_tea"]
+BREAK_DURATIONS = {"lunch": 30, "early_tea": 15, "late_tea": 15}
+SHIFT_START_MINUTE = 15 * 60  # LM US ENG 3:00 PM shift; break times are measured from here
+DEFAULT_SLOT_LIMITS = {"lunch": 5, "early_tea": 3, "late_tea": 3}
+DEFAULT_BREAK_TEMPLATE = {
+    "lunch_breaks": ["19:30", "20:00", "20:30", "21:00", "21:30"],
+    "tea_breaks": {
+        "early": ["16:00", "16:15", "16:30", "16:45", "17:00", "17:15", "17:30"],
+        "late": ["21:45", "22:00", "22:15", "22:30"]
+    }
+}
+
+BREAK_BOOKING_SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS break_bookings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        agent TEXT NOT NULL,
+        break_type TEXT NOT NULL,
+        slot TEXT NOT NULL,
+        template TEXT,
+        booked_at TEXT,
+        UNIQUE (date, agent, break_type)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_break_bookings_slot ON break_bookings (date, break_type, slot)",
+    # Booked count per slot, kept in step with break_bookings
+    """
+    CREATE TABLE IF NOT EXISTS break_slot_occupancy (
+        date TEXT NOT NULL,
+        template TEXT NOT NULL,
+        break_type TEXT NOT NULL,
+        slot TEXT NOT NULL,
+        booked INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, template, break_type, slot)
+    )
+    """,
+    # Past days, one compressed partition per date
+    """
+    CREATE TABLE IF NOT EXISTS break_bookings_archive (
+        date TEXT PRIMARY KEY,
+        booking_count INTEGER NOT NULL,
+        payload BLOB NOT NULL,
+        archived_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS break_day_rollovers (
+        date TEXT PRIMARY KEY,
+        rolled_at TEXT NOT NULL,
+        archived_days INTEGER DEFAULT 0,
+        archived_rows INTEGER DEFAULT 0,
+        purged_rows INTEGER DEFAULT 0
+    )
+    """,
+    # Most agents of a group (or of the whole floor, scope '*') away at the same minute
+    """
+    CREATE TABLE IF NOT EXISTS break_floor_caps (
+        scope TEXT PRIMARY KEY,
+        max_away INTEGER NOT NULL,
+        updated_at TEXT,
+        updated_by TEXT
+    )
+    """,
+    # When agents actually left and came back; rows are never changed or removed
+    """
+    CREATE TABLE IF NOT EXISTS break_punches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        agent TEXT NOT NULL,
+        break_type TEXT NOT NULL,
+        event TEXT NOT NULL CHECK(event IN ('start', 'end')),
+        minute INTEGER NOT NULL,
+        punched_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_break_punches_date ON break_punches (date, id)",
+    """
+    CREATE TRIGGER IF NOT EXISTS break_punches_no_update BEFORE UPDATE ON break_punches
+    BEGIN SELECT RAISE(ABORT, 'break_punches is append-only'); END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS break_punches_no_delete BEFORE DELETE ON break_punches
+    BEGIN SELECT RAISE(ABORT, 'break_punches is append-only'); END
+    """
+]
+
+REBUILD_SLOT_OCCUPANCY_SQL = """
+    INSERT INTO break_slot_occupancy (date, template, break_type, slot, booked)
+    SELECT date, COALESCE(template, 'Default Template'), break_type, slot, COUNT(*)
+    FROM break_bookings
+    GROUP BY date, COALESCE(template, 'Default Template'), break_type, slot
+"""
+
 def init_break_session_state():
     if 'templates' not in st.session_state:
         st.session_state.templates = {}
     if 'current_template' not in st.session_state:
         st.session_state.current_template = None
-    if 'agent_bookings' not in st.session_state:
-        st.session_state.agent_bookings = {}
     if 'selected_date' not in st.session_state:
-        st.session_state.selected_date = datetime.now().strftime('%Y-%m-%d')
+        st.session_state.selected_date = booking_date()
     if 'timezone_offset' not in st.session_state:
         st.session_state.timezone_offset = 0  # GMT by default
     if 'break_limits' not in st.session_state:
@@ -1073,146 +2042,585 @@ def init_break_session_state():
     if 'active_templates' not in st.session_state:
         st.session_state.active_templates = []
     
-    # Load data from files if exists
-    if os.path.exists('templates.json'):
-        with open('templates.json', 'r') as f:
-            st.session_state.templates = json.load(f)
-    if os.path.exists('break_limits.json'):
-        with open('break_limits.json', 'r') as f:
-            st.session_state.break_limits = json.load(f)
-    if os.path.exists('all_bookings.json'):
-        with open('all_bookings.json', 'r') as f:
-            st.session_state.agent_bookings = json.load(f)
-    if os.path.exists('active_templates.json'):
-        with open('active_templates.json', 'r') as f:
-            st.session_state.active_templates = json.load(f)
-
-def adjust_template_time(time_str, hours):
-    """Adjust a single time string by adding/subtracting hours"""
-    try:
-        if not time_str.strip():
-            return ""
-        time_obj = datetime.strptime(time_str.strip(), "%H:%M")
-        adjusted_time = (time_obj + timedelta(hours=hours)).time()
-        return adjusted_time.strftime("%H:%M")
-    except:
-        return time_str
+    # Point at the process-wide registry views; slots are only re-read when a version changes
+    registry = get_break_registry()
+    registry.refresh()
+    st.session_state.templates, st.session_state.break_limits, st.session_state.active_templates = registry.views()
 
-def bulk_update_template_times(hours):
-    """Update all template times by adding/subtracting hours"""
-    if 'templates' not in st.session_state:
-        return False
-    
-    try:
-        for template_name in st.session_state.templates:
-            template = st.session_state.templates[template_name]
-            
-            # Update lunch breaks
-            template["lunch_breaks"] = [
-                adjust_template_time(t, hours) 
-                for t in template["lunch_breaks"]
-            ]
-            
-            # Update early tea breaks
-            template["tea_breaks"]["early"] = [
-                adjust_template_time(t, hours) 
-                for t in template["tea_breaks"]["early"]
-            ]
-            
-            # Update late tea breaks
-            template["tea_breaks"]["late"] = [
-                adjust_template_time(t, hours) 
-                for t in template["tea_breaks"]["late"]
-            ]
-        
-        save_break_data()
-        return True
-    except Exception as e:
-        st.error(f"Error updating template times: {str(e)}")
-        return False
+# --------------------------
+# Compiled Break Templates
+# --------------------------
 
-def save_break_data():
-    """Persist break-related data atomically and return True on success."""
-    try:
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        os.makedirs(current_dir, exist_ok=True)
-
-        temp_files = []
-        def write_tmp(filename, data):
-            tmp_path = os.path.join(current_dir, filename + '.tmp')
-            with open(tmp_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            temp_files.append((tmp_path, os.path.join(current_dir, filename)))
-
-        # Queue writes
-        write_tmp('all_bookings.json', st.session_state.agent_bookings)
-        write_tmp('templates.json', st.session_state.get('templates', {}))
-        write_tmp('break_limits.json', st.session_state.get('break_limits', {}))
-        write_tmp('active_templates.json', st.session_state.get('active_templates', []))
-
-        # Atomic replace
-        for tmp_path, final_path in temp_files:
-            os.replace(tmp_path, final_path)
+BREAK_TIME_PATTERN = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+MINUTES_PER_DAY = 24 * 60
+BREAK_TYPE_LABELS = {"lunch": "Lunch", "early_tea": "Early tea", "late_tea": "Late tea"}
+
+def parse_break_time(text):
+    """Strict HH:MM to minutes since midnight; raises ValueError for anything else"""
+    match = BREAK_TIME_PATTERN.match(str(text).strip())
+    if not match:
+        raise ValueError(f"'{text}' is not a valid HH:MM time")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+def format_break_minutes(minutes):
+    minutes = int(minutes) % MINUTES_PER_DAY
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def _order_by_shift(minutes, limits):
+    """Sort slots by minutes since shift start, so 23:45 comes before 00:15"""
+    order = np.argsort((minutes.astype(np.int32) - SHIFT_START_MINUTE) % MINUTES_PER_DAY, kind="stable")
+    return minutes[order], limits[order]
+
+class CompiledTemplate:
+    """A break template as integer-minute arrays, one per break type.
+
+    minutes[break_type] is sorted by shift order and limits[break_type] lines up
+    with it. HH:MM strings are only produced when something is displayed or saved.
+    problems lists entries dropped while compiling a stored template.
+    """
+
+    def __init__(self, name, minutes, limits, problems=()):
+        self.name = name
+        self.minutes = minutes
+        self.limits = limits
+        self.problems = list(problems)
+        self._index = {
+            break_type: {int(m): i for i, m in enumerate(values)}
+            for break_type, values in minutes.items()
+        }
 
-        return True
-    except Exception as e:
-        try:
-            st.error(f"Error saving break data: {str(e)}")
-        except Exception:
-            pass
-        return False
+    def slot_strings(self, break_type):
+        return [format_break_minutes(m) for m in self.minutes[break_type]]
 
-def adjust_time(time_str, offset):
-    try:
-        if not time_str.strip():
-            return ""
-        time_obj = datetime.strptime(time_str.strip(), "%H:%M")
-        adjusted_time = (time_obj + timedelta(hours=offset)).time()
-        return adjusted_time.strftime("%H:%M")
-    except:
-        return time_str
+    def slots(self):
+        return {break_type: self.slot_strings(break_type) for break_type in BREAK_TYPES}
 
-def adjust_template_times(template, offset):
-    """Safely adjust template times with proper error handling"""
-    try:
-        if not template or not isinstance(template, dict):
-            return {
-                "lunch_breaks": [],
-                "tea_breaks": {"early": [], "late": []}
-            }
-            
-        adjusted_template = {
-            "lunch_breaks": [adjust_time(t, offset) for t in template.get("lunch_breaks", [])],
-            "tea_breaks": {
-                "early": [adjust_time(t, offset) for t in template.get("tea_breaks", {}).get("early", [])],
-                "late": [adjust_time(t, offset) for t in template.get("tea_breaks", {}).get("late", [])]
-            }
+    def limit(self, break_type, slot):
+        try:
+            i = self._index[break_type].get(parse_break_time(slot))
+        except ValueError:
+            i = None
+        return int(self.limits[break_type][i]) if i is not None else DEFAULT_SLOT_LIMITS[break_type]
+
+    def to_template(self):
+        slots = self.slots()
+        return {
+            "lunch_breaks": slots["lunch"],
+            "tea_breaks": {"early": slots["early_tea"], "late": slots["late_tea"]}
         }
-        return adjusted_template
-    except Exception as e:
-        st.error(f"Error adjusting template times: {str(e)}")
+
+    def to_limits(self):
         return {
-            "lunch_breaks": [],
-            "tea_breaks": {"early": [], "late": []}
+            break_type: {format_break_minutes(m): int(n) for m, n in zip(self.minutes[break_type], self.limits[break_type])}
+            for break_type in BREAK_TYPES
         }
 
-def count_bookings(date, break_type, time_slot):
-    count = 0
-    if date in st.session_state.agent_bookings:
-        for agent_id, breaks in st.session_state.agent_bookings[date].items():
-            if break_type == "lunch" and "lunch" in breaks and isinstance(breaks["lunch"], dict) and breaks["lunch"].get("time") == time_slot:
-                count += 1
-            elif break_type == "early_tea" and "early_tea" in breaks and isinstance(breaks["early_tea"], dict) and breaks["early_tea"].get("time") == time_slot:
-                count += 1
-            elif break_type == "late_tea" and "late_tea" in breaks and isinstance(breaks["late_tea"], dict) and breaks["late_tea"].get("time") == time_slot:
-                count += 1
-    return count
+def compile_template(name, template, limits=None, strict=True):
+    """Parse and validate a template dict (and its limits) into a CompiledTemplate.
+
+    With strict, any malformed or duplicate time raises ValueError listing every
+    problem; otherwise bad entries are dropped and kept in .problems.
+    """
+    limits = limits or {}
+    problems, minutes, slot_limits = [], {}, {}
+    for break_type, texts in template_slot_lists(template).items():
+        values, counts, seen = [], [], set()
+        for text in texts:
+            try:
+                m = parse_break_time(text)
+            except ValueError as e:
+                problems.append(f"{BREAK_TYPE_LABELS[break_type]}: {e}")
+                continue
+            if m in seen:
+                problems.append(f"{BREAK_TYPE_LABELS[break_type]}: {format_break_minutes(m)} is listed twice")
+                continue
+            seen.add(m)
+            values.append(m)
+            type_limits = limits.get(break_type, {})
+            counts.append(type_limits.get(text, type_limits.get(format_break_minutes(m), DEFAULT_SLOT_LIMITS[break_type])))
+        minutes[break_type], slot_limits[break_type] = _order_by_shift(
+            np.array(values, dtype=np.int16), np.array(counts, dtype=np.int32)
+        )
+    if strict and problems:
+        raise ValueError("; ".join(problems))
+    return CompiledTemplate(name, minutes, slot_limits, problems)
+
+def shift_compiled_templates(compiled, delta_minutes):
+    """Move every slot of every template by delta_minutes, wrapping at midnight.
+
+    All templates are shifted with one array addition; limits travel with their slots.
+    """
+    pieces = [(name, break_type) for name in compiled for break_type in BREAK_TYPES]
+    if not pieces:
+        return {}
+    arrays = [compiled[name].minutes[break_type] for name, break_type in pieces]
+    sizes = np.cumsum([len(a) for a in arrays])[:-1]
+    moved = (np.concatenate(arrays).astype(np.int32) + delta_minutes) % MINUTES_PER_DAY
+    shifted = {name: ({}, {}) for name in compiled}
+    for (name, break_type), values in zip(pieces, np.split(moved.astype(np.int16), sizes)):
+        shifted[name][0][break_type], shifted[name][1][break_type] = _order_by_shift(
+            values, compiled[name].limits[break_type]
+        )
+    return {
+        name: CompiledTemplate(name, minutes, limits, compiled[name].problems)
+        for name, (minutes, limits) in shifted.items()
+    }
 
-def display_schedule(template):
-    st.header("LM US ENG 3:00 PM shift")
-    
-    # Lunch breaks table
-    st.markdown("### LUNCH BREAKS")
+# --------------------------
+# Break Template Registry
+# --------------------------
+
+BREAK_REGISTRY_SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS break_templates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        is_active INTEGER NOT NULL DEFAULT 0,
+        version INTEGER NOT NULL,
+        updated_at TEXT,
+        updated_by TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS template_slots (
+        template_id INTEGER NOT NULL,
+        break_type TEXT NOT NULL,
+        minute INTEGER NOT NULL,
+        slot_limit INTEGER NOT NULL,
+        PRIMARY KEY (template_id, break_type, minute)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS agent_templates (
+        user_id INTEGER NOT NULL,
+        template_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, template_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_agent_templates_template ON agent_templates (template_id)"
+]
+
+class BreakTemplateRegistry:
+    """Process-wide cache of the break template registry.
+
+    Keeps one CompiledTemplate per template plus the dict views sessions read.
+    refresh() costs one small query for (id, name, version, active); slots are only
+    re-read and recompiled for templates whose version stamp changed.
+    """
+
+    def __init__(self, connect=get_db_connection):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._key = None
+        self._entries = {}
+        self._views = ({}, {}, [])
+        self.refreshes = 0
+        self.unchanged = 0
+        self.recompiled = 0
+
+    def refresh(self):
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, version, is_active FROM break_templates ORDER BY id")
+            rows = cursor.fetchall()
+            with self._lock:
+                self.refreshes += 1
+                if rows == self._key:
+                    self.unchanged += 1
+                    return
+                stale = [row for row in rows if self._entries.get(row[1], (None, None))[1] != row[2]]
+            slot_rows = {}
+            if stale:
+                placeholders = ",".join("?" * len(stale))
+                cursor.execute(f"""
+                    SELECT template_id, break_type, minute, slot_limit FROM template_slots
+                    WHERE template_id IN ({placeholders})
+                """, [row[0] for row in stale])
+                for template_id, break_type, minute, slot_limit in cursor.fetchall():
+                    slot_rows.setdefault(template_id, []).append((break_type, minute, slot_limit))
+        finally:
+            conn.close()
+
+        with self._lock:
+            entries = {}
+            for template_id, name, version, is_active in rows:
+                cached = self._entries.get(name)
+                if cached is not None and cached[1] == version:
+                    entries[name] = (template_id, version, bool(is_active), cached[3])
+                else:
+                    entries[name] = (template_id, version, bool(is_active),
+                                     compiled_from_slot_rows(name, slot_rows.get(template_id, [])))
+                    self.recompiled += 1
+            self._entries = entries
+            self._key = rows
+            self._views = (
+                {name: entry[3].to_template() for name, entry in entries.items()},
+                {name: entry[3].to_limits() for name, entry in entries.items()},
+                [name for name, entry in entries.items() if entry[2]]
+            )
+
+    def views(self):
+        """(templates, limits, active names) shared by every session; do not mutate"""
+        with self._lock:
+            return self._views
+
+    def compiled(self):
+        with self._lock:
+            return {name: entry[3] for name, entry in self._entries.items()}
+
+    def versions(self):
+        with self._lock:
+            return {name: entry[1] for name, entry in self._entries.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "Templates": len(self._entries),
+                "Refreshes": self.refreshes,
+                "Unchanged refreshes": self.unchanged,
+                "Templates recompiled": self.recompiled,
+                "Versions": {name: entry[1] for name, entry in self._entries.items()}
+            }
+
+@st.cache_resource
+def get_break_registry():
+    return BreakTemplateRegistry()
+
+def get_compiled_templates():
+    """Compiled templates from the registry, recompiled only when their version changes"""
+    return get_break_registry().compiled()
+
+def compiled_from_slot_rows(name, rows):
+    """Build a CompiledTemplate from (break_type, minute, slot_limit) rows"""
+    minutes, limits = {}, {}
+    for break_type in BREAK_TYPES:
+        picked = [(minute, slot_limit) for bt, minute, slot_limit in rows if bt == break_type]
+        minutes[break_type], limits[break_type] = _order_by_shift(
+            np.array([m for m, _ in picked], dtype=np.int16),
+            np.array([n for _, n in picked], dtype=np.int32)
+        )
+    return CompiledTemplate(name, minutes, limits)
+
+def _next_template_version(cursor):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM break_templates")
+    return cursor.fetchone()[0]
+
+def _write_template_slots(cursor, template_id, compiled):
+    """Bring a template's slot rows in line with compiled, writing only rows that differ; returns how many"""
+    cursor.execute("SELECT break_type, minute, slot_limit FROM template_slots WHERE template_id = ?", (template_id,))
+    stored = {(break_type, minute): slot_limit for break_type, minute, slot_limit in cursor.fetchall()}
+    wanted = {
+        (break_type, int(minute)): int(limit)
+        for break_type in BREAK_TYPES
+        for minute, limit in zip(compiled.minutes[break_type], compiled.limits[break_type])
+    }
+    removed = [(template_id, break_type, minute) for break_type, minute in stored.keys() - wanted.keys()]
+    changed = [(template_id, break_type, minute, limit)
+               for (break_type, minute), limit in wanted.items() if stored.get((break_type, minute)) != limit]
+    cursor.executemany("DELETE FROM template_slots WHERE template_id = ? AND break_type = ? AND minute = ?", removed)
+    cursor.executemany(
+        "INSERT OR REPLACE INTO template_slots (template_id, break_type, minute, slot_limit) VALUES (?, ?, ?, ?)",
+        changed
+    )
+    return len(removed) + len(changed)
+
+def _insert_template(cursor, compiled, active, updated_by):
+    cursor.execute("""
+        INSERT INTO break_templates (name, is_active, version, updated_at, updated_by)
+        VALUES (?, ?, ?, ?, ?)
+    """, (compiled.name, int(active), _next_template_version(cursor), get_casablanca_time(), updated_by))
+    _write_template_slots(cursor, cursor.lastrowid, compiled)
+
+def create_break_template(name, template=None, limits=None, active=False):
+    """Add a template (default times if none given); returns True or "exists" """
+    compiled = compile_template(name, template or DEFAULT_BREAK_TEMPLATE, limits)
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        _insert_template(cursor, compiled, active, st.session_state.get("username"))
+        conn.commit()
+        return True
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return "exists"
+    finally:
+        conn.close()
+
+def update_break_template(name, template, limits, base_version=None):
+    """Save a template's times and limits if nobody changed it since base_version.
+
+    Raises ValueError for invalid times. Returns "saved", "unchanged" when the
+    times and limits are already stored (nothing is written and the version
+    stays), or "conflict" when the stored version moved on (another admin saved
+    first) or the template is gone.
+    """
+    compiled = compile_template(name, template, limits)
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT id, version FROM break_templates WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if row is None or (base_version is not None and row[1] != base_version):
+            conn.rollback()
+            return "conflict"
+        if _write_template_slots(cursor, row[0], compiled) == 0:
+            conn.rollback()
+            return "unchanged"
+        cursor.execute(
+            "UPDATE break_templates SET version = ?, updated_at = ?, updated_by = ? WHERE id = ?",
+            (_next_template_version(cursor), get_casablanca_time(), st.session_state.get("username"), row[0])
+        )
+        conn.commit()
+        return "saved"
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def delete_break_template(name):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT id FROM break_templates WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("DELETE FROM template_slots WHERE template_id = ?", (row[0],))
+            cursor.execute("DELETE FROM agent_templates WHERE template_id = ?", (row[0],))
+            cursor.execute("DELETE FROM break_templates WHERE id = ?", (row[0],))
+        conn.commit()
+        return row is not None
+    finally:
+        conn.close()
+
+def set_template_active(name, active):
+    """Store a template's activation; the version only moves when it actually changes"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            UPDATE break_templates SET is_active = ?, version = ?, updated_at = ?, updated_by = ?
+            WHERE name = ? AND is_active != ?
+        """, (int(active), _next_template_version(cursor), get_casablanca_time(), st.session_state.get("username"),
+              name, int(active)))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def toggle_template_active(name):
+    """Checkbox callback: store the new activation state straight away"""
+    set_template_active(name, st.session_state.get(f"active_{name}", False))
+
+def shift_all_templates(hours):
+    """Move all template break times (and their limits) by whole hours in one transaction"""
+    registry = get_break_registry()
+    registry.refresh()
+    shifted = shift_compiled_templates(registry.compiled(), int(hours * 60))
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        version = _next_template_version(cursor)
+        for name, compiled in shifted.items():
+            cursor.execute("SELECT id FROM break_templates WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            if row is None:
+                continue
+            if _write_template_slots(cursor, row[0], compiled) == 0:
+                continue
+            cursor.execute(
+                "UPDATE break_templates SET version = ?, updated_at = ?, updated_by = ? WHERE id = ?",
+                (version, get_casablanca_time(), st.session_state.get("username"), row[0])
+            )
+            version += 1
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Error updating template times: {str(e)}")
+        return False
+    finally:
+        conn.close()
+
+def get_template_names():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM break_templates ORDER BY id")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def get_agent_template_names(username):
+    """Templates assigned to an agent, via the indexed agent_templates join"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT t.name FROM users u
+            JOIN agent_templates a ON a.user_id = u.id
+            JOIN break_templates t ON t.id = a.template_id
+            WHERE u.username = ?
+            ORDER BY t.id
+        """, (username,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def _assign_templates(cursor, user_id, template_names):
+    cursor.execute("DELETE FROM agent_templates WHERE user_id = ?", (user_id,))
+    if template_names:
+        placeholders = ",".join("?" * len(template_names))
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO agent_templates (user_id, template_id)
+            SELECT ?, id FROM break_templates WHERE name IN ({placeholders})
+        """, [user_id] + list(template_names))
+
+def set_agent_templates(username, template_names, group_name=None):
+    """Replace an agent's template assignments (and optionally group) in one transaction"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return False
+        _assign_templates(cursor, row[0], template_names)
+        if group_name is not None:
+            cursor.execute("UPDATE users SET group_name = ? WHERE id = ?", (group_name, row[0]))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def _find_legacy_break_file(filename):
+    for directory in (os.path.dirname(os.path.abspath(__file__)), os.getcwd()):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+def migrate_break_registry():
+    """Fill the registry on first run and retire the old storage.
+
+    Imports templates.json, break_limits.json and active_templates.json (or
+    creates the default template), then moves users.break_templates strings
+    into agent_templates and clears them.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA table_info(users)")
+        has_legacy_column = "break_templates" in [row[1] for row in cursor.fetchall()]
+        cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM break_templates)")
+        needs_templates = cursor.fetchone()[0]
+        if has_legacy_column:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM users WHERE break_templates IS NOT NULL)")
+            has_legacy_column = cursor.fetchone()[0]
+        if not needs_templates and not has_legacy_column:
+            return
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT COUNT(*) FROM break_templates")
+        if cursor.fetchone()[0] == 0:
+            legacy = {}
+            for key, filename, default in (("templates", "templates.json", dict),
+                                           ("break_limits", "break_limits.json", dict),
+                                           ("active_templates", "active_templates.json", list)):
+                path = _find_legacy_break_file(filename)
+                legacy[key] = default()
+                if path:
+                    try:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            legacy[key] = json.load(f)
+                    except (OSError, ValueError):
+                        pass
+            templates = legacy["templates"] or {"Default Template": DEFAULT_BREAK_TEMPLATE}
+            active = legacy["active_templates"] if legacy["templates"] else ["Default Template"]
+            for name, template in templates.items():
+                compiled = compile_template(name, template, legacy["break_limits"].get(name), strict=False)
+                _insert_template(cursor, compiled, name in active, "migration")
+
+        if has_legacy_column:
+            cursor.execute("SELECT id, break_templates FROM users WHERE break_templates IS NOT NULL AND break_templates != ''")
+            for user_id, templates_csv in cursor.fetchall():
+                names = [t.strip() for t in templates_csv.split(",") if t.strip()]
+                cursor.execute("SELECT COUNT(*) FROM agent_templates WHERE user_id = ?", (user_id,))
+                if cursor.fetchone()[0] == 0:
+                    _assign_templates(cursor, user_id, names)
+            cursor.execute("UPDATE users SET break_templates = NULL WHERE break_templates IS NOT NULL")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    for filename in ("templates.json", "break_limits.json", "active_templates.json"):
+        path = _find_legacy_break_file(filename)
+        if path:
+            os.replace(path, path + ".migrated")
+
+def get_slot_limit(template_name, break_type, slot):
+    compiled = get_compiled_templates().get(template_name)
+    if compiled is not None:
+        return compiled.limit(break_type, slot)
+    limits = st.session_state.get('break_limits', {}).get(template_name, {})
+    return limits.get(break_type, {}).get(slot, DEFAULT_SLOT_LIMITS[break_type])
+
+def get_slot_occupancy(date, template_name):
+    """Return {(break_type, slot): booked} for a template on a date in one query"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT break_type, slot, booked FROM break_slot_occupancy WHERE date = ? AND template = ?",
+            (date, template_name)
+        )
+        return {(break_type, slot): booked for break_type, slot, booked in cursor.fetchall()}
+    finally:
+        conn.close()
+
+def count_bookings(date, template_name, break_type, time_slot):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT booked FROM break_slot_occupancy
+            WHERE date = ? AND template = ? AND break_type = ? AND slot = ?
+        """, (date, template_name, break_type, time_slot))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    finally:
+        conn.close()
+
+def rebuild_slot_occupancy():
+    """Recount every slot from break_bookings, e.g. after importing legacy data"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DELETE FROM break_slot_occupancy")
+        cursor.execute(REBUILD_SLOT_OCCUPANCY_SQL)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def display_schedule(template):
+    st.header("LM US ENG 3:00 PM shift")
+    
+    # Lunch breaks table
+    st.markdown("### LUNCH BREAKS")
     lunch_df = pd.DataFrame({
         "DATE": [st.session_state.selected_date],
         **{time: [""] for time in template["lunch_breaks"]}
@@ -1243,48 +2651,825 @@ def display_schedule(template):
     """)
 
 def migrate_booking_data():
-    if 'agent_bookings' in st.session_state:
-        for date in st.session_state.agent_bookings:
-            for agent in st.session_state.agent_bookings[date]:
-                bookings = st.session_state.agent_bookings[date][agent]
-                if "lunch" in bookings and isinstance(bookings["lunch"], str):
-                    bookings["lunch"] = {
-                        "time": bookings["lunch"],
-                        "template": "Default Template",
-                        "booked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                if "early_tea" in bookings and isinstance(bookings["early_tea"], str):
-                    bookings["early_tea"] = {
-                        "time": bookings["early_tea"],
-                        "template": "Default Template",
-                        "booked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                if "late_tea" in bookings and isinstance(bookings["late_tea"], str):
-                    bookings["late_tea"] = {
-                        "time": bookings["late_tea"],
-                        "template": "Default Template",
-                        "booked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-        
-        save_break_data()
+    """Import the legacy all_bookings.json file into break_bookings, then retire the file.
+
+    Old string-only entries are upgraded to the {time, template, booked_at} shape on the way.
+    The file is looked up like the other legacy break files. Raises ValueError,
+    leaving the file in place, if it cannot be read.
+    """
+    path = _find_legacy_break_file('all_bookings.json')
+    if path is None:
+        return 0
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        legacy = json.loads(content) if content.strip() else {}
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Could not read legacy bookings from {path}: {e}") from e
+
+    migrated_at = get_casablanca_time()
+    rows = []
+    for date, agents in legacy.items():
+        for agent, bookings in (agents or {}).items():
+            for break_type in BREAK_TYPES:
+                entry = bookings.get(break_type)
+                if isinstance(entry, str):
+                    entry = {"time": entry, "template": "Default Template", "booked_at": migrated_at}
+                if isinstance(entry, dict) and entry.get("time"):
+                    rows.append((date, agent, break_type, entry["time"],
+                                 entry.get("template", "Default Template"),
+                                 entry.get("booked_at", migrated_at)))
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT OR IGNORE INTO break_bookings (date, agent, break_type, slot, template, booked_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+    finally:
+        conn.close()
+    rebuild_slot_occupancy()
+    os.replace(path, path + '.migrated')
+    return len(rows)
+
+def _booking_rows_to_dict(rows):
+    bookings = {}
+    for agent, break_type, slot, template, booked_at in rows:
+        bookings.setdefault(agent, {})[break_type] = {
+            "time": slot,
+            "template": template,
+            "booked_at": booked_at
+        }
+    return bookings
+
+def _fetch_booking_rows(date):
+    """(agent, break_type, slot, template, booked_at) rows for one date, archived first then live"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT payload FROM break_bookings_archive WHERE date = ?", (date,))
+        row = cursor.fetchone()
+        rows = decompress_archive_payload(row[0]) if row else []
+        cursor.execute(
+            "SELECT agent, break_type, slot, template, booked_at FROM break_bookings WHERE date = ? ORDER BY agent",
+            (date,)
+        )
+        rows.extend(cursor.fetchall())
+        return rows
+    finally:
+        conn.close()
+
+def get_bookings_for_date(date):
+    """Return {agent: {break_type: {time, template, booked_at}}} for one date, live or archived"""
+    return _booking_rows_to_dict(_fetch_booking_rows(date))
+
+def get_agent_bookings(date, agent):
+    """Return {break_type: {time, template, booked_at}} for one agent on one date"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT agent, break_type, slot, template, booked_at FROM break_bookings WHERE date = ? AND agent = ?",
+            (date, agent)
+        )
+        return _booking_rows_to_dict(cursor.fetchall()).get(agent, {})
+    finally:
+        conn.close()
+
+def get_booking_dates():
+    """Dates that still have live bookings (normally just today)"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT date FROM break_bookings ORDER BY date")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def get_archived_booking_dates():
+    """Return [(date, booking_count)] for archived days, newest first"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT date, booking_count FROM break_bookings_archive ORDER BY date DESC")
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def book_agent_breaks(date, agent, template, selections, limits, connect=get_db_connection):
+    """Book all of an agent's selected breaks for a date in one small transaction.
+
+    selections maps break type to slot time and limits maps break type to that
+    slot's capacity. Each slot counter is only bumped while it is below its limit,
+    so two agents racing for the last seat cannot both get it. Floor caps on the
+    agent's group or the whole floor are checked in the same transaction.
+    Returns ("booked", None), ("full", break_type), ("cap", break_type) or ("exists", None).
+    """
+    booked_at = get_casablanca_time()
+    chosen = [(break_type, slot) for break_type, slot in selections.items() if slot]
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        floor_caps = _applicable_floor_caps(cursor, agent)
+        if floor_caps:
+            stamp = _booking_stamp(cursor, date)
+            spans = [(break_type, break_interval(break_type, slot)) for break_type, slot in chosen]
+            index = get_floor_cap_index()
+            for scope, cap in floor_caps:
+                away = index.occupancy(cursor, date, scope, stamp)
+                for break_type, span in spans:
+                    if span and away.peak_in(*span) >= cap:
+                        conn.rollback()
+                        return "cap", break_type
+        for break_type, slot in chosen:
+            cursor.execute("""
+                INSERT OR IGNORE INTO break_slot_occupancy (date, template, break_type, slot, booked)
+                VALUES (?, ?, ?, ?, 0)
+            """, (date, template, break_type, slot))
+            cursor.execute("""
+                UPDATE break_slot_occupancy SET booked = booked + 1
+                WHERE date = ? AND template = ? AND break_type = ? AND slot = ? AND booked < ?
+            """, (date, template, break_type, slot, limits[break_type]))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return "full", break_type
+        cursor.executemany("""
+            INSERT INTO break_bookings (date, agent, break_type, slot, template, booked_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(date, agent, break_type, slot, template, booked_at) for break_type, slot in chosen])
+        new_stamp = _booking_stamp(cursor, date) if floor_caps else None
+        conn.commit()
+        for scope, _ in floor_caps:
+            index.record(date, scope, [span for _, span in spans if span], stamp, new_stamp)
+        return "booked", None
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return "exists", None
+    finally:
+        conn.close()
+
+def delete_agent_bookings(date, agent):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            UPDATE break_slot_occupancy SET booked = booked - 1
+            WHERE (date, template, break_type, slot) IN (
+                SELECT date, COALESCE(template, 'Default Template'), break_type, slot
+                FROM break_bookings WHERE date = ? AND agent = ?
+            )
+        """, (date, agent))
+        cursor.execute("DELETE FROM break_bookings WHERE date = ? AND agent = ?", (date, agent))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# --------------------------
+# Booking Matrix
+# --------------------------
+
+class BookingMatrix:
+    """One day's bookings as small integer arrays instead of nested dicts.
+
+    Agents, slot times and template names are interned once per day.
+    slot_index[a, b] is the index into slots of agent a's booking for
+    BREAK_TYPES[b] (-1 when not booked); template_index and booked_at
+    (Unix seconds, 0 when unknown) hold one value per agent.
+    """
+
+    def __init__(self, date, agents, slots, templates, slot_index, template_index, booked_at):
+        self.date = date
+        self.agents = agents
+        self.agent_ids = {agent: i for i, agent in enumerate(agents)}
+        self.slots = slots
+        self.templates = templates
+        self.slot_index = slot_index
+        self.template_index = template_index
+        self.booked_at = booked_at
+        self.slot_minutes = np.array([time_to_minutes(slot) or 0 for slot in slots], dtype=np.int16)
+
+    @classmethod
+    def from_rows(cls, date, rows):
+        """Build from (agent, break_type, slot, template, booked_at) rows"""
+        agent_ids, slot_ids, template_ids = {}, {}, {}
+        cells, agent_template, agent_booked_at = [], {}, {}
+        column = {break_type: b for b, break_type in enumerate(BREAK_TYPES)}
+        for agent, break_type, slot, template, booked_at in rows:
+            if break_type not in column:
+                continue
+            a = agent_ids.setdefault(agent, len(agent_ids))
+            cells.append((a, column[break_type], slot_ids.setdefault(slot, len(slot_ids))))
+            agent_template.setdefault(a, template_ids.setdefault(template or "Default Template", len(template_ids)))
+            if booked_at and a not in agent_booked_at:
+                agent_booked_at[a] = booked_at
+
+        slot_index = np.full((len(agent_ids), len(BREAK_TYPES)), -1, dtype=np.int16)
+        if cells:
+            a, b, k = np.array(cells, dtype=np.int32).T
+            slot_index[a, b] = k
+        template_index = np.zeros(len(agent_ids), dtype=np.int16)
+        if agent_template:
+            template_index[list(agent_template)] = list(agent_template.values())
+        booked_at = np.zeros(len(agent_ids), dtype=np.int64)
+        if agent_booked_at:
+            parsed = pd.to_datetime(pd.Series(list(agent_booked_at.values())), errors="coerce")
+            seconds = (parsed - pd.Timestamp("1970-01-01")) // pd.Timedelta(seconds=1)
+            booked_at[list(agent_booked_at)] = seconds.fillna(0).astype(np.int64).to_numpy()
+        return cls(date, list(agent_ids), list(slot_ids), list(template_ids),
+                   slot_index, template_index, booked_at)
+
+    def __len__(self):
+        return len(self.agents)
+
+    def nbytes(self):
+        """Approximate memory held: arrays plus the interned strings"""
+        arrays = self.slot_index.nbytes + self.template_index.nbytes + self.booked_at.nbytes + self.slot_minutes.nbytes
+        strings = sum(sys.getsizeof(value) for value in self.agents + self.slots + self.templates)
+        return arrays + strings
+
+    def occupancy(self, template_name=None):
+        """Return {(break_type, slot): booked} counted with one bincount per break type"""
+        mask = np.ones(len(self.agents), dtype=bool)
+        if template_name is not None:
+            if template_name not in self.templates:
+                return {}
+            mask = self.template_index == self.templates.index(template_name)
+        counts = {}
+        for b, break_type in enumerate(BREAK_TYPES):
+            column = self.slot_index[mask, b]
+            tally = np.bincount(column[column >= 0], minlength=len(self.slots))
+            for k in np.flatnonzero(tally):
+                counts[(break_type, self.slots[k])] = int(tally[k])
+        return counts
+
+    def conflict_mask(self):
+        """(agents x BREAK_TYPES) mask of bookings overlapping another break of the same agent"""
+        booked = self.slot_index >= 0
+        shift_start = (self.slot_minutes.astype(np.int32) - SHIFT_START_MINUTE) % (24 * 60)
+        starts = shift_start[np.where(booked, self.slot_index, 0)] if len(self.slots) else np.zeros(booked.shape, dtype=np.int32)
+        return booking_conflict_mask(starts, booked)
+
+    def conflicting_agents(self):
+        """Boolean mask of agents with two breaks that overlap, checked for all agents at once"""
+        return self.conflict_mask().any(axis=1)
+
+    def agent_bookings(self, agent):
+        """The {break_type: {time, template, booked_at}} dict for one agent"""
+        a = self.agent_ids.get(agent)
+        if a is None:
+            return {}
+        booked_at = None
+        if self.booked_at[a]:
+            booked_at = (datetime(1970, 1, 1) + timedelta(seconds=int(self.booked_at[a]))).strftime("%Y-%m-%d %H:%M:%S")
+        return {
+            break_type: {"time": self.slots[k], "template": self.templates[self.template_index[a]], "booked_at": booked_at}
+            for break_type, k in zip(BREAK_TYPES, self.slot_index[a]) if k >= 0
+        }
+
+def get_booking_matrix(date):
+    return BookingMatrix.from_rows(date, _fetch_booking_rows(date))
+
+# --------------------------
+# Booking Day Rollover
+# --------------------------
+
+BOOKING_ROLLOVER_TIME = time(11, 59)
+
+def booking_date(now=None):
+    """Booking day of the shift running at now (Casablanca time); it only rolls over at BOOKING_ROLLOVER_TIME.
+
+    A shift runs past midnight, so bookings, punches, reminders and the floor
+    board made before the cutoff still belong to the previous day.
+    """
+    now = now or casablanca_now()
+    if now.time() < BOOKING_ROLLOVER_TIME:
+        now -= timedelta(days=1)
+    return now.strftime("%Y-%m-%d")
+
+def break_start_at(date, slot):
+    """Casablanca datetime a slot booked on a booking day starts; slots before the cutoff fall after midnight"""
+    start = datetime.strptime(date, "%Y-%m-%d") + timedelta(minutes=parse_break_time(slot))
+    if start.time() < BOOKING_ROLLOVER_TIME:
+        start += timedelta(days=1)
+    return start
+
+@st.cache_resource
+def get_rollover_marker():
+    """Remembers the last booking day this process saw rolled over, to skip the DB check"""
+    return {"date": None}
+
+def roll_over_break_day(marker=None, connect=get_db_connection):
+    """Open a new booking day once it is past 11:59 Casablanca time.
+
+    The first caller after the cutoff archives every earlier date into one
+    compressed partition per day and clears today's bookings made before the
+    cutoff, all in one transaction. The break_day_rollovers row makes sure only
+    one session does it. The scheduler runs it at the cutoff and passes the
+    marker in; a rerun only pays for the marker check. Returns the rollover
+    summary, or None if nothing ran.
+    """
+    now = casablanca_now()
+    today = now.strftime("%Y-%m-%d")
+    if marker is None:
+        marker = get_rollover_marker()
+    if marker["date"] == today or now.time() < BOOKING_ROLLOVER_TIME:
+        return None
+
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "INSERT OR IGNORE INTO break_day_rollovers (date, rolled_at) VALUES (?, ?)",
+            (today, now.strftime("%Y-%m-%d %H:%M:%S"))
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            marker["date"] = today
+            return None
+
+        cursor.execute("""
+            SELECT date, agent, break_type, slot, template, booked_at FROM break_bookings
+            WHERE date < ? ORDER BY date, agent, break_type
+        """, (today,))
+        partitions = {}
+        for date, *row in cursor.fetchall():
+            partitions.setdefault(date, []).append(row)
+
+        archived_at = now.strftime("%Y-%m-%d %H:%M:%S")
+        for date, day_rows in partitions.items():
+            cursor.execute("SELECT payload FROM break_bookings_archive WHERE date = ?", (date,))
+            existing = cursor.fetchone()
+            merged = (decompress_archive_payload(existing[0]) if existing else []) + day_rows
+            cursor.execute("""
+                INSERT INTO break_bookings_archive (date, booking_count, payload, archived_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(date) DO UPDATE SET
+                    booking_count = excluded.booking_count,
+                    payload = excluded.payload,
+                    archived_at = excluded.archived_at
+            """, (date, len(merged), compress_archive_payload(merged), archived_at))
+
+        archived_rows = sum(len(day_rows) for day_rows in partitions.values())
+        cursor.execute("DELETE FROM break_bookings WHERE date < ?", (today,))
+        cutoff = f"{today} {BOOKING_ROLLOVER_TIME.strftime('%H:%M:%S')}"
+        cursor.execute("DELETE FROM break_bookings WHERE date = ? AND booked_at < ?", (today, cutoff))
+        purged_rows = cursor.rowcount
+        # Seats booked since the cutoff stay taken
+        cursor.execute("DELETE FROM break_slot_occupancy WHERE date <= ?", (today,))
+        cursor.execute("""
+            INSERT INTO break_slot_occupancy (date, template, break_type, slot, booked)
+            SELECT date, COALESCE(template, 'Default Template'), break_type, slot, COUNT(*)
+            FROM break_bookings WHERE date = ?
+            GROUP BY date, COALESCE(template, 'Default Template'), break_type, slot
+        """, (today,))
+        cursor.execute("""
+            UPDATE break_day_rollovers SET archived_days = ?, archived_rows = ?, purged_rows = ?
+            WHERE date = ?
+        """, (len(partitions), archived_rows, purged_rows, today))
+        conn.commit()
+        marker["date"] = today
+        return {"date": today, "archived_days": len(partitions),
+                "archived_rows": archived_rows, "purged_rows": purged_rows}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_last_rollover():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT date, rolled_at, archived_days, archived_rows, purged_rows
+            FROM break_day_rollovers ORDER BY date DESC LIMIT 1
+        """)
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+# --------------------------
+# Background Jobs
+# --------------------------
+
+SCHEDULER_TICK_SECONDS = 60
+SCHEDULER_LEASE_SECONDS = 15 * 60
+
+SCHEDULED_JOBS_SQL = """
+    CREATE TABLE IF NOT EXISTS scheduled_jobs (
+        name TEXT PRIMARY KEY,
+        schedule TEXT NOT NULL,
+        next_run TEXT,
+        lease_owner TEXT,
+        lease_expires REAL NOT NULL DEFAULT 0,
+        last_started TEXT,
+        last_finished TEXT,
+        last_duration_ms REAL,
+        last_status TEXT,
+        last_result TEXT,
+        run_count INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+@st.cache_resource
+def prepare_database():
+    """Create and migrate the schema once per server process instead of on every rerun.
+
+    Raises ValueError if a legacy file cannot be migrated; the caller shows it,
+    since anything rendered here would only appear on the first run.
+    """
+    ensure_dropdown_options_table()
+    init_db()
+    ensure_break_templates_column()
+    ensure_group_messages_reactions_column()
+    migrate_booking_data()
+    migrate_break_registry()
+    return True
+
+def analyze_database():
+    """Refresh the query planner's table statistics"""
+    conn = get_db_connection()
+    try:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+    finally:
+        conn.close()
+
+def vacuum_database():
+    """Rebuild the database file to hand back pages freed by archival; returns the KB reclaimed"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+        before = cursor.execute("PRAGMA page_count").fetchone()[0]
+        cursor.execute("VACUUM")
+        after = cursor.execute("PRAGMA page_count").fetchone()[0]
+        return round((before - after) * page_size / 1024, 1)
+    finally:
+        conn.close()
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day month weekday) in Casablanca time.
+
+    Fields take *, */n, a-b, a-b/n, single values and comma lists. Weekday 0
+    (or 7) is Sunday. As in cron, when both day and weekday are restricted a
+    day matching either one runs.
+    """
+
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.FIELD_RANGES)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            step = int(step) if step else 1
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-", 1))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Cron field out of range: {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment):
+        """First matching minute strictly after moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year, month = divmod(candidate.month, 12)
+                candidate = candidate.replace(year=candidate.year + year, month=month + 1,
+                                              day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+class ScheduledJob:
+    def __init__(self, name, schedule, func, jitter=0, catch_up=False, description=""):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.func = func
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.description = description
+
+class JobScheduler:
+    """Runs maintenance jobs on cron schedules from one daemon thread per server process.
+
+    The schedule lives in the scheduled_jobs table. Before running, a process
+    takes the job's lease there, and only while the run is still due, so with
+    several processes each occurrence runs once. A run that was missed while the
+    server was down is made up at start-up only for catch_up jobs. Jobs talk to
+    the database only, never to st.*.
+    """
+
+    TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self, clock=None):
+        # Without its own clock it follows the module clock, so use_clock moves it too
+        self.clock = clock
+        self.owner = f"{os.getpid()}-{id(self):x}"
+        self.jobs = {}
+        self._due = {}
+        self._requested = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._rng = random.Random()
+        self._thread = None
+        self.loop_errors = 0
+        self.last_loop_error = None
+
+    def register(self, name, schedule, func, **options):
+        self.jobs[name] = ScheduledJob(name, schedule, func, **options)
+
+    def now(self):
+        return (self.clock or clock).now().replace(microsecond=0)
+
+    def _plan(self, job, after):
+        due = job.schedule.next_after(after)
+        if job.jitter:
+            due += timedelta(seconds=self._rng.uniform(0, job.jitter))
+        return due.replace(microsecond=0)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._sync_jobs(self.now())
+        self._thread = threading.Thread(target=self._loop, name="job-scheduler", daemon=True)
+        self._thread.start()
+
+    def _sync_jobs(self, now):
+        now_text = now.strftime(self.TIME_FORMAT)
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            for job in self.jobs.values():
+                cursor.execute("SELECT schedule, next_run FROM scheduled_jobs WHERE name = ?", (job.name,))
+                row = cursor.fetchone()
+                next_run = row[1] if row and row[0] == job.schedule.expression else None
+                if next_run is None or (next_run < now_text and not job.catch_up):
+                    next_run = self._plan(job, now).strftime(self.TIME_FORMAT)
+                cursor.execute("""
+                    INSERT INTO scheduled_jobs (name, schedule, next_run) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET schedule = excluded.schedule, next_run = excluded.next_run
+                """, (job.name, job.schedule.expression, next_run))
+                self._due[job.name] = datetime.strptime(next_run, self.TIME_FORMAT)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def request_run(self, name):
+        """Ask the scheduler thread to run a job as soon as it wakes, outside its schedule"""
+        with self._lock:
+            self._requested.add(name)
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_pending()
+            except Exception as e:
+                self.loop_errors += 1
+                self.last_loop_error = f"{type(e).__name__}: {e}"
+            now = self.now()
+            wait = min([SCHEDULER_TICK_SECONDS] + [(due - now).total_seconds() for due in self._due.values()])
+            self._wake.wait(max(wait, 1))
+            self._wake.clear()
+
+    def run_pending(self):
+        with self._lock:
+            requested, self._requested = self._requested, set()
+        now = self.now()
+        for name in self.jobs:
+            if name in requested or self._due[name] <= now:
+                self.run_job(name, force=name in requested)
+
+    def run_job(self, name, force=False):
+        """Run one job if this process gets its lease; returns the run status, or None if skipped"""
+        job = self.jobs[name]
+        started = self.now()
+        if not self._acquire(job, started, force):
+            return None
+        start = perf_counter()
+        try:
+            result = job.func()
+            status = "ok"
+        except Exception as e:
+            result = f"{type(e).__name__}: {e}"
+            status = "error"
+        duration_ms = (perf_counter() - start) * 1000
+        self._finish(job, status, result, duration_ms)
+        return status
+
+    def _acquire(self, job, now, force):
+        now_text = now.strftime(self.TIME_FORMAT)
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                UPDATE scheduled_jobs SET lease_owner = ?, lease_expires = ?, last_started = ?
+                WHERE name = ? AND (lease_owner IS NULL OR lease_expires < ?) AND (? OR next_run <= ?)
+            """, (self.owner, now.timestamp() + SCHEDULER_LEASE_SECONDS, now_text,
+                  job.name, now.timestamp(), int(force), now_text))
+            acquired = cursor.rowcount == 1
+            if not acquired:
+                # Another process ran it or holds it; follow the shared schedule
+                cursor.execute("SELECT next_run FROM scheduled_jobs WHERE name = ?", (job.name,))
+                row = cursor.fetchone()
+                if row and row[0] and row[0] > now_text:
+                    self._due[job.name] = datetime.strptime(row[0], self.TIME_FORMAT)
+                else:
+                    self._due[job.name] = now + timedelta(seconds=SCHEDULER_TICK_SECONDS)
+            conn.commit()
+            return acquired
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job, status, result, duration_ms):
+        finished = self.now()
+        next_run = self._plan(job, finished)
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE scheduled_jobs SET lease_owner = NULL, lease_expires = 0, next_run = ?,
+                    last_finished = ?, last_duration_ms = ?, last_status = ?, last_result = ?,
+                    run_count = run_count + 1
+                WHERE name = ? AND lease_owner = ?
+            """, (next_run.strftime(self.TIME_FORMAT), finished.strftime(self.TIME_FORMAT),
+                  round(duration_ms, 2), status, None if result is None else str(result)[:200],
+                  job.name, self.owner))
+            conn.commit()
+        finally:
+            conn.close()
+        self._due[job.name] = next_run
+
+    def status(self):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT name, schedule, next_run, last_started, last_finished, last_duration_ms,
+                       last_status, last_result, run_count, lease_owner
+                FROM scheduled_jobs ORDER BY next_run
+            """)
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        return [
+            {
+                "Job": name,
+                "Description": self.jobs[name].description if name in self.jobs else "",
+                "Schedule": schedule,
+                "Next Run": next_run,
+                "Last Started": last_started,
+                "Last Finished": last_finished,
+                "Duration (ms)": duration_ms,
+                "Status": "running" if lease_owner else last_status,
+                "Result": last_result,
+                "Runs": run_count
+            }
+            for (name, schedule, next_run, last_started, last_finished, duration_ms,
+                 last_status, last_result, run_count, lease_owner) in rows
+        ]
+
+    def stats(self):
+        return {
+            "owner": self.owner,
+            "thread_alive": self._thread is not None and self._thread.is_alive(),
+            "loop_errors": self.loop_errors,
+            "last_loop_error": self.last_loop_error
+        }
+
+@st.cache_resource
+def get_job_scheduler():
+    """Process-wide scheduler with the maintenance jobs registered and its thread started"""
+    prepare_database()
+    # Jobs run off the script thread, so look up the rollover marker here
+    marker = get_rollover_marker()
+    scheduler = JobScheduler()
+    # No jitter on the rollover: it must land right on the 11:59 cutoff
+    scheduler.register("break_day_rollover", "59 11 * * *", lambda: roll_over_break_day(marker),
+                       catch_up=True, description="Archive past booking days and open today's")
+    scheduler.register("chat_archival", "30 4 * * *", archive_old_group_messages, jitter=300,
+                       catch_up=True, description=f"Archive chat older than {CHAT_RETENTION_DAYS} days")
+    scheduler.register("slot_counter_rebuild", "45 4 * * *", rebuild_slot_occupancy, jitter=300,
+                       description="Recount break slot occupancy from the bookings")
+    scheduler.register("database_analyze", "0 5 * * *", analyze_database, jitter=300,
+                       description="ANALYZE and PRAGMA optimize")
+    scheduler.register("database_vacuum", "30 5 * * 0", vacuum_database, jitter=300,
+                       description="VACUUM the database file (KB reclaimed)")
+    scheduler.start()
+    return scheduler
+
+# --------------------------
+# Shift-Start Booking Rush
+# --------------------------
+
+class BookingAdmissionQueue:
+    """Runs booking transactions one at a time, strictly in arrival order.
+
+    When the whole floor confirms at once, SQLite's busy handler lets waiting
+    writers retry in no particular order and gives up after its timeout. Taking
+    a ticket here first means requests are served first come, first served and
+    never queue on the database lock itself.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._now_serving = 0
+        self.admitted = 0
+        self.peak_waiting = 0
+
+    def waiting(self):
+        with self._cond:
+            return self._next_ticket - self._now_serving
+
+    def admit(self, func, *args, **kwargs):
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self.peak_waiting = max(self.peak_waiting, self._next_ticket - self._now_serving)
+            while ticket != self._now_serving:
+                self._cond.wait()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._cond:
+                self._now_serving += 1
+                self.admitted += 1
+                self._cond.notify_all()
+
+@st.cache_resource
+def get_booking_queue():
+    return BookingAdmissionQueue()
+
+def reserve_agent_breaks(date, agent, template, selections, limits):
+    """Queue the agent's booking behind everyone who confirmed before them"""
+    return get_booking_queue().admit(book_agent_breaks, date, agent, template, selections, limits)
 
 def clear_all_bookings():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
     
+    conn = get_db_connection()
     try:
-        # Clear session state bookings
-        st.session_state.agent_bookings = {}
-        
-        # Clear the bookings file
-        if os.path.exists('all_bookings.json'):
-            with open('all_bookings.json', 'w') as f:
-                json.dump({}, f)
-        
-        # Save empty state to ensure it's propagated
-        save_break_data()
-        
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM break_bookings")
+        cursor.execute("DELETE FROM break_slot_occupancy")
+        cursor.execute("DELETE FROM break_bookings_archive")
+        conn.commit()
+
         # Force session state refresh
         st.session_state.last_request_count = 0
         st.session_state.last_mistake_count = 0
@@ -1294,29 +3479,51 @@ def clear_all_bookings():
     except Exception as e:
         st.error(f"Error clearing bookings: {str(e)}")
         return False
+    finally:
+        conn.close()
+
+def booking_table_rows(date_bookings):
+    """Flatten {agent: {break_type: booking}} into one table row per agent"""
+    rows = []
+    for agent, breaks in date_bookings.items():
+        # Get template name from any break type (they should all be the same)
+        template_name = None
+        for break_type in ['lunch', 'early_tea', 'late_tea']:
+            if break_type in breaks and isinstance(breaks[break_type], dict):
+                template_name = breaks[break_type].get('template', 'Unknown')
+                break
+
+        # Find a single 'booked_at' value for this agent's booking
+        booked_at = None
+        for btype in ['lunch', 'early_tea', 'late_tea']:
+            if btype in breaks and isinstance(breaks[btype], dict):
+                booked_at = breaks[btype].get('booked_at', None)
+                if booked_at:
+                    break
+        booking = {
+            "Agent": agent,
+            "Template": template_name or "Unknown",
+            "Lunch": breaks.get("lunch", {}).get("time", "-") if isinstance(breaks.get("lunch"), dict) else breaks.get("lunch", "-"),
+            "Early Tea": breaks.get("early_tea", {}).get("time", "-") if isinstance(breaks.get("early_tea"), dict) else breaks.get("early_tea", "-"),
+            "Late Tea": breaks.get("late_tea", {}).get("time", "-") if isinstance(breaks.get("late_tea"), dict) else breaks.get("late_tea", "-"),
+            "Booked At": booked_at or "-"
+        }
+        rows.append(booking)
+    return rows
 
 def admin_break_dashboard():
     st.title("Break Schedule Management")
     st.markdown("---")
     
-    # Initialize templates if empty
-    if 'templates' not in st.session_state:
-        st.session_state.templates = {}
-    
     # Create default template if no templates exist
     if not st.session_state.templates:
-        default_template = {
-            "lunch_breaks": ["19:30", "20:00", "20:30", "21:00", "21:30"],
-            "tea_breaks": {
-                "early": ["16:00", "16:15", "16:30", "16:45", "17:00", "17:15", "17:30"],
-                "late": ["21:45", "22:00", "22:15", "22:30"]
-            }
-        }
-        st.session_state.templates["Default Template"] = default_template
+        create_break_template("Default Template", active=True)
         st.session_state.current_template = "Default Template"
-        if "Default Template" not in st.session_state.active_templates:
-            st.session_state.active_templates.append("Default Template")
-        save_break_data()
+        st.rerun()
+    
+    # Versions the editor was rendered from; saving against a newer one is a conflict
+    edit_base = st.session_state.get("template_edit_base", {})
+    st.session_state.template_edit_base = get_break_registry().versions()
     
     # Template Activation Management
     # Inject CSS to fix white-on-white metric text
@@ -1340,17 +3547,12 @@ def admin_break_dashboard():
         
         for template in template_list:
             is_active = template in active_templates
-            if st.checkbox(f"{template} {'✅' if is_active else ''}", 
-                         value=is_active, 
-                         key=f"active_{template}"):
-                if template not in active_templates:
-                    active_templates.append(template)
-            else:
-                if template in active_templates:
-                    active_templates.remove(template)
-        
-        st.session_state.active_templates = active_templates
-        save_break_data()
+            if f"active_{template}" not in st.session_state:
+                st.session_state[f"active_{template}"] = is_active
+            st.checkbox(f"{template} {'✅' if is_active else ''}",
+                        key=f"active_{template}",
+                        on_change=toggle_template_active,
+                        args=(template,))
     
     with col2:
         st.write("### Statistics")
@@ -1367,17 +3569,11 @@ def admin_break_dashboard():
         template_name = st.text_input("New Template Name:")
     with col2:
         if st.button("Create Template"):
-            if template_name and template_name not in st.session_state.templates:
-                st.session_state.templates[template_name] = {
-                    "lunch_breaks": ["19:30", "20:00", "20:30", "21:00", "21:30"],
-                    "tea_breaks": {
-                        "early": ["16:00", "16:15", "16:30", "16:45", "17:00", "17:15", "17:30"],
-                        "late": ["21:45", "22:00", "22:15", "22:30"]
-                    }
-                }
-                save_break_data()
+            if template_name and create_break_template(template_name) is True:
                 st.success(f"Template '{template_name}' created!")
                 st.rerun()
+            elif template_name:
+                st.error(f"Template '{template_name}' already exists.")
     
     # Template Selection and Editing
     selected_template = st.selectbox(
@@ -1387,18 +3583,21 @@ def admin_break_dashboard():
     
     if selected_template:
         template = st.session_state.templates[selected_template]
+        stored_problems = get_compiled_templates().get(selected_template)
+        if stored_problems is not None and stored_problems.problems:
+            st.warning("Agents can't book these entries until they are fixed: " + "; ".join(stored_problems.problems))
         
         # Time adjustment buttons
         st.subheader("Time Adjustment")
         col1, col2 = st.columns(2)
         with col1:
             if st.button("➕ Add 1 Hour to All Times"):
-                bulk_update_template_times(1)
+                shift_all_templates(1)
                 st.success("Added 1 hour to all break times")
                 st.rerun()
         with col2:
             if st.button("➖ Subtract 1 Hour from All Times"):
-                bulk_update_template_times(-1)
+                shift_all_templates(-1)
                 st.success("Subtracted 1 hour from all break times")
                 st.rerun()
         
@@ -1434,14 +3633,10 @@ def admin_break_dashboard():
         st.markdown("---")
         st.subheader("Break Limits")
         
-        if selected_template not in st.session_state.break_limits:
-            st.session_state.break_limits[selected_template] = {
-                "lunch": {time: 5 for time in template["lunch_breaks"]},
-                "early_tea": {time: 3 for time in template["tea_breaks"]["early"]},
-                "late_tea": {time: 3 for time in template["tea_breaks"]["late"]}
-            }
-        
-        limits = st.session_state.break_limits[selected_template]
+        # The registry's limits are shared with every session; the inputs below
+        # fill a new dict instead of editing them in place
+        stored_limits = st.session_state.break_limits.get(selected_template, {})
+        limits = {break_type: {} for break_type in BREAK_TYPES}
         
         # Validate break times before rendering limits
         if not template["lunch_breaks"]:
@@ -1454,7 +3649,7 @@ def admin_break_dashboard():
                     limits["lunch"][time] = st.number_input(
                         f"Max at {time}",
                         min_value=1,
-                        value=limits["lunch"].get(time, 5),
+                        value=stored_limits.get("lunch", {}).get(time, 5),
                         key=f"lunch_limit_{time}"
                     )
         
@@ -1468,7 +3663,7 @@ def admin_break_dashboard():
                     limits["early_tea"][time] = st.number_input(
                         f"Max at {time}",
                         min_value=1,
-                        value=limits["early_tea"].get(time, 3),
+                        value=stored_limits.get("early_tea", {}).get(time, 3),
                         key=f"early_tea_limit_{time}"
                     )
         
@@ -1482,32 +3677,246 @@ def admin_break_dashboard():
                     limits["late_tea"][time] = st.number_input(
                         f"Max at {time}",
                         min_value=1,
-                        value=limits["late_tea"].get(time, 3),
+                        value=stored_limits.get("late_tea", {}).get(time, 3),
                         key=f"late_tea_limit_{time}"
                     )
         
         # Consolidated save button
         if st.button("Save All Changes", type="primary"):
-            template["lunch_breaks"] = [t.strip() for t in lunch_breaks.split("\n") if t.strip()]
-            template["tea_breaks"]["early"] = [t.strip() for t in early_tea.split("\n") if t.strip()]
-            template["tea_breaks"]["late"] = [t.strip() for t in late_tea.split("\n") if t.strip()]
-            save_break_data()
-            st.success("All changes saved successfully!")
-            st.rerun()
+            edited = {
+                "lunch_breaks": [t.strip() for t in lunch_breaks.split("\n") if t.strip()],
+                "tea_breaks": {
+                    "early": [t.strip() for t in early_tea.split("\n") if t.strip()],
+                    "late": [t.strip() for t in late_tea.split("\n") if t.strip()]
+                }
+            }
+            try:
+                result = update_break_template(selected_template, edited, limits, edit_base.get(selected_template))
+            except ValueError as e:
+                st.error(f"Template not saved. Fix these times first: {e}")
+            else:
+                if result == "conflict":
+                    st.error("Another admin changed this template since you opened it. Your edits were not saved; the latest version is shown now.")
+                elif result == "unchanged":
+                    st.info("Nothing changed; the template was not rewritten.")
+                else:
+                    st.success("All changes saved successfully!")
+                    st.rerun()
         
         if st.button("Delete Template") and len(st.session_state.templates) > 1:
-            del st.session_state.templates[selected_template]
-            if selected_template in st.session_state.active_templates:
-                st.session_state.active_templates.remove(selected_template)
-            save_break_data()
+            delete_break_template(selected_template)
             st.success(f"Template '{selected_template}' deleted!")
             st.rerun()
     
+    # Who is away right now, per group
+    st.markdown("---")
+    st.subheader("📡 Live Floor Board")
+    now_casa = casablanca_now()
+    board_date = booking_date(now_casa)
+    board_minute = shift_minutes(now_casa.strftime("%H:%M"))
+    board_groups = sorted({row[3] for row in get_all_users() if row[2] == "agent" and row[3]})
+    board_group = st.selectbox("Floor:", ["All groups"] + board_groups, key="floor_board_group")
+    timeline = get_floor_timeline(board_date, None if board_group == "All groups" else board_group)
+    current = timeline.on_break(board_minute)
+    upcoming = timeline.upcoming(board_minute)
+    peak, peak_minute = timeline.peak()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("On Break Now", len(current))
+    col2.metric(f"Starting in {FLOOR_BOARD_HORIZON} min", len(upcoming))
+    col3.metric("Peak Away", peak, help=f"at {format_break_minutes(peak_minute + SHIFT_START_MINUTE)}" if peak_minute is not None else None)
+    board_cap = get_floor_caps().get(FLOOR_SCOPE if board_group == "All groups" else board_group)
+    st.caption(f"Shift of {board_date}, as of {now_casa.strftime('%H:%M')} Casablanca time."
+               + (f" Cap: {board_cap} away at once." if board_cap else ""))
+    if not len(timeline):
+        st.info("No breaks booked for this shift yet.")
+    else:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write("**On break now**")
+            if current:
+                st.dataframe(pd.DataFrame(floor_board_rows(current, board_minute)), use_container_width=True, hide_index=True)
+            else:
+                st.caption("Nobody is on break.")
+        with col2:
+            st.write("**Up next**")
+            if upcoming:
+                st.dataframe(pd.DataFrame(floor_board_rows(upcoming, board_minute, upcoming=True)), use_container_width=True, hide_index=True)
+            else:
+                st.caption(f"No breaks start in the next {FLOOR_BOARD_HORIZON} minutes.")
+        last_minute = int(timeline.ends.max())
+        st.line_chart(pd.DataFrame(
+            {"Agents on break": timeline.absence[:last_minute]},
+            index=[format_break_minutes(m + SHIFT_START_MINUTE) for m in range(last_minute)]
+        ).iloc[int(timeline.starts.min()):])
+
+    # Adherence from the punch log
+    st.markdown("---")
+    st.subheader("⏱️ Break Adherence")
+    punch_dates = get_punch_dates()
+    if not punch_dates:
+        st.caption("No break punches recorded yet.")
+    else:
+        adherence_date = st.selectbox("Punch Date:", punch_dates, index=len(punch_dates) - 1, key="adherence_date")
+        adherence = get_live_adherence(adherence_date, board_minute if adherence_date == board_date else None)
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Breaks Punched", len(adherence))
+        col2.metric("On Break", int(adherence["Running"].sum()))
+        col3.metric("Late Starts", int(adherence["Late Start"].sum()))
+        col4.metric("Overruns", int(adherence["Overrun"].sum()))
+        col5.metric("Last-Hour Breaks", int(adherence["Last Hour"].sum()))
+        flagged = adherence_display(adherence)
+        if flagged.empty:
+            st.success("No adherence issues so far.")
+        else:
+            st.dataframe(flagged.drop(columns=["Running"]), use_container_width=True, hide_index=True)
+        with st.expander("Per-agent adherence"):
+            st.dataframe(summarize_adherence(adherence), use_container_width=True, hide_index=True)
+
+    # Floor-wide limits on simultaneous breaks, across templates and start times
+    with st.expander("🚦 Floor Caps"):
+        st.caption("Most agents allowed on break at the same minute, counting each break's full length. 0 means no cap.")
+        floor_caps_config = get_floor_caps()
+        cap_scopes = [FLOOR_SCOPE] + board_groups
+        cols = st.columns(min(4, len(cap_scopes)))
+        new_caps = {}
+        for i, scope in enumerate(cap_scopes):
+            with cols[i % len(cols)]:
+                new_caps[scope] = st.number_input(
+                    "Whole floor" if scope == FLOOR_SCOPE else scope,
+                    min_value=0,
+                    value=int(floor_caps_config.get(scope, 0)),
+                    key=f"floor_cap_{scope}"
+                )
+        if st.button("Save Floor Caps"):
+            if all(set_floor_cap(scope, value) for scope, value in new_caps.items() if value != floor_caps_config.get(scope, 0)):
+                st.success("Floor caps saved.")
+                st.rerun()
+
+    # What the current limits do to floor coverage, from simulated shift days
+    with st.expander("📈 Capacity Planner"):
+        st.caption("Simulates thousands of shift days from the active templates, agent assignments and the slots agents actually booked, then suggests per-slot limits.")
+        agent_total = sum(1 for row in get_all_users() if row[2] == "agent")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            plan_headcount = st.number_input("Headcount", min_value=1, value=max(1, agent_total), key="plan_headcount")
+        with col2:
+            plan_days = st.number_input("Simulated days", min_value=500, max_value=20000, value=5000, step=500, key="plan_days")
+        with col3:
+            plan_service = st.slider("Cover demand on % of days", 50, 99, 95, key="plan_service")
+        if st.button("Run Simulation"):
+            with st.spinner("Simulating shift days..."):
+                plan = plan_break_capacity(int(plan_headcount), days=int(plan_days), service_level=plan_service)
+            if plan is None:
+                st.warning("No active templates to plan for.")
+            else:
+                worst = int(np.argmax(plan["away_service"]))
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Median Peak Away", int(plan["away_p50"].max()))
+                col2.metric(f"P{plan_service} Peak Away", int(np.ceil(plan["away_service"][worst])),
+                            help=f"at {format_break_minutes(plan['minutes'][worst] + SHIFT_START_MINUTE)}")
+                col3.metric("Simulation Time", f"{plan['elapsed_ms']:.0f} ms")
+                st.line_chart(pd.DataFrame(
+                    {
+                        "Median on floor %": 100 * (1 - plan["away_p50"] / plan["headcount"]),
+                        f"P{plan_service} worst on floor %": 100 * (1 - plan["away_service"] / plan["headcount"]),
+                        "P99 worst on floor %": 100 * (1 - plan["away_p99"] / plan["headcount"])
+                    },
+                    index=[format_break_minutes(m + SHIFT_START_MINUTE) for m in plan["minutes"]]
+                ))
+                st.dataframe(plan["slots"], use_container_width=True, hide_index=True)
+
+    # Bulk assignment for a whole group
+    st.markdown("---")
+    st.subheader("🤖 Auto-Assign Breaks")
+    st.info("Assigns every agent of a group who has not booked yet, spreading breaks to keep the number of agents away at once as low as possible.")
+    groups = sorted({row[3] for row in get_all_users() if row[2] == "agent" and row[3]})
+    if not groups:
+        st.caption("No agent groups configured yet.")
+    else:
+        assign_date = booking_date()
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            assign_group = st.selectbox("Group:", groups, key="assign_group")
+        with col2:
+            st.write("")
+            preview = st.button("Preview Assignment")
+        preferences_text = st.text_area(
+            "Preferences (optional, one per line: agent, break type, time — e.g. john, lunch, 20:00):",
+            key="assign_preferences"
+        )
+        if preview:
+            preferences = {}
+            for line in preferences_text.splitlines():
+                parts = [p.strip() for p in line.split(",")]
+                if len(parts) == 3 and parts[1] in BREAK_TYPES:
+                    preferences.setdefault(parts[0], {})[parts[1]] = parts[2]
+            roster, skipped = get_group_roster(assign_group, st.session_state.active_templates)
+            already = set(get_bookings_for_date(assign_date))
+            roster = [(agent, name) for agent, name in roster if agent not in already]
+            started = perf_counter()
+            result = solve_break_assignment(
+                roster, st.session_state.templates, st.session_state.break_limits,
+                occupancy=get_occupancy_for_date(assign_date), preferences=preferences,
+                scope_absence={scope: get_floor_absence(assign_date, scope) for scope in (FLOOR_SCOPE, assign_group)}
+            )
+            result["unassigned"] = skipped + result["unassigned"]
+            result["elapsed_ms"] = (perf_counter() - started) * 1000
+            st.session_state.assignment_preview = (assign_date, assign_group, result)
+
+        preview_state = st.session_state.get("assignment_preview")
+        if preview_state and preview_state[1] == assign_group:
+            preview_date, _, result = preview_state
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Agents Assigned", len(result["assignment"]))
+            col2.metric("Peak Away", result["peak"])
+            col3.metric("Best Possible", result["lower_bound"])
+            col4.metric("Solve Time", f"{result['elapsed_ms']:.0f} ms")
+            caps_config = get_floor_caps()
+            exceeded = [
+                f"{'the floor' if scope == FLOOR_SCOPE else scope} (up to {peak} away, cap {caps_config[scope]})"
+                for scope, peak in result["peaks"].items() if caps_config.get(scope) and peak > caps_config[scope]
+            ]
+            if exceeded:
+                st.warning(f"This assignment would exceed the cap for {' and '.join(exceeded)}. Applying is refused while it would break a cap.")
+            if result["assignment"]:
+                st.dataframe(pd.DataFrame([
+                    {"Agent": agent, "Template": name,
+                     "Lunch": picked.get("lunch", "-"), "Early Tea": picked.get("early_tea", "-"), "Late Tea": picked.get("late_tea", "-")}
+                    for agent, (name, picked) in result["assignment"].items()
+                ]), use_container_width=True)
+                st.line_chart(pd.DataFrame(
+                    {"Agents on break": result["absence"][:24 * 60]},
+                    index=[f"{((m + SHIFT_START_MINUTE) // 60) % 24:02d}:{m % 60:02d}" for m in range(24 * 60)]
+                ).loc[lambda df: df["Agents on break"] > 0])
+            if result["unassigned"]:
+                st.warning("Not assigned: " + ", ".join(f"{agent} ({reason})" for agent, reason in result["unassigned"]))
+            if result["assignment"] and st.button("Apply Assignment", type="primary"):
+                if is_killswitch_enabled():
+                    st.error("System is currently locked. Please contact the developer.")
+                else:
+                    # Same first come, first served queue as agents confirming their own breaks
+                    status, detail = get_booking_queue().admit(apply_break_assignment, preview_date, result["assignment"])
+                    if status == "booked":
+                        st.session_state.assignment_preview = None
+                        st.success(f"Booked breaks for {len(result['assignment'])} agents.")
+                        st.rerun()
+                    elif status == "cap":
+                        agent, scope, cap = detail
+                        st.error(f"Nothing was applied: placing {agent} would put more than {cap} agents of "
+                                 f"{'the whole floor' if scope == FLOOR_SCOPE else scope} on break at once. "
+                                 "Raise the cap or book fewer agents.")
+                    elif status == "full":
+                        agent, break_type, slot = detail
+                        st.error(f"Nothing was applied: the {BREAK_TYPE_LABELS.get(break_type, break_type)} slot at {slot} "
+                                 f"filled up since the preview ({agent} could not be placed). Preview again.")
+                    else:
+                        st.error("Nothing was applied: some of these agents booked in the meantime. Preview again.")
+
     # View Bookings with template information
     st.markdown("---")
     st.subheader("View All Bookings")
     
-    dates = list(st.session_state.agent_bookings.keys())
+    dates = get_booking_dates()
     if dates:
         selected_date = st.selectbox("Select Date:", dates, index=len(dates)-1)
         
@@ -1535,32 +3944,10 @@ def admin_break_dashboard():
                     st.session_state.confirm_clear = False
                     st.rerun()
         
-        if selected_date in st.session_state.agent_bookings:
-            bookings_data = []
-            for agent, breaks in st.session_state.agent_bookings[selected_date].items():
-                # Get template name from any break type (they should all be the same)
-                template_name = None
-                for break_type in ['lunch', 'early_tea', 'late_tea']:
-                    if break_type in breaks and isinstance(breaks[break_type], dict):
-                        template_name = breaks[break_type].get('template', 'Unknown')
-                        break
-                
-                # Find a single 'booked_at' value for this agent's booking
-                booked_at = None
-                for btype in ['lunch', 'early_tea', 'late_tea']:
-                    if btype in breaks and isinstance(breaks[btype], dict):
-                        booked_at = breaks[btype].get('booked_at', None)
-                        if booked_at:
-                            break
-                booking = {
-                    "Agent": agent,
-                    "Template": template_name or "Unknown",
-                    "Lunch": breaks.get("lunch", {}).get("time", "-") if isinstance(breaks.get("lunch"), dict) else breaks.get("lunch", "-"),
-                    "Early Tea": breaks.get("early_tea", {}).get("time", "-") if isinstance(breaks.get("early_tea"), dict) else breaks.get("early_tea", "-"),
-                    "Late Tea": breaks.get("late_tea", {}).get("time", "-") if isinstance(breaks.get("late_tea"), dict) else breaks.get("late_tea", "-"),
-                    "Booked At": booked_at or "-"
-                }
-                bookings_data.append(booking)
+        booking_rows = _fetch_booking_rows(selected_date)
+        date_bookings = _booking_rows_to_dict(booking_rows)
+        if date_bookings:
+            bookings_data = booking_table_rows(date_bookings)
             
             if bookings_data:
                 df = pd.DataFrame(bookings_data)
@@ -1575,64 +3962,1246 @@ def admin_break_dashboard():
                         f"break_bookings_{selected_date}.csv",
                         "text/csv"
                     )
+
+                matrix = BookingMatrix.from_rows(selected_date, booking_rows)
+                fill = [
+                    {"Break": break_type.replace("_", " ").title(), "Slot": slot, "Booked": booked}
+                    for (break_type, slot), booked in sorted(matrix.occupancy().items())
+                ]
+                with st.expander("Slot fill"):
+                    st.dataframe(pd.DataFrame(fill), use_container_width=True)
+
+                with st.expander("🔍 Conflict Audit"):
+                    conflicts_df = audit_break_conflicts(selected_date)
+                    if conflicts_df.empty:
+                        st.success(f"No overlapping breaks on {selected_date}.")
+                    else:
+                        st.warning(f"{conflicts_df['Agent'].nunique()} agent(s) have overlapping breaks on {selected_date}.")
+                        st.dataframe(conflicts_df, use_container_width=True)
             else:
                 st.info("No bookings found for this date")
     else:
-        st.info("No bookings available")
+        st.info("No bookings available")
+
+    last_rollover = get_last_rollover()
+    if last_rollover:
+        st.caption(
+            f"Last day rollover: {last_rollover[1]} — archived {last_rollover[3]} bookings "
+            f"from {last_rollover[2]} day(s), cleared {last_rollover[4]} early bookings for {last_rollover[0]}."
+        )
+
+    archived_dates = get_archived_booking_dates()
+    if archived_dates:
+        with st.expander(f"📦 Archived Days ({len(archived_dates)})"):
+            archived_date = st.selectbox(
+                "Select Archived Date:",
+                [date for date, _ in archived_dates],
+                format_func=lambda d: f"{d} ({dict(archived_dates)[d]} bookings)",
+                key="archived_booking_date"
+            )
+            archived_rows = booking_table_rows(get_bookings_for_date(archived_date))
+            if archived_rows:
+                archived_df = pd.DataFrame(archived_rows)
+                st.dataframe(archived_df)
+                st.download_button(
+                    "Download CSV",
+                    archived_df.to_csv(index=False).encode('utf-8'),
+                    f"break_bookings_{archived_date}.csv",
+                    "text/csv",
+                    key="archived_bookings_csv"
+                )
+
+    # Utilization across the whole booking history
+    st.markdown("---")
+    st.subheader("📊 Break Analytics")
+    if st.toggle("Show break analytics", key="show_break_analytics"):
+        analytics = get_break_analytics()
+        if analytics is None:
+            st.info("No bookings stored yet.")
+        else:
+            st.caption(
+                f"{analytics['bookings']:,} bookings over {analytics['days']} days. "
+                "Fill rates are measured against the current slot limits; cached until bookings or templates change."
+            )
+            fill_tab, speed_tab, trend_tab, change_tab = st.tabs(["Fill Rate", "Time to Fill", "Trends", "Template Changes"])
+            with fill_tab:
+                st.caption("Average share of each slot's seats taken, by weekday.")
+                st.dataframe(analytics["fill_rate"], use_container_width=True, column_config={
+                    day: st.column_config.ProgressColumn(day, min_value=0.0, max_value=1.0, format="percent")
+                    for day in analytics["fill_rate"].columns
+                })
+            with speed_tab:
+                st.caption("Median minutes from the day's first booking until the slot was full; blank when it never filled.")
+                longest = float(np.nanmax(analytics["time_to_fill"].to_numpy())) if analytics["time_to_fill"].size else 0.0
+                st.dataframe(analytics["time_to_fill"], use_container_width=True, column_config={
+                    day: st.column_config.ProgressColumn(day, min_value=0.0, max_value=max(1.0, longest), format="%.0f min")
+                    for day in analytics["time_to_fill"].columns
+                })
+                st.write("**Slots that fill first**")
+                st.dataframe(analytics["fill_order"], use_container_width=True)
+            with trend_tab:
+                st.write("**Agents booking per day by template**")
+                st.line_chart(analytics["by_template"])
+                st.write("**Agents booking per day by group**")
+                st.line_chart(analytics["by_group"])
+            with change_tab:
+                st.dataframe(analytics["template_changes"], use_container_width=True)
+
+def time_to_minutes(time_str):
+    """Convert time string (HH:MM) to minutes since midnight"""
+    try:
+        hours, minutes = map(int, time_str.split(':'))
+        return hours * 60 + minutes
+    except:
+        return None
+
+def shift_minutes(time_str, shift_start=SHIFT_START_MINUTE):
+    """Minutes since shift start for an HH:MM time, wrapping past midnight (00:05 -> 545)"""
+    minutes = time_to_minutes(time_str)
+    if minutes is None:
+        return None
+    return (minutes - shift_start) % (24 * 60)
+
+def break_interval(break_type, time_str):
+    """Shift-relative [start, end) minutes of a break, or None for a bad time"""
+    start = shift_minutes(time_str)
+    if start is None:
+        return None
+    return start, start + BREAK_DURATIONS[break_type]
+
+def find_interval_conflicts(intervals):
+    """Sweep (start, end, label) intervals in start order and return overlapping label pairs.
+
+    Each interval is compared with the one reaching furthest so far, so this is
+    O(n log n) rather than comparing every pair.
+    """
+    conflicts = []
+    reach_end, reach_label = None, None
+    for start, end, label in sorted(intervals):
+        if reach_end is not None and start < reach_end:
+            conflicts.append((reach_label, label))
+        if reach_end is None or end > reach_end:
+            reach_end, reach_label = end, label
+    return conflicts
+
+def check_break_conflicts(selected_breaks):
+    """Check for conflicts between selected breaks"""
+    intervals = []
+    for break_type in BREAK_TYPES:
+        slot = selected_breaks.get(break_type)
+        span = break_interval(break_type, slot) if slot else None
+        if span:
+            intervals.append((span[0], span[1], (break_type, slot)))
+
+    conflicts = find_interval_conflicts(intervals)
+    if conflicts:
+        (break1_type, break1_time), (break2_type, break2_time) = conflicts[0]
+        return f"Conflict detected between {break1_type.replace('_', ' ')} ({break1_time}) and {break2_type.replace('_', ' ')} ({break2_time})"
+    return None
+
+def booking_conflict_mask(starts, booked):
+    """Flag every booking that overlaps another break of the same agent, for all agents at once.
+
+    starts is an (agents x BREAK_TYPES) array of shift-relative start minutes and
+    booked says which cells hold a booking. Each row is sorted by start; a booking
+    conflicts if it begins before the furthest end among earlier breaks, or ends
+    after the next break begins.
+    """
+    durations = np.array([BREAK_DURATIONS[b] for b in BREAK_TYPES], dtype=np.int32)
+    far = np.iinfo(np.int32).max // 2
+    starts = np.where(booked, starts, far).astype(np.int32)
+    order = np.argsort(starts, axis=1, kind="stable")
+    sorted_starts = np.take_along_axis(starts, order, axis=1)
+    sorted_booked = np.take_along_axis(booked, order, axis=1)
+    sorted_ends = np.where(sorted_booked, sorted_starts + durations[order], -far)
+
+    reach = np.maximum.accumulate(sorted_ends, axis=1)
+    prev_reach = np.concatenate([np.full((len(starts), 1), -far, dtype=np.int32), reach[:, :-1]], axis=1)
+    next_start = np.concatenate([sorted_starts[:, 1:], np.full((len(starts), 1), far, dtype=np.int32)], axis=1)
+    sorted_flags = sorted_booked & ((sorted_starts < prev_reach) | (sorted_ends > next_start))
+
+    flags = np.zeros_like(sorted_flags)
+    np.put_along_axis(flags, order, sorted_flags, axis=1)
+    return flags
+
+def audit_break_conflicts(date):
+    """Whole-floor audit: one row per conflicting booking on date, found in one vectorized pass"""
+    matrix = get_booking_matrix(date)
+    if not len(matrix):
+        return pd.DataFrame(columns=["Agent", "Break", "Slot", "Ends", "Template"])
+    flags = matrix.conflict_mask()
+    agents, columns = np.nonzero(flags)
+    records = []
+    for a, b in zip(agents, columns):
+        break_type = BREAK_TYPES[b]
+        slot = matrix.slots[matrix.slot_index[a, b]]
+        end = (time_to_minutes(slot) + BREAK_DURATIONS[break_type]) % (24 * 60)
+        records.append({
+            "Agent": matrix.agents[a],
+            "Break": break_type.replace("_", " ").title(),
+            "Slot": slot,
+            "Ends": f"{end // 60:02d}:{end % 60:02d}",
+            "Template": matrix.templates[matrix.template_index[a]]
+        })
+    return pd.DataFrame(records)
+
+# --------------------------
+# Bulk Break Assignment
+# --------------------------
+
+ASSIGNMENT_TIMELINE_MINUTES = 24 * 60 + max(BREAK_DURATIONS.values())
+
+def template_slot_lists(template):
+    return {
+        "lunch": list(template.get("lunch_breaks", [])),
+        "early_tea": list(template.get("tea_breaks", {}).get("early", [])),
+        "late_tea": list(template.get("tea_breaks", {}).get("late", []))
+    }
+
+class _TemplateSlots:
+    """Slot intervals of one template as arrays, with the conflict-free slot combinations"""
+
+    def __init__(self, name, template, limits, occupancy):
+        self.name = name
+        slot_lists = template_slot_lists(template)
+        self.break_types = [b for b in BREAK_TYPES if slot_lists[b]]
+        self.slots, self.masks, self.spans, self.remaining = {}, {}, {}, {}
+        for break_type in self.break_types:
+            slots = [slot for slot in slot_lists[break_type] if break_interval(break_type, slot)]
+            spans = np.array([break_interval(break_type, slot) for slot in slots], dtype=np.int32).reshape(-1, 2)
+            minutes = np.arange(ASSIGNMENT_TIMELINE_MINUTES)
+            self.slots[break_type] = slots
+            self.spans[break_type] = spans
+            self.masks[break_type] = (minutes >= spans[:, :1]) & (minutes < spans[:, 1:])
+            self.remaining[break_type] = np.array([
+                limits.get(break_type, {}).get(slot, DEFAULT_SLOT_LIMITS[break_type])
+                - occupancy.get((name, break_type, slot), 0)
+                for slot in slots
+            ], dtype=np.int32)
+
+        # feasible[i, j, k] is True when the chosen slots of the break types don't overlap
+        shape = [len(self.slots[b]) for b in self.break_types]
+        self.feasible = np.ones(shape, dtype=bool)
+        for x, bx in enumerate(self.break_types):
+            for y in range(x + 1, len(self.break_types)):
+                by = self.break_types[y]
+                sx, sy = self.spans[bx], self.spans[by]
+                clash = (sx[:, None, 0] < sy[None, :, 1]) & (sy[None, :, 0] < sx[:, None, 1])
+                index = [None] * len(shape)
+                index[x], index[y] = slice(None), slice(None)
+                self.feasible &= ~clash[tuple(index)]
+
+    def _grid(self, per_type):
+        """Broadcast one vector per break type into the combination grid"""
+        grids = []
+        for position, values in enumerate(per_type):
+            shape = [1] * len(per_type)
+            shape[position] = len(values)
+            grids.append(np.asarray(values).reshape(shape))
+        return grids
+
+    def choose(self, absence, preference=None, first_come=False):
+        """Pick slot indices for one agent, or None when nothing fits.
+
+        Minimises the highest floor absence the agent's breaks would touch, then
+        prefers the agent's wishes, then the least busy slots overall. With
+        first_come the earliest open combination is taken instead, as agents do
+        when booking by hand.
+        """
+        if not self.break_types:
+            return None
+        peaks = [np.where(self.masks[b], absence, -1).max(axis=1).astype(np.int64) for b in self.break_types]
+        opens = [self.remaining[b] > 0 for b in self.break_types]
+        allowed = self.feasible.copy()
+        for open_grid in self._grid(opens):
+            allowed = allowed & open_grid
+        if not allowed.any():
+            return None
+        if first_come:
+            return np.unravel_index(np.flatnonzero(allowed)[0], allowed.shape)
+
+        peak_grids = self._grid(peaks)
+        score = np.maximum.reduce(np.broadcast_arrays(*peak_grids)) * 100_000_000
+        score = score + sum(np.broadcast_arrays(*peak_grids))
+        if preference:
+            wished = [np.array([preference.get(b) == slot for slot in self.slots[b]]) for b in self.break_types]
+            score = score - sum(np.broadcast_arrays(*self._grid(wished))).astype(np.int64) * 10_000_000
+        score = np.where(allowed, score, np.iinfo(np.int64).max)
+        return np.unravel_index(int(np.argmin(score)), score.shape)
+
+    def take(self, choice, absence):
+        picked = {}
+        for break_type, k in zip(self.break_types, choice):
+            start, end = self.spans[break_type][k]
+            absence[start:end] += 1
+            self.remaining[break_type][k] -= 1
+            picked[break_type] = self.slots[break_type][k]
+        return picked
+
+def absence_lower_bound(demands, windows, base_absence):
+    """Smallest peak any assignment could reach.
+
+    demands maps break type to total break minutes still to place and windows
+    maps it to a timeline mask of where those breaks may fall. For every set of
+    break types, their minutes (plus absence already booked there) must fit
+    inside the union of their windows.
+    """
+    bound = int(base_absence.max()) if len(base_absence) else 0
+    types = [b for b in demands if demands[b] and windows[b].any()]
+    for size in range(1, len(types) + 1):
+        for subset in itertools.combinations(types, size):
+            window = np.logical_or.reduce([windows[b] for b in subset])
+            minutes = sum(demands[b] for b in subset) + int(base_absence[window].sum())
+            bound = max(bound, -(-minutes // int(window.sum())))
+    return bound
+
+def occupancy_to_absence(occupancy):
+    """Per-minute floor absence implied by already booked slots"""
+    absence = np.zeros(ASSIGNMENT_TIMELINE_MINUTES, dtype=np.int32)
+    for (template_name, break_type, slot), booked in occupancy.items():
+        span = break_interval(break_type, slot) if break_type in BREAK_DURATIONS else None
+        if span and booked > 0:
+            absence[span[0]:span[1]] += booked
+    return absence
+
+def solve_break_assignment(agents, templates, limits, occupancy=None, preferences=None, first_come=False,
+                           scope_absence=None):
+    """Assign every agent a conflict-free set of breaks, keeping peak floor absence low.
+
+    agents is a list of (agent, template_name); limits is {template: {break_type:
+    {slot: limit}}}; occupancy holds seats already booked as {(template,
+    break_type, slot): booked}; preferences is an optional {agent: {break_type:
+    slot}}. Agents are placed greedily, each into the combination whose busiest
+    minute is least busy. Returns the assignment, unassigned agents, the
+    per-minute absence curve, the achieved peak and a lower bound on the peak
+    for the agents that were placed.
+
+    scope_absence optionally maps floor cap scopes to the per-minute absence
+    already booked in each; the placed agents count toward every scope, and
+    "peaks" reports each scope's resulting peak so it can be held to its own cap.
+    """
+    occupancy = occupancy or {}
+    preferences = preferences or {}
+    absence = occupancy_to_absence(occupancy)
+    base_absence = absence.copy()
+    compiled = {}
+    assignment, unassigned = {}, []
+    demands = {b: 0 for b in BREAK_TYPES}
+    windows = {b: np.zeros(ASSIGNMENT_TIMELINE_MINUTES, dtype=bool) for b in BREAK_TYPES}
+
+    for agent, template_name in agents:
+        if template_name not in templates:
+            unassigned.append((agent, "template not found"))
+            continue
+        if template_name not in compiled:
+            compiled[template_name] = _TemplateSlots(
+                template_name, templates[template_name], limits.get(template_name, {}), occupancy
+            )
+            for b in compiled[template_name].break_types:
+                windows[b] |= compiled[template_name].masks[b].any(axis=0)
+        slots = compiled[template_name]
+        choice = slots.choose(absence, preferences.get(agent), first_come=first_come)
+        if choice is None:
+            unassigned.append((agent, "no open conflict-free slots"))
+            continue
+        assignment[agent] = (template_name, slots.take(choice, absence))
+        for b in slots.break_types:
+            demands[b] += BREAK_DURATIONS[b]
+
+    added = absence - base_absence
+    return {
+        "assignment": assignment,
+        "unassigned": unassigned,
+        "absence": absence,
+        "peak": int(absence.max()),
+        "peaks": {scope: int((booked + added).max()) for scope, booked in (scope_absence or {}).items()},
+        "lower_bound": absence_lower_bound(demands, windows, base_absence)
+    }
+
+def get_occupancy_for_date(date):
+    """Return {(template, break_type, slot): booked} for every template on date"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT template, break_type, slot, booked FROM break_slot_occupancy WHERE date = ? AND booked > 0",
+            (date,)
+        )
+        return {(template, break_type, slot): booked for template, break_type, slot, booked in cursor.fetchall()}
+    finally:
+        conn.close()
+
+def get_group_roster(group_name, active_templates):
+    """Agents of a group who have not booked today, with the first active template assigned to them"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT u.username, t.name FROM users u
+            LEFT JOIN agent_templates a ON a.user_id = u.id
+            LEFT JOIN break_templates t ON t.id = a.template_id
+            WHERE u.role = 'agent' AND u.group_name = ?
+            ORDER BY u.username, t.id
+        """, (group_name,))
+        assignments = {}
+        for username, template_name in cursor.fetchall():
+            assignments.setdefault(username, [])
+            if template_name:
+                assignments[username].append(template_name)
+        roster, skipped = [], []
+        for username, assigned in assignments.items():
+            usable = [t for t in assigned if t in active_templates]
+            if usable:
+                roster.append((username, usable[0]))
+            else:
+                skipped.append((username, "no active template assigned"))
+        return roster, skipped
+    finally:
+        conn.close()
+
+def apply_break_assignment(date, assignment, limit_for=get_slot_limit, connect=get_db_connection):
+    """Write a solver assignment as bookings, all or nothing, in one transaction.
+
+    Seats are claimed like book_agent_breaks does: a slot counter is only
+    bumped while it is below limit_for(template, break_type, slot), so agents
+    who booked since the preview are never pushed past a limit. Floor caps are
+    checked agent by agent against the day's bookings plus the ones before it.
+    Returns ("booked", None), ("full", (agent, break_type, slot)),
+    ("cap", (agent, scope, cap)) or ("exists", None).
+    """
+    booked_at = get_casablanca_time()
+    rows = [
+        (date, agent, break_type, slot, template_name, booked_at)
+        for agent, (template_name, picked) in assignment.items()
+        for break_type, slot in picked.items()
+    ]
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        occupancies = {}
+        for agent, (_, picked) in assignment.items():
+            spans = [span for span in (break_interval(b, slot) for b, slot in picked.items()) if span]
+            for scope, cap in _applicable_floor_caps(cursor, agent):
+                if scope not in occupancies:
+                    occupancies[scope] = FloorOccupancy(_load_floor_spans(cursor, date, scope))
+                away = occupancies[scope]
+                if any(away.peak_in(*span) >= cap for span in spans):
+                    conn.rollback()
+                    return "cap", (agent, scope, cap)
+                for span in spans:
+                    away.add(*span)
+        for _, agent, break_type, slot, template_name, _ in rows:
+            cursor.execute("""
+                INSERT OR IGNORE INTO break_slot_occupancy (date, template, break_type, slot, booked)
+                VALUES (?, ?, ?, ?, 0)
+            """, (date, template_name, break_type, slot))
+            cursor.execute("""
+                UPDATE break_slot_occupancy SET booked = booked + 1
+                WHERE date = ? AND template = ? AND break_type = ? AND slot = ? AND booked < ?
+            """, (date, template_name, break_type, slot, limit_for(template_name, break_type, slot)))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return "full", (agent, break_type, slot)
+        cursor.executemany("""
+            INSERT INTO break_bookings (date, agent, break_type, slot, template, booked_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        return "booked", None
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return "exists", None
+    finally:
+        conn.close()
+
+# --------------------------
+# Live Floor Board
+# --------------------------
+
+FLOOR_BOARD_HORIZON = 15  # minutes of upcoming breaks shown on the floor board
+
+class FloorTimeline:
+    """One day's breaks as shift-relative intervals sorted by start.
+
+    No break lasts longer than the longest duration, so the breaks running at
+    minute m are the ones starting in (m - longest, m]: two binary searches
+    instead of a scan of every agent. Absence per minute is a prefix sum of
+    +1/-1 edges, so the headcount at any minute is a lookup.
+    """
+
+    def __init__(self, date, rows):
+        records = []
+        for agent, break_type, slot, template, _ in rows:
+            span = break_interval(break_type, slot) if break_type in BREAK_DURATIONS else None
+            if span:
+                records.append((span[0], span[1], agent, break_type, slot, template))
+        records.sort()
+        self.date = date
+        self.records = records
+        self.longest = max(BREAK_DURATIONS.values())
+        self.starts = np.array([r[0] for r in records], dtype=np.int32)
+        self.ends = np.array([r[1] for r in records], dtype=np.int32)
+        edges = np.zeros(ASSIGNMENT_TIMELINE_MINUTES + 1, dtype=np.int32)
+        np.add.at(edges, self.starts, 1)
+        np.add.at(edges, self.ends, -1)
+        self.absence = np.cumsum(edges[:-1])
+
+    def __len__(self):
+        return len(self.records)
+
+    def on_break(self, minute):
+        """Breaks running at a shift minute"""
+        lo = np.searchsorted(self.starts, minute - self.longest, side="right")
+        hi = np.searchsorted(self.starts, minute, side="right")
+        return [self.records[i] for i in range(lo, hi) if self.ends[i] > minute]
+
+    def upcoming(self, minute, horizon=FLOOR_BOARD_HORIZON):
+        """Breaks starting in (minute, minute + horizon]"""
+        lo = np.searchsorted(self.starts, minute, side="right")
+        hi = np.searchsorted(self.starts, minute + horizon, side="right")
+        return self.records[lo:hi]
+
+    def away_at(self, minute):
+        return int(self.absence[minute]) if 0 <= minute < len(self.absence) else 0
+
+    def peak(self):
+        """(headcount, first shift minute it is reached)"""
+        if not self.records:
+            return 0, None
+        minute = int(self.absence.argmax())
+        return int(self.absence[minute]), minute
+
+def get_group_members(group_name):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT username FROM users WHERE group_name = ?", (group_name,))
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+def _booking_stamp(cursor, date):
+    cursor.execute("""
+        SELECT COUNT(*), TOTAL(rowid),
+               (SELECT booking_count FROM break_bookings_archive WHERE date = ?)
+        FROM break_bookings WHERE date = ?
+    """, (date, date))
+    return cursor.fetchone()
+
+def get_booking_stamp(date):
+    """Cheap fingerprint of a date's bookings; changes whenever one is added or removed"""
+    conn = get_db_connection()
+    try:
+        return _booking_stamp(conn.cursor(), date)
+    finally:
+        conn.close()
+
+@st.cache_resource(max_entries=16)
+def _cached_floor_timeline(date, group_name, stamp):
+    rows = _fetch_booking_rows(date)
+    if group_name:
+        members = get_group_members(group_name)
+        rows = [row for row in rows if row[0] in members]
+    return FloorTimeline(date, rows)
+
+def get_floor_timeline(date, group_name=None):
+    """Shared timeline for a date and group, rebuilt only when that date's bookings change"""
+    return _cached_floor_timeline(date, group_name, get_booking_stamp(date))
+
+def floor_board_rows(records, minute, upcoming=False):
+    rows = []
+    for start, end, agent, break_type, slot, template in records:
+        row = {"Agent": agent, "Break": BREAK_TYPE_LABELS[break_type], "Template": template,
+               "Start": slot, "Ends": format_break_minutes(end + SHIFT_START_MINUTE)}
+        if upcoming:
+            row["Starts In (min)"] = start - minute
+        else:
+            row["Minutes Left"] = end - minute
+        rows.append(row)
+    return rows
+
+# --------------------------
+# Floor Break Caps
+# --------------------------
+
+FLOOR_SCOPE = "*"  # break_floor_caps scope covering every agent
+
+class MaxSegmentTree:
+    """Integer array with range add and range max, both O(log n).
+
+    Each node keeps the max of its range plus an add still owed to its whole
+    subtree, so updates never have to be pushed down to the leaves.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.peak = [0] * (4 * size)
+        self.pending = [0] * (4 * size)
+
+    def add(self, lo, hi, delta, node=1, left=0, right=None):
+        """Add delta to entries lo..hi-1"""
+        right = self.size if right is None else right
+        if hi <= left or right <= lo:
+            return
+        if lo <= left and right <= hi:
+            self.peak[node] += delta
+            self.pending[node] += delta
+            return
+        mid = (left + right) // 2
+        self.add(lo, hi, delta, 2 * node, left, mid)
+        self.add(lo, hi, delta, 2 * node + 1, mid, right)
+        self.peak[node] = self.pending[node] + max(self.peak[2 * node], self.peak[2 * node + 1])
+
+    def max(self, lo, hi, node=1, left=0, right=None):
+        """Largest of entries lo..hi-1 (lo < hi)"""
+        right = self.size if right is None else right
+        if lo <= left and right <= hi:
+            return self.peak[node]
+        mid = (left + right) // 2
+        if hi <= mid:
+            best = self.max(lo, hi, 2 * node, left, mid)
+        elif lo >= mid:
+            best = self.max(lo, hi, 2 * node + 1, mid, right)
+        else:
+            best = max(self.max(lo, hi, 2 * node, left, mid), self.max(lo, hi, 2 * node + 1, mid, right))
+        return self.pending[node] + best
+
+class FloorOccupancy:
+    """Agents away per shift minute, kept in a max segment tree.
+
+    Adding a booking is one range add and the peak over a break is one range
+    max, both O(log n), so checking a break against a cap never rescans the day.
+    """
+
+    def __init__(self, spans=()):
+        self.minutes = MaxSegmentTree(ASSIGNMENT_TIMELINE_MINUTES)
+        for start, end in spans:
+            self.add(start, end)
+
+    def add(self, start, end, delta=1):
+        self.minutes.add(start, end, delta)
+
+    def away_at(self, minute):
+        return self.minutes.max(minute, minute + 1)
+
+    def peak_in(self, start, end):
+        """Most agents away at any minute of [start, end)"""
+        return self.minutes.max(start, end) if start < end else 0
+
+def _load_floor_spans(cursor, date, scope):
+    if scope == FLOOR_SCOPE:
+        cursor.execute("SELECT break_type, slot FROM break_bookings WHERE date = ?", (date,))
+    else:
+        cursor.execute("""
+            SELECT b.break_type, b.slot FROM break_bookings b
+            JOIN users u ON u.username = b.agent
+            WHERE b.date = ? AND u.group_name = ?
+        """, (date, scope))
+    spans = (break_interval(break_type, slot) for break_type, slot in cursor.fetchall() if break_type in BREAK_DURATIONS)
+    return [span for span in spans if span]
+
+class FloorCapIndex:
+    """FloorOccupancy per (date, scope), shared by every booking transaction.
+
+    An entry is trusted while the date's booking stamp matches; bookings made
+    through book_agent_breaks are added in place, anything else (bulk assign,
+    clearing, rollover) changes the stamp and the entry is rebuilt once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.rebuilds = 0
+        self.updates = 0
+
+    def occupancy(self, cursor, date, scope, stamp):
+        with self._lock:
+            entry = self._entries.get((date, scope))
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+        away = FloorOccupancy(_load_floor_spans(cursor, date, scope))
+        with self._lock:
+            self._entries = {key: value for key, value in self._entries.items() if key[0] == date}
+            self._entries[(date, scope)] = (stamp, away)
+            self.rebuilds += 1
+        return away
+
+    def record(self, date, scope, spans, old_stamp, new_stamp):
+        """Add a committed booking, unless the entry was already rebuilt past it"""
+        with self._lock:
+            entry = self._entries.get((date, scope))
+            if entry is None or entry[0] != old_stamp:
+                return
+            for start, end in spans:
+                entry[1].add(start, end)
+            self._entries[(date, scope)] = (new_stamp, entry[1])
+            self.updates += 1
+
+    def stats(self):
+        with self._lock:
+            return {"Cached scopes": len(self._entries), "Hits": self.hits,
+                    "Rebuilds": self.rebuilds, "In-place updates": self.updates}
+
+@st.cache_resource
+def get_floor_cap_index():
+    return FloorCapIndex()
+
+def _applicable_floor_caps(cursor, agent):
+    """[(scope, max_away)] for the whole-floor cap and the agent's group cap, if set"""
+    cursor.execute("SELECT scope, max_away FROM break_floor_caps WHERE max_away > 0")
+    caps = dict(cursor.fetchall())
+    if not caps:
+        return []
+    applicable = [(FLOOR_SCOPE, caps[FLOOR_SCOPE])] if FLOOR_SCOPE in caps else []
+    cursor.execute("SELECT group_name FROM users WHERE username = ?", (agent,))
+    row = cursor.fetchone()
+    if row and row[0] in caps:
+        applicable.append((row[0], caps[row[0]]))
+    return applicable
+
+def get_floor_absence(date, scope):
+    """Per-minute absence already booked on date in a floor cap scope"""
+    conn = get_db_connection()
+    try:
+        spans = _load_floor_spans(conn.cursor(), date, scope)
+    finally:
+        conn.close()
+    absence = np.zeros(ASSIGNMENT_TIMELINE_MINUTES, dtype=np.int32)
+    for start, end in spans:
+        absence[start:end] += 1
+    return absence
 
-def time_to_minutes(time_str):
-    """Convert time string (HH:MM) to minutes since midnight"""
+def get_floor_caps():
+    """{scope: max_away} for every configured cap"""
+    conn = get_db_connection()
     try:
-        hours, minutes = map(int, time_str.split(':'))
-        return hours * 60 + minutes
-    except:
-        return None
+        cursor = conn.cursor()
+        cursor.execute("SELECT scope, max_away FROM break_floor_caps")
+        return dict(cursor.fetchall())
+    finally:
+        conn.close()
 
-def times_overlap(time1, time2, duration_minutes=15):
-    """Check if two time slots overlap, assuming each break is duration_minutes long"""
-    t1 = time_to_minutes(time1)
-    t2 = time_to_minutes(time2)
-    
-    if t1 is None or t2 is None:
+def set_floor_cap(scope, max_away):
+    """Set a group's (or FLOOR_SCOPE's) cap; 0 removes it"""
+    if is_killswitch_enabled():
+        st.error("System is currently locked. Please contact the developer.")
         return False
-        
-    # Check if the breaks overlap
-    return abs(t1 - t2) < duration_minutes
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if max_away > 0:
+            cursor.execute("""
+                INSERT INTO break_floor_caps (scope, max_away, updated_at, updated_by) VALUES (?, ?, ?, ?)
+                ON CONFLICT(scope) DO UPDATE SET
+                    max_away = excluded.max_away, updated_at = excluded.updated_at, updated_by = excluded.updated_by
+            """, (scope, int(max_away), get_casablanca_time(), st.session_state.get("username")))
+        else:
+            cursor.execute("DELETE FROM break_floor_caps WHERE scope = ?", (scope,))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
 
-def check_break_conflicts(selected_breaks):
-    """Check for conflicts between selected breaks"""
-    times = []
-    
-    # Collect all selected break times
-    if selected_breaks.get("lunch"):
-        times.append(("lunch", selected_breaks["lunch"]))
-    if selected_breaks.get("early_tea"):
-        times.append(("early_tea", selected_breaks["early_tea"]))
-    if selected_breaks.get("late_tea"):
-        times.append(("late_tea", selected_breaks["late_tea"]))
-    
-    # Check each pair of breaks for overlap
-    for i in range(len(times)):
-        for j in range(i + 1, len(times)):
-            break1_type, break1_time = times[i]
-            break2_type, break2_time = times[j]
-            
-            if times_overlap(break1_time, break2_time, 30 if "lunch" in (break1_type, break2_type) else 15):
-                return f"Conflict detected between {break1_type.replace('_', ' ')} ({break1_time}) and {break2_type.replace('_', ' ')} ({break2_time})"
-    
-    return None
+def get_agent_floor_caps(date, agent):
+    """[(scope, max_away, FloorOccupancy)] for the caps that apply to an agent on date"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        caps = _applicable_floor_caps(cursor, agent)
+        if not caps:
+            return []
+        stamp = _booking_stamp(cursor, date)
+        index = get_floor_cap_index()
+        return [(scope, cap, index.occupancy(cursor, date, scope, stamp)) for scope, cap in caps]
+    finally:
+        conn.close()
+
+def floor_cap_room(floor_caps, break_type, slot):
+    """Seats left under every applicable cap for one break, or None when uncapped"""
+    span = break_interval(break_type, slot) if floor_caps else None
+    if span is None:
+        return None
+    return min(cap - away.peak_in(*span) for _, cap, away in floor_caps)
+
+def describe_floor_caps(floor_caps):
+    return " and ".join(
+        f"{cap} of the whole floor" if scope == FLOOR_SCOPE else f"{cap} of {scope}"
+        for scope, cap, _ in floor_caps
+    )
+
+# --------------------------
+# Break Punches & Adherence
+# --------------------------
+
+LATE_START_GRACE = 2  # minutes after the booked time before a start counts as late
+OVERRUN_GRACE = 1     # minutes past the break's length before it counts as an overrun
+FORBIDDEN_BREAK_START = shift_minutes("23:00")  # no break in the last hour of the shift
+FORBIDDEN_BREAK_END = FORBIDDEN_BREAK_START + 60
+
+def get_agent_punches(date, agent):
+    """{break_type: {"start": minute, "end": minute}} in shift minutes for one agent"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT break_type, event, minute FROM break_punches WHERE date = ? AND agent = ? ORDER BY id",
+            (date, agent)
+        )
+        punches = {}
+        for break_type, event, minute in cursor.fetchall():
+            punches.setdefault(break_type, {})[event] = minute
+        return punches
+    finally:
+        conn.close()
 
-def refresh_break_data():
-    """Refresh break data from the database files"""
+def punch_break(agent, break_type, event, now=None):
+    """Append a start or end punch for a booked break; returns "ok" or why it was refused.
+
+    Punches are keyed on the booking day of now, so a break that ends after
+    midnight is closed on the day it started.
+    """
+    now = now or casablanca_now()
+    date = booking_date(now)
+    conn = get_db_connection()
     try:
-        if os.path.exists('all_bookings.json'):
-            with open('all_bookings.json', 'r') as f:
-                # Only update if the file has content
-                content = f.read()
-                if content.strip():
-                    st.session_state.agent_bookings = json.loads(content)
-    except Exception as e:
-        st.error(f"Error refreshing break data: {str(e)}")
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "SELECT break_type, event FROM break_punches WHERE date = ? AND agent = ?",
+            (date, agent)
+        )
+        punched = set(cursor.fetchall())
+        started = {bt for bt, ev in punched if ev == "start"}
+        running = started - {bt for bt, ev in punched if ev == "end"}
+        if event == "start":
+            cursor.execute(
+                "SELECT 1 FROM break_bookings WHERE date = ? AND agent = ? AND break_type = ?",
+                (date, agent, break_type)
+            )
+            if cursor.fetchone() is None:
+                reason = "not booked"
+            elif break_type in started:
+                reason = "already taken"
+            elif running:
+                reason = "another break is still running"
+            else:
+                reason = None
+        else:
+            reason = None if break_type in running else "not started"
+        if reason:
+            conn.rollback()
+            return reason
+        cursor.execute("""
+            INSERT INTO break_punches (date, agent, break_type, event, minute, punched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (date, agent, break_type, event, shift_minutes(now.strftime("%H:%M")), now.strftime("%Y-%m-%d %H:%M:%S")))
+        conn.commit()
+        return "ok"
+    finally:
+        conn.close()
+
+class AdherenceTracker:
+    """Live adherence for one day, folded forward from the punch log.
+
+    poll() only reads punches with an id above the last one seen and updates
+    the affected break in place. Each punched break is one slot in parallel
+    arrays (booked, started and ended shift minutes), so the adherence figures
+    for the whole floor are computed column-wise rather than agent by agent.
+    Booked slots come from live bookings, or from the archive once the 11:59
+    rollover has moved the day there.
+    """
+
+    def __init__(self, date, capacity=256):
+        self.date = date
+        self.last_id = 0
+        self.events = 0
+        self._lock = threading.Lock()
+        self.archived_slots = None
+        self.rows = {}
+        self.agents = []
+        self.break_codes = np.zeros(capacity, dtype=np.int8)
+        self.booked = np.full(capacity, -1, dtype=np.int32)
+        self.started = np.full(capacity, -1, dtype=np.int32)
+        self.ended = np.full(capacity, -1, dtype=np.int32)
+
+    def _row(self, agent, break_type, slot):
+        key = (agent, break_type)
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.agents)
+            if row == len(self.booked):
+                self.break_codes = np.concatenate([self.break_codes, np.zeros(row, dtype=np.int8)])
+                for name in ("booked", "started", "ended"):
+                    setattr(self, name, np.concatenate([getattr(self, name), np.full(row, -1, dtype=np.int32)]))
+            self.agents.append(agent)
+            self.break_codes[row] = BREAK_TYPES.index(break_type)
+            booked = shift_minutes(slot) if slot else None
+            self.booked[row] = -1 if booked is None else booked
+        return row
+
+    def apply(self, agent, break_type, event, minute, slot=None):
+        if break_type not in BREAK_DURATIONS:
+            return
+        row = self._row(agent, break_type, slot)
+        (self.started if event == "start" else self.ended)[row] = minute
+        self.events += 1
+
+    def poll(self, cursor):
+        with self._lock:
+            cursor.execute("""
+                SELECT p.id, p.agent, p.break_type, p.event, p.minute, b.slot
+                FROM break_punches p
+                LEFT JOIN break_bookings b
+                    ON b.date = p.date AND b.agent = p.agent AND b.break_type = p.break_type
+                WHERE p.date = ? AND p.id > ?
+                ORDER BY p.id
+            """, (self.date, self.last_id))
+            for punch_id, agent, break_type, event, minute, slot in cursor.fetchall():
+                if slot is None and (agent, break_type) not in self.rows:
+                    slot = self._archived_slot(cursor, agent, break_type)
+                self.apply(agent, break_type, event, minute, slot)
+                self.last_id = punch_id
+
+    def _archived_slot(self, cursor, agent, break_type):
+        """Booked slot from the day's archive partition, decompressed once it exists"""
+        if self.archived_slots is None:
+            cursor.execute("SELECT payload FROM break_bookings_archive WHERE date = ?", (self.date,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            self.archived_slots = {
+                (booked_agent, booked_type): slot
+                for booked_agent, booked_type, slot, _, _ in decompress_archive_payload(row[0])
+            }
+        return self.archived_slots.get((agent, break_type))
+
+    def frame(self, now_minute=None):
+        """One row per punched break with late start, overrun and last-hour flags"""
+        with self._lock:
+            n = len(self.agents)
+            agents = list(self.agents)
+            codes = self.break_codes[:n].copy()
+            booked, started, ended = self.booked[:n].copy(), self.started[:n].copy(), self.ended[:n].copy()
+        durations = np.array([BREAK_DURATIONS[b] for b in BREAK_TYPES], dtype=np.int32)[codes]
+        running = (started >= 0) & (ended < 0)
+        until = np.where(running, started if now_minute is None else np.maximum(started, now_minute), ended)
+        late = np.where((booked >= 0) & (started >= 0), started - booked, 0)
+        overrun = np.where(started >= 0, until - started - durations, 0)
+        return pd.DataFrame({
+            "Agent": agents,
+            "Break": np.array([BREAK_TYPE_LABELS[b] for b in BREAK_TYPES], dtype=object)[codes],
+            "Booked": booked,
+            "Started": started,
+            "Ended": ended,
+            "Running": running,
+            "Late Minutes": np.maximum(late, 0),
+            "Overrun Minutes": np.maximum(overrun, 0),
+            "Late Start": late > LATE_START_GRACE,
+            "Overrun": overrun > OVERRUN_GRACE,
+            "Last Hour": (started >= 0) & (started < FORBIDDEN_BREAK_END) & (until > FORBIDDEN_BREAK_START)
+        })
+
+@st.cache_resource(max_entries=4)
+def get_adherence_tracker(date):
+    return AdherenceTracker(date)
+
+def get_live_adherence(date, now_minute=None):
+    """Adherence frame for date after folding in any punches since the last call"""
+    tracker = get_adherence_tracker(date)
+    conn = get_db_connection()
+    try:
+        tracker.poll(conn.cursor())
+    finally:
+        conn.close()
+    return tracker.frame(now_minute)
+
+def get_punch_dates():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT date FROM break_punches ORDER BY date")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def summarize_adherence(frame):
+    """Per-agent totals of an adherence frame, aggregated with one groupby"""
+    if frame.empty:
+        return frame
+    return frame.groupby("Agent", sort=True).agg(**{
+        "Breaks": ("Break", "size"),
+        "Late Starts": ("Late Start", "sum"),
+        "Late Minutes": ("Late Minutes", "sum"),
+        "Overruns": ("Overrun", "sum"),
+        "Overrun Minutes": ("Overrun Minutes", "sum"),
+        "Last Hour": ("Last Hour", "sum")
+    }).reset_index()
+
+def adherence_display(frame):
+    """Violations only, with shift minutes shown as clock times"""
+    flagged = frame[frame["Late Start"] | frame["Overrun"] | frame["Last Hour"]].copy()
+    for column in ("Booked", "Started", "Ended"):
+        flagged[column] = [format_break_minutes(m + SHIFT_START_MINUTE) if m >= 0 else "-" for m in flagged[column]]
+    return flagged
+
+# --------------------------
+# Break Capacity Planner
+# --------------------------
+
+PLANNER_HISTORY_DAYS = 30  # most recent archived booking days used for slot preferences
+
+def get_booking_history(max_days=PLANNER_HISTORY_DAYS):
+    """{(template, break_type, minute): times booked} over recent archived days and live bookings"""
+    history = {}
+
+    def count(template, break_type, slot, times=1):
+        try:
+            key = (template or "Default Template", break_type, parse_break_time(slot))
+        except ValueError:
+            return
+        history[key] = history.get(key, 0) + times
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT payload FROM break_bookings_archive ORDER BY date DESC LIMIT ?", (max_days,))
+        for (payload,) in cursor.fetchall():
+            for _, break_type, slot, template, _ in decompress_archive_payload(payload):
+                count(template, break_type, slot)
+        cursor.execute("SELECT template, break_type, slot, COUNT(*) FROM break_bookings GROUP BY template, break_type, slot")
+        for template, break_type, slot, times in cursor.fetchall():
+            count(template, break_type, slot, times)
+        return history
+    finally:
+        conn.close()
+
+def get_template_headcounts():
+    """{template: agents assigned}, agents on several templates counted once per template"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT t.name, COUNT(*) FROM agent_templates a
+            JOIN break_templates t ON t.id = a.template_id
+            JOIN users u ON u.id = a.user_id
+            WHERE u.role = 'agent'
+            GROUP BY t.name
+        """)
+        return dict(cursor.fetchall())
+    finally:
+        conn.close()
+
+def simulate_break_capacity(compiled, shares, history, headcount, days=5000, service_level=95, seed=None):
+    """Monte Carlo of break demand over many shift days, all days drawn at once.
+
+    Each day splits headcount across templates by shares, then each template's
+    agents across its slots by the historical booking mix (a half booking of
+    smoothing keeps unseen slots possible). Demand is unconstrained by limits,
+    so it shows what agents would pick. Returns per-minute percentiles of agents
+    away, and per slot the current limit, the limit that covers demand on
+    service_level percent of days, and how often the current limit overflows.
+    """
+    rng = np.random.default_rng(seed)
+    names = [name for name in compiled if shares.get(name, 0) > 0]
+    if not names or headcount <= 0:
+        return None
+    started = perf_counter()
+    weights = np.array([shares[name] for name in names], dtype=float)
+    per_template = rng.multinomial(headcount, weights / weights.sum(), size=days)
+
+    spans = [
+        (t, name, break_type, (compiled[name].minutes[break_type].astype(np.int32) - SHIFT_START_MINUTE) % MINUTES_PER_DAY)
+        for t, name in enumerate(names) for break_type in BREAK_TYPES if len(compiled[name].minutes[break_type])
+    ]
+    first = min(int(starts.min()) for *_, starts in spans)
+    last = max(int(starts.max()) + BREAK_DURATIONS[break_type] for _, _, break_type, starts in spans)
+    away = np.zeros((days, last - first), dtype=np.float32)
+    slot_rows = []
+    for t, name, break_type, starts in spans:
+        minutes = compiled[name].minutes[break_type]
+        mix = np.array([history.get((name, break_type, int(m)), 0) for m in minutes], dtype=float) + 0.5
+        counts = rng.multinomial(per_template[:, t], mix / mix.sum())
+        cover = np.zeros((len(starts), last - first), dtype=np.float32)
+        for k, start in enumerate(starts):
+            cover[k, start - first:start - first + BREAK_DURATIONS[break_type]] = 1
+        away += counts.astype(np.float32) @ cover
+
+        limits = compiled[name].limits[break_type]
+        recommended = np.ceil(np.percentile(counts, service_level, axis=0)).astype(int)
+        overflow = (counts > limits).mean(axis=0)
+        median = np.median(counts, axis=0)
+        for k, m in enumerate(minutes):
+            slot_rows.append({
+                "Template": name,
+                "Break": BREAK_TYPE_LABELS[break_type],
+                "Slot": format_break_minutes(m),
+                "Median Demand": float(median[k]),
+                "Current Limit": int(limits[k]),
+                "Recommended Limit": max(1, int(recommended[k])),
+                "Days Over Current Limit": f"{overflow[k]:.0%}"
+            })
+
+    percentiles = np.percentile(away, [50, service_level, 99], axis=0)
+    return {
+        "minutes": np.arange(first, last),
+        "away_p50": percentiles[0],
+        "away_service": percentiles[1],
+        "away_p99": percentiles[2],
+        "slots": pd.DataFrame(slot_rows),
+        "headcount": headcount,
+        "days": days,
+        "elapsed_ms": (perf_counter() - started) * 1000
+    }
+
+def plan_break_capacity(headcount, days=5000, service_level=95, seed=None):
+    """Run the simulation for the active templates with stored history and assignments"""
+    compiled = get_compiled_templates()
+    active = [name for name in st.session_state.active_templates if name in compiled]
+    assigned = get_template_headcounts()
+    shares = {name: assigned.get(name, 0) for name in active}
+    if not any(shares.values()):
+        shares = {name: 1 for name in active}
+    return simulate_break_capacity(
+        {name: compiled[name] for name in active}, shares, get_booking_history(), headcount,
+        days=days, service_level=service_level, seed=seed
+    )
+
+# --------------------------
+# Break Utilization Analytics
+# --------------------------
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+def get_booking_history_version():
+    """Changes whenever a booking is added or removed, or a day is archived"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM break_bookings), (SELECT TOTAL(id) FROM break_bookings),
+                   (SELECT COUNT(*) FROM break_bookings_archive), (SELECT TOTAL(booking_count) FROM break_bookings_archive),
+                   (SELECT MAX(archived_at) FROM break_bookings_archive)
+        """)
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+def load_booking_history_frame():
+    """Every stored booking, archived and live, as one columnar DataFrame with the agent's group"""
+    columns = {name: [] for name in ("date", "agent", "break_type", "slot", "template", "booked_at")}
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT date, payload FROM break_bookings_archive ORDER BY date")
+        for date, payload in cursor.fetchall():
+            rows = decompress_archive_payload(payload)
+            if not rows:
+                continue
+            columns["date"].extend([date] * len(rows))
+            for name, values in zip(("agent", "break_type", "slot", "template", "booked_at"), zip(*rows)):
+                columns[name].extend(values)
+        cursor.execute("SELECT date, agent, break_type, slot, template, booked_at FROM break_bookings")
+        for name, values in zip(columns, zip(*cursor.fetchall())):
+            columns[name].extend(values)
+        cursor.execute("SELECT username, group_name FROM users")
+        groups = dict(cursor.fetchall())
+    finally:
+        conn.close()
+    return booking_history_frame(columns, groups)
+
+def booking_history_frame(columns, groups):
+    frame = pd.DataFrame(columns)
+    frame["template"] = frame["template"].fillna("Default Template")
+    frame["group"] = frame["agent"].map(groups).fillna("No group")
+    frame["date"] = pd.to_datetime(frame["date"], format="%Y-%m-%d", errors="coerce")
+    frame["booked_at"] = pd.to_datetime(frame["booked_at"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    frame = frame.dropna(subset=["date"])
+    return frame.astype({name: "category" for name in ("agent", "break_type", "slot", "template", "group")})
+
+def compute_break_analytics(frame, compiled):
+    """Fill rate, time-to-fill, trends and template changes, all from grouped column operations.
+
+    Fill rates are measured against today's limits from compiled templates,
+    falling back to the default limit for slots no template has any more.
+    """
+    if frame.empty:
+        return None
+    started = perf_counter()
+    limits = pd.DataFrame(
+        [(name, break_type, format_break_minutes(m), int(n))
+         for name, template in compiled.items()
+         for break_type in BREAK_TYPES
+         for m, n in zip(template.minutes[break_type], template.limits[break_type])],
+        columns=["template", "break_type", "slot", "limit"]
+    )
+    keys = ["template", "break_type", "slot"]
+
+    def with_limits(table):
+        table = table.astype({key: str for key in keys}).merge(limits, on=keys, how="left")
+        table["limit"] = table["limit"].fillna(table["break_type"].map(DEFAULT_SLOT_LIMITS)).astype(int)
+        table["label"] = table["template"] + " · " + table["break_type"].map(BREAK_TYPE_LABELS) + " " + table["slot"]
+        table["weekday"] = table["date"].dt.dayofweek.map(dict(enumerate(WEEKDAYS)))
+        return table
+
+    def by_weekday(table, values, aggfunc):
+        pivot = table.pivot_table(index="label", columns="weekday", values=values, aggfunc=aggfunc)
+        return pivot[[day for day in WEEKDAYS if day in pivot.columns]]
+
+    # Seats taken per slot per day; groups are numbered in the same (sorted) order as ngroup()
+    slot_day = frame.groupby(["date"] + keys, observed=True)
+    per_day = with_limits(slot_day.size().rename("booked").reset_index())
+    per_day["fill"] = np.minimum(1.0, per_day["booked"] / per_day["limit"])
+
+    # Minutes from the day's first booking until each slot's last seat went
+    stamped = frame[["date", "booked_at"]].assign(
+        group=slot_day.ngroup(),
+        minutes_in=(frame["booked_at"] - frame.groupby("date")["booked_at"].transform("min")).dt.total_seconds() / 60
+    ).dropna(subset=["booked_at"]).sort_values("booked_at", kind="stable")
+    stamped["nth"] = stamped.groupby("group").cumcount() + 1
+    stamped = stamped[stamped["nth"].to_numpy() == per_day["limit"].to_numpy()[stamped["group"].to_numpy()]]
+    filled = per_day.iloc[stamped["group"].to_numpy()].assign(minutes_in=stamped["minutes_in"].to_numpy())
+    fill_order = filled.groupby("label").agg(
+        **{"Days Filled": ("date", "size"), "Median Minutes to Fill": ("minutes_in", "median")}
+    ).sort_values("Median Minutes to Fill")
+
+    # Agents booking per day, by template and by group
+    agents_per = lambda column: frame.groupby(["date", column], observed=True)["agent"].nunique().unstack(fill_value=0)
+
+    # Template switches between an agent's consecutive booking days
+    per_agent_day = pd.DataFrame({
+        "agent": frame["agent"].cat.codes, "date": frame["date"], "template": frame["template"].cat.codes
+    }).drop_duplicates(["agent", "date"]).sort_values(["agent", "date"])
+    previous = per_agent_day.groupby("agent")["template"].shift()
+    per_agent_day["changed"] = previous.notna() & (previous != per_agent_day["template"])
+    template_changes = per_agent_day.groupby("agent").agg(
+        **{"Days Booked": ("date", "size"), "Template Changes": ("changed", "sum"), "Templates Used": ("template", "nunique")}
+    ).sort_values(["Template Changes", "Days Booked"], ascending=False)
+    template_changes.index = frame["agent"].cat.categories[template_changes.index]
+    template_changes.index.name = "agent"
+
+    return {
+        "bookings": len(frame),
+        "days": int(frame["date"].nunique()),
+        "fill_rate": by_weekday(per_day, "fill", "mean"),
+        "time_to_fill": by_weekday(filled, "minutes_in", "median"),
+        "fill_order": fill_order,
+        "by_template": agents_per("template"),
+        "by_group": agents_per("group"),
+        "template_changes": template_changes,
+        "elapsed_ms": (perf_counter() - started) * 1000
+    }
+
+@st.cache_resource(max_entries=2)
+def _cached_break_analytics(history_version, template_versions):
+    return compute_break_analytics(load_booking_history_frame(), get_compiled_templates())
+
+def get_break_analytics():
+    """Analytics over the whole booking history, recomputed only when bookings or templates change"""
+    template_versions = tuple(sorted(get_break_registry().versions().items()))
+    return _cached_break_analytics(get_booking_history_version(), template_versions)
 
 def agent_break_dashboard():
     # Initialize session state if not exists
@@ -1642,28 +5211,20 @@ def agent_break_dashboard():
         st.session_state.temp_bookings = {}
     if 'booking_confirmed' not in st.session_state:
         st.session_state.booking_confirmed = False
-    if 'agent_bookings' not in st.session_state:
-        st.session_state.agent_bookings = {}
-    
-    # Always refresh data from database at the start
-    refresh_break_data()
     
     # If no template selected, show template selection
     if st.session_state.selected_template_name is None:
         agent_id = st.session_state.username
-        current_date = datetime.now().strftime('%Y-%m-%d')
+        current_date = booking_date()
         
         # Check if user already has bookings for today
-        has_existing_booking = (
-            current_date in st.session_state.agent_bookings and 
-            agent_id in st.session_state.agent_bookings[current_date]
-        )
+        existing_bookings = get_agent_bookings(current_date, agent_id)
         
-        if has_existing_booking:
+        if existing_bookings:
             st.session_state.booking_confirmed = True
             st.session_state.selected_template_name = next(
                 (b.get('template', 'Default Template') 
-                 for b in st.session_state.agent_bookings[current_date][agent_id].values() 
+                 for b in existing_bookings.values() 
                  if isinstance(b, dict) and 'template' in b),
                 'Default Template'
             )
@@ -1689,38 +5250,16 @@ def agent_break_dashboard():
             st.rerun()
         return
     agent_id = st.session_state.username
-    morocco_tz = pytz.timezone('Africa/Casablanca')
-    now_casa = datetime.now(morocco_tz)
-    server_time_iso = now_casa.isoformat()
-    casa_date = now_casa.strftime('%Y-%m-%d')
-    current_date = casa_date  # Use Casablanca date for all booking logic
-
-    # Only apply auto-clear for agents (not admin/qa)
-    user_role = st.session_state.get('role', 'agent')
-    if user_role == 'agent':
-        # Track last clear per agent
-        if 'last_booking_clear_per_agent' not in st.session_state:
-            st.session_state.last_booking_clear_per_agent = {}
-        last_clear = st.session_state.last_booking_clear_per_agent.get(agent_id)
-        # Clear after 11:59 AM
-        if (now_casa.hour > 11 or (now_casa.hour == 11 and now_casa.minute >= 59)):
-            if last_clear != casa_date:
-                # Clear only this agent's bookings for today
-                if current_date in st.session_state.agent_bookings:
-                    st.session_state.agent_bookings[current_date].pop(agent_id, None)
-                st.session_state.last_booking_clear_per_agent[agent_id] = casa_date
-                save_break_data()
+    now_casa = casablanca_now()
+    server_time_iso = CASABLANCA_TZ.localize(now_casa).isoformat()
+    current_date = booking_date(now_casa)  # The shift's booking day, even after midnight
 
     # Check if agent already has confirmed bookings
-    has_confirmed_bookings = (
-        current_date in st.session_state.agent_bookings and 
-        agent_id in st.session_state.agent_bookings[current_date]
-    )
+    bookings = get_agent_bookings(current_date, agent_id)
     
-    if has_confirmed_bookings:
+    if bookings:
         st.success("Your breaks have been confirmed for today")
         st.subheader("Your Confirmed Breaks")
-        bookings = st.session_state.agent_bookings[current_date][agent_id]
         template_name = None
         for break_type in ['lunch', 'early_tea', 'late_tea']:
             if break_type in bookings and isinstance(bookings[break_type], dict):
@@ -1750,6 +5289,38 @@ def agent_break_dashboard():
                 else:
                     st.write(f"**{display_name}:** {bookings[break_type]}")
 
+        # Punch in and out so adherence is tracked from when breaks were actually taken
+        st.subheader("⏱️ Break Punch")
+        punches = get_agent_punches(current_date, agent_id)
+        running = [bt for bt, p in punches.items() if "start" in p and "end" not in p]
+        for break_type in BREAK_TYPES:
+            if break_type not in bookings:
+                continue
+            label = BREAK_TYPE_LABELS[break_type]
+            punched = punches.get(break_type, {})
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                if "end" in punched:
+                    st.write(f"{label}: taken {format_break_minutes(punched['start'] + SHIFT_START_MINUTE)}–{format_break_minutes(punched['end'] + SHIFT_START_MINUTE)}")
+                elif "start" in punched:
+                    st.write(f"{label}: on break since {format_break_minutes(punched['start'] + SHIFT_START_MINUTE)}")
+                else:
+                    st.write(f"{label}: not taken yet")
+            with col2:
+                if "end" in punched:
+                    continue
+                event = "end" if "start" in punched else "start"
+                disabled = event == "start" and bool(running)
+                if st.button(f"{'⏹️ End' if event == 'end' else '▶️ Start'} {label}", key=f"punch_{break_type}", disabled=disabled):
+                    if is_killswitch_enabled():
+                        st.error("System is currently locked. Please contact the developer.")
+                    elif rate_limit_write("punch", agent_id, (break_type, event)) == "allowed":
+                        result = punch_break(agent_id, break_type, event)
+                        if result == "ok":
+                            confirm_write("punch", agent_id, (break_type, event))
+                            st.rerun()
+                        st.error(f"Could not record your {label.lower()} punch: {result}.")
+
         # --- Inject browser notification for breaks 5 min before ---
         import streamlit.components.v1 as components
         import json
@@ -1867,25 +5438,7 @@ def agent_break_dashboard():
         return
     
     # Determine agent's assigned templates
-    agent_templates = []
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Defensive: Check if break_templates column exists
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if "break_templates" in columns:
-            cursor.execute("SELECT break_templates FROM users WHERE username = ?", (agent_id,))
-            row = cursor.fetchone()
-            if row and row[0]:
-                agent_templates = [t.strip() for t in row[0].split(',') if t.strip()]
-    except Exception:
-        agent_templates = []
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
+    agent_templates = get_agent_template_names(agent_id)
 
     # Step 1: Template Selection
     if not st.session_state.selected_template_name:
@@ -1917,7 +5470,7 @@ def agent_break_dashboard():
     if st.session_state.selected_template_name not in st.session_state.templates:
         st.error("Your assigned break schedule is not available. Please contact your administrator.")
         return
-    template = st.session_state.templates[st.session_state.selected_template_name]
+    template_slots = get_compiled_templates()[st.session_state.selected_template_name].slots()
     
     st.subheader("Step 2: Select Your Breaks")
     st.info(f"Selected Template: **{st.session_state.selected_template_name}**")
@@ -1928,13 +5481,21 @@ def agent_break_dashboard():
         st.rerun()
     
     # Break selection
+    occupancy = get_slot_occupancy(current_date, st.session_state.selected_template_name)
+    floor_caps = get_agent_floor_caps(current_date, agent_id)
+    if floor_caps:
+        st.caption(f"At most {describe_floor_caps(floor_caps)} can be on break at the same time; free seats below already account for this.")
+
+    def free_seats(break_type, slot):
+        free = get_slot_limit(st.session_state.selected_template_name, break_type, slot) - occupancy.get((break_type, slot), 0)
+        room = floor_cap_room(floor_caps, break_type, slot)
+        return max(0, free if room is None else min(free, room))
+
     with st.form("break_selection_form"):
-        st.write("**Lunch Break** (30 minutes)")
+        st.write(f"**Lunch Break** ({BREAK_DURATIONS['lunch']} minutes)")
         lunch_options = []
-        for slot in template["lunch_breaks"]:
-            count = count_bookings(current_date, "lunch", slot)
-            limit = st.session_state.break_limits.get(st.session_state.selected_template_name, {}).get("lunch", {}).get(slot, 5)
-            available = max(0, limit - count)
+        for slot in template_slots["lunch"]:
+            available = free_seats("lunch", slot)
             label = f"{slot} ({available} free to book)"
             lunch_options.append((label, slot))
         lunch_labels = ["No selection"] + [label for label, _ in lunch_options]
@@ -1949,12 +5510,10 @@ def agent_break_dashboard():
         lunch_time = lunch_values[lunch_labels.index(lunch_time)] if lunch_time in lunch_labels else ""
 
         
-        st.write("**Early Tea Break** (15 minutes)")
+        st.write(f"**Early Tea Break** ({BREAK_DURATIONS['early_tea']} minutes)")
         early_tea_options = []
-        for slot in template["tea_breaks"]["early"]:
-            count = count_bookings(current_date, "early_tea", slot)
-            limit = st.session_state.break_limits.get(st.session_state.selected_template_name, {}).get("early_tea", {}).get(slot, 3)
-            available = max(0, limit - count)
+        for slot in template_slots["early_tea"]:
+            available = free_seats("early_tea", slot)
             label = f"{slot} ({available} free to book)"
             early_tea_options.append((label, slot))
         early_tea_labels = ["No selection"] + [label for label, _ in early_tea_options]
@@ -1968,12 +5527,10 @@ def agent_break_dashboard():
         early_tea = early_tea_values[early_tea_labels.index(early_tea)] if early_tea in early_tea_labels else ""
 
         
-        st.write("**Late Tea Break** (15 minutes)")
+        st.write(f"**Late Tea Break** ({BREAK_DURATIONS['late_tea']} minutes)")
         late_tea_options = []
-        for slot in template["tea_breaks"]["late"]:
-            count = count_bookings(current_date, "late_tea", slot)
-            limit = st.session_state.break_limits.get(st.session_state.selected_template_name, {}).get("late_tea", {}).get(slot, 3)
-            available = max(0, limit - count)
+        for slot in template_slots["late_tea"]:
+            available = free_seats("late_tea", slot)
             label = f"{slot} ({available} free to book)"
             late_tea_options.append((label, slot))
         late_tea_labels = ["No selection"] + [label for label, _ in late_tea_options]
@@ -2005,64 +5562,45 @@ def agent_break_dashboard():
                 st.error(conflict)
                 return
             
-            # Check limits for each selected break
-            can_book = True
-            if lunch_time:
-                count = sum(1 for bookings in st.session_state.agent_bookings.get(current_date, {}).values()
-                           if isinstance(bookings.get("lunch"), dict) and bookings["lunch"]["time"] == lunch_time)
-                limit = st.session_state.break_limits.get(st.session_state.selected_template_name, {}).get("lunch", {}).get(lunch_time, 5)
-                if count >= limit:
-                    st.error(f"Lunch break at {lunch_time} is full.")
-                    can_book = False
-            
-            if early_tea:
-                count = sum(1 for bookings in st.session_state.agent_bookings.get(current_date, {}).values()
-                           if isinstance(bookings.get("early_tea"), dict) and bookings["early_tea"]["time"] == early_tea)
-                limit = st.session_state.break_limits.get(st.session_state.selected_template_name, {}).get("early_tea", {}).get(early_tea, 3)
-                if count >= limit:
-                    st.error(f"Early tea break at {early_tea} is full.")
-                    can_book = False
-            
-            if late_tea:
-                count = sum(1 for bookings in st.session_state.agent_bookings.get(current_date, {}).values()
-                           if isinstance(bookings.get("late_tea"), dict) and bookings["late_tea"]["time"] == late_tea)
-                limit = st.session_state.break_limits.get(st.session_state.selected_template_name, {}).get("late_tea", {}).get(late_tea, 3)
-                if count >= limit:
-                    st.error(f"Late tea break at {late_tea} is full.")
-                    can_book = False
-            
-            if can_book:
-                # Save the bookings
-                if current_date not in st.session_state.agent_bookings:
-                    st.session_state.agent_bookings[current_date] = {}
-                
-                bookings = {}
-                if lunch_time:
-                    bookings["lunch"] = {
-                        "time": lunch_time,
-                        "template": st.session_state.selected_template_name,
-                        "booked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                if early_tea:
-                    bookings["early_tea"] = {
-                        "time": early_tea,
-                        "template": st.session_state.selected_template_name,
-                        "booked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                if late_tea:
-                    bookings["late_tea"] = {
-                        "time": late_tea,
-                        "template": st.session_state.selected_template_name,
-                        "booked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                
-                st.session_state.agent_bookings[current_date][agent_id] = bookings
-                if save_break_data():
-                    st.success("Your breaks have been confirmed!")
-                    # Force a rerun to ensure state is consistent
-                    st.rerun()
+            # Capacity is checked and claimed atomically inside the booking transaction
+            template_name = st.session_state.selected_template_name
+            limits = {
+                break_type: get_slot_limit(template_name, break_type, slot)
+                for break_type, slot in selected_breaks.items() if slot
+            }
+            with st.spinner("Reserving your breaks..."):
+                status, full_type = reserve_agent_breaks(current_date, agent_id, template_name, selected_breaks, limits)
+            if status == "booked":
+                st.success("Your breaks have been confirmed!")
+                # Force a rerun to ensure state is consistent
+                st.rerun()
+            elif status == "full":
+                display = full_type.replace("_", " ").capitalize()
+                slot = selected_breaks[full_type]
+                if occupancy.get((full_type, slot), 0) < limits[full_type]:
+                    st.error(f"{display} break at {slot} was just filled by another agent. Please pick another slot.")
                 else:
-                    st.error("Failed to save break bookings. Please try again.")
+                    st.error(f"{display} break at {slot} is full.")
+                fresh = get_slot_occupancy(current_date, template_name)
+                alternatives = [
+                    other for other in template_slots[full_type]
+                    if fresh.get((full_type, other), 0) < get_slot_limit(template_name, full_type, other)
+                ]
+                if alternatives:
+                    st.info(f"Still open for {display.lower()}: {', '.join(alternatives)}")
+            elif status == "cap":
+                display = full_type.replace("_", " ").capitalize()
+                slot = selected_breaks[full_type]
+                fresh_caps = get_agent_floor_caps(current_date, agent_id)
+                st.error(f"{display} break at {slot} would put more than {describe_floor_caps(fresh_caps)} on break at once. Please pick another slot.")
+                alternatives = [
+                    other for other in template_slots[full_type]
+                    if (floor_cap_room(fresh_caps, full_type, other) or 0) > 0
+                ]
+                if alternatives:
+                    st.info(f"Still open for {display.lower()}: {', '.join(alternatives)}")
+            else:
+                st.error("You already have breaks booked for today.")
 
 def is_vip_user(username):
     """Check if a user has VIP status"""
@@ -2792,7 +6330,14 @@ if "authenticated" not in st.session_state:
         "last_message_ids": []
     })
 
-init_db()
+capture_rerun_now()
+try:
+    prepare_database()
+except ValueError as e:
+    st.error(f"Database setup failed: {e}")
+    st.stop()
+get_job_scheduler()
+roll_over_break_day()
 init_break_session_state()
 
 if not st.session_state.authenticated:
@@ -2964,13 +6509,10 @@ else:
 
             # --- Break reminder notifications for agents (5-minute warning) ---
             if st.session_state.role == "agent":
-                morocco_tz = pytz.timezone('Africa/Casablanca')
-                now_casa = datetime.now(morocco_tz)
-                today_str = now_casa.strftime('%Y-%m-%d')
+                now_casa = CASABLANCA_TZ.localize(casablanca_now())
+                today_str = booking_date(now_casa)
                 agent_id = st.session_state.username
-                bookings_today = (
-                    st.session_state.get('agent_bookings', {}).get(today_str, {}).get(agent_id)
-                )
+                bookings_today = get_agent_bookings(today_str, agent_id)
                 if bookings_today:
                     break_times = []
                     for b_type in ["lunch", "early_tea", "late_tea"]:
@@ -2979,6 +6521,7 @@ else:
                             t = entry.get("time")
                             if t:
                                 break_times.append(t)
+                    break_starts = {t: CASABLANCA_TZ.localize(break_start_at(today_str, t)).isoformat() for t in break_times}
                     if break_times:
                         # keep server time fresh without full reload
                         try:
@@ -2991,18 +6534,14 @@ else:
                         <script>
                         (function() {{
                             const breakTimes = {json.dumps(break_times)};
-                            const serverTimeISO = '{now_casa.isoformat()}';
-                            const start = new Date(serverTimeISO);
-                            const dayKey = start.toISOString().split('T')[0];
-
-                            function buildBreakDate(hm, base) {{
-                                const parts = hm.split(':');
-                                const h = parseInt(parts[0], 10) || 0;
-                                const m = parseInt(parts[1], 10) || 0;
-                                return new Date(base.getFullYear(), base.getMonth(), base.getDate(), h, m, 0, 0);
+                            const dayKey = '{today_str}';
+                            const breakStarts = {json.dumps(break_starts)};
+
+                            function buildBreakDate(hm) {{
+                                return new Date(breakStarts[hm]);
                             }}
 
-                            const breaks = breakTimes.map(function(bt) {{ return {{ bt: bt, time: buildBreakDate(bt, start) }}; }});
+                            const breaks = breakTimes.map(function(bt) {{ return {{ bt: bt, time: buildBreakDate(bt) }}; }});
 
                             function notifyOnce(key, title, body) {{
                                 if (localStorage.getItem(key)) return;
@@ -3053,10 +6592,10 @@ else:
                             const labelEl = document.getElementById('next-break-label');
                             const countdownEl = document.getElementById('next-break-countdown');
 
+                            const breakStarts = {json.dumps(break_starts)};
+
                             function parseHM(hm) {{
-                                const [h, m] = hm.split(':').map(Number);
-                                const base = new Date(serverTimeISO);
-                                return new Date(base.getFullYear(), base.getMonth(), base.getDate(), h, m, 0, 0);
+                                return new Date(breakStarts[hm]);
                             }}
 
                             function getNextBreak(now) {{
@@ -3148,6 +6687,15 @@ else:
             st.session_state.authenticated = False
             st.rerun()
 
+    # Presence heartbeat: coalesced in memory, flushed in batches by the tracker
+    if 'presence_group' not in st.session_state:
+        st.session_state.presence_group = get_user_group(st.session_state.username)
+    get_presence_tracker().heartbeat(
+        st.session_state.username,
+        st.session_state.current_section,
+        st.session_state.presence_group
+    )
+
     st.title(st.session_state.current_section.title())
 
     if st.session_state.current_section == "requests":
@@ -3451,71 +6999,70 @@ else:
                                         st.rerun()
                                 else:
                                     st.warning("No group selected for chat.")
+
+                # Chat history pager: older days are served from the compressed archive on demand
+                if view_group is not None and str(view_group).strip() != "":
+                    with st.expander("📜 Chat History"):
+                        history_query = st.text_input("Search history...", key="chat_history_search")
+                        if history_query:
+                            history = search_group_message_history(view_group, history_query)
+                            if not history:
+                                st.info("No messages found.")
+                        else:
+                            history_days = get_chat_history_days(view_group)
+                            history = []
+                            if history_days:
+                                history_day = st.selectbox("Day", history_days, key="chat_history_day")
+                                history = get_group_message_history(view_group, history_day)
+                            else:
+                                st.info("No chat history yet.")
+                        for msg in history:
+                            st.markdown(f"""
+                            <div class="chat-message {'sent' if msg['sender'] == st.session_state.username else 'received'}">
+                                <div class="message-avatar">{(msg['sender'] or '?')[0].upper()}</div>
+                                <div class="message-content">
+                                    <div>{msg['message']}</div>
+                                    <div class="message-meta">{msg['sender']} • {msg['timestamp']}</div>
+                                </div>
+                            </div>
+                            """, unsafe_allow_html=True)
         else:
             st.error("System is currently locked. Access to chat is disabled.")
 
     elif st.session_state.current_section == "Live KPIs":
         if not is_killswitch_enabled():
             st.subheader("📋 AHT Table")
-            import pandas as pd
-            # --- HOLD Table Functions (now using SQLite for persistence) ---
-            import io
-            def add_hold_table(uploader, table_data):
-                conn = get_db_connection()
-                try:
-                    cursor = conn.cursor()
-                    # Only keep the latest table: clear any existing records
-                    cursor.execute("DELETE FROM hold_tables")
-                    timestamp = get_casablanca_time()  # Ensure Casablanca time
-                    cursor.execute("INSERT INTO hold_tables (uploader, table_data, timestamp) VALUES (?, ?, ?)", (uploader, table_data, timestamp))
-                    conn.commit()
-                    return True
-                finally:
-                    conn.close()
-
-            def get_hold_tables():
-                conn = get_db_connection()
-                try:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT id, uploader, table_data, timestamp FROM hold_tables ORDER BY id DESC LIMIT 1")
-                    result = cursor.fetchall()
-                    return result
-                finally:
-                    conn.close()
-
-            def clear_hold_tables():
-                conn = get_db_connection()
-                try:
-                    cursor = conn.cursor()
-                    cursor.execute("DELETE FROM hold_tables")
-                    conn.commit()
-                    return True
-                finally:
-                    conn.close()
-            # --- END HOLD Table Functions ---
             # Only show table paste option to admin users
             if st.session_state.role == "admin":
-                st.write("Paste a table copied from Excel (CSV or tab-separated):")
+                st.write("Paste a table copied from Excel (CSV or tab-separated), or upload the export:")
                 pasted_table = st.text_area("Paste table here", height=150)
+                uploaded_table = st.file_uploader(
+                    f"Upload a CSV or TSV file (up to {KPI_UPLOAD_MAX_BYTES // 1024 // 1024} MB)",
+                    type=["csv", "tsv", "txt"], key="hold_table_upload"
+                )
                 if st.button("Save HOLD Table"):
-                    if pasted_table.strip():
+                    if uploaded_table is not None or pasted_table.strip():
+                        progress_bar = st.progress(0.0, text="Parsing table...")
                         try:
-                            # Try to parse as DataFrame
-                            try:
-                                df = pd.read_csv(io.StringIO(pasted_table), sep=None, engine='python')
-                            except Exception:
-                                df = pd.read_csv(io.StringIO(pasted_table), sep='\t')
-                            table_data = df.to_csv(index=False)
-                            clear_hold_tables()  # Only keep latest
-                            if add_hold_table(st.session_state.username, table_data):
+                            if uploaded_table is not None:
+                                df = ingest_kpi_table(uploaded_table, size=uploaded_table.size,
+                                                      progress=lambda done: progress_bar.progress(done, text="Parsing table..."))
+                            else:
+                                df = ingest_kpi_table(pasted_table,
+                                                      progress=lambda done: progress_bar.progress(done, text="Parsing table..."))
+                            progress_bar.progress(1.0, text=f"Saving {len(df):,} rows...")
+                            if add_hold_table(st.session_state.username, df):
                                 st.success("Table saved successfully!")
                                 st.rerun()
                             else:
                                 st.error("Failed to save table.")
                         except Exception as e:
+                            progress_bar.empty()
                             st.error(f"Error parsing table: {str(e)}")
                     else:
-                        st.warning("Please paste a table.")
+                        st.warning("Please paste a table or upload a file.")
+                snapshot_count, stored_bytes = get_hold_table_storage()
+                st.caption(f"Every save is kept as a snapshot for trends: {snapshot_count} stored, {stored_bytes / 1024:.1f} KB.")
                 # Add clear button with confirmation
                 with st.form("clear_hold_tables_form"):
                     confirm_clear_hold = st.checkbox("I understand and want to clear all HOLD tables")
@@ -3529,9 +7076,9 @@ else:
                         else:
                             st.warning("Please confirm by checking the checkbox.")
             # Display most recent table (visible to all users)
-            tables = get_hold_tables()
-            if tables:
-                table_id, uploader, table_data, timestamp = tables[0]
+            latest_table = get_latest_hold_table()
+            if latest_table:
+                table_id, uploader, timestamp = latest_table
                 st.markdown(f"""
                 <div style='border: 1px solid #ddd; padding: 10px; margin-bottom: 20px; border-radius: 5px;'>
                     <p><strong>Uploaded by:</strong> {uploader}</p>
@@ -3539,17 +7086,42 @@ else:
                 </div>
                 """, unsafe_allow_html=True)
                 try:
-                    import pandas as pd
-                    import io
-                    df = pd.read_csv(io.StringIO(table_data))
+                    own_rows = find_own_kpi_rows(table_id, st.session_state.username)
+                    if not own_rows.empty:
+                        st.markdown("**Your row**")
+                        st.dataframe(own_rows, use_container_width=True)
                     search_query = st.text_input("🔍 Search in table", key="hold_table_search")
-                    if search_query:
-                        filtered_df = df[df.apply(lambda row: row.astype(str).str.contains(search_query, case=False, na=False).any(), axis=1)]
-                        st.dataframe(filtered_df, use_container_width=True)
+                    if search_query.strip():
+                        st.dataframe(search_hold_table(table_id, search_query), use_container_width=True)
                     else:
-                        st.dataframe(df, use_container_width=True)
+                        st.dataframe(load_hold_table(table_id), use_container_width=True)
                 except Exception as e:
                     st.error(f"Error displaying table: {str(e)}")
+
+                snapshots = get_hold_table_snapshots()
+                if len(snapshots) > 1:
+                    with st.expander("📈 Trends across snapshots"):
+                        latest_df = load_hold_table(table_id)
+                        key_column = kpi_key_column(latest_df)
+                        metrics = [c for c in latest_df.columns if pd.api.types.is_numeric_dtype(latest_df[c].dtype)]
+                        if key_column is None or not metrics:
+                            st.info("The table needs an agent column and at least one numeric column to show trends.")
+                        else:
+                            days = sorted({ts[:10] for _, _, ts in snapshots}, reverse=True)
+                            col1, col2 = st.columns(2)
+                            trend_day = col1.selectbox("Day", days, key="kpi_trend_day")
+                            trend_metric = col2.selectbox("Metric", metrics, key="kpi_trend_metric")
+                            agent_names = latest_df[key_column].dropna().unique().tolist()
+                            own_row = [name for name in agent_names if str(name).lower() == str(st.session_state.username).lower()]
+                            trend_agents = st.multiselect("Agents", agent_names, default=own_row or agent_names[:5],
+                                                          key="kpi_trend_agents")
+                            trend = kpi_trend([(i, ts) for i, _, ts in snapshots if ts.startswith(trend_day)],
+                                              trend_metric, trend_agents)
+                            if trend.empty:
+                                st.info("No snapshots with this metric on that day.")
+                            else:
+                                st.line_chart(trend)
+                                st.dataframe(trend, use_container_width=True)
             else:
                 st.info("No HOLD tables available")
         else:
@@ -3573,13 +7145,13 @@ else:
                     try:
                         datetime.strptime(presence_time, "%H:%M")
                         datetime.strptime(login_time, "%H:%M")
-                        add_late_login(
+                        if add_late_login(
                             st.session_state.username,
                             presence_time,
                             login_time,
                             reason
-                        )
-                        st.success("Late login reported successfully!")
+                        ):
+                            st.success("Late login reported successfully!")
                     except ValueError:
                         st.error("Invalid time format. Please use HH:MM format (e.g., 08:30)")
         
@@ -3735,14 +7307,14 @@ else:
                 if st.form_submit_button("Submit"):
                     try:
                         datetime.strptime(timing, "%H:%M")
-                        add_quality_issue(
+                        if add_quality_issue(
                             st.session_state.username,
                             issue_type,
                             timing,
                             mobile_number,
                             product
-                        )
-                        st.success("Quality issue reported successfully!")
+                        ):
+                            st.success("Quality issue reported successfully!")
                     except ValueError:
                         st.error("Invalid time format. Please use HH:MM format (e.g., 14:30)")
         
@@ -3881,13 +7453,13 @@ else:
                     try:
                         datetime.strptime(start_time, "%H:%M")
                         datetime.strptime(end_time, "%H:%M")
-                        add_midshift_issue(
+                        if add_midshift_issue(
                             st.session_state.username,
                             issue_type,
                             start_time,
                             end_time
-                        )
-                        st.success("Mid-shift issue reported successfully!")
+                        ):
+                            st.success("Mid-shift issue reported successfully!")
                     except ValueError:
                         st.error("Invalid time format. Please use HH:MM format (e.g., 10:00)")
         
@@ -4003,6 +7575,22 @@ else:
                 st.info("You have no mid-shift issue records")
 
     elif st.session_state.current_section == "admin" and st.session_state.role == "admin":
+        st.subheader("🟢 Online Now")
+        online_by_group = get_online_users_by_group()
+        if online_by_group:
+            group_cols = st.columns(min(len(online_by_group), 4))
+            for i, (group_name, members) in enumerate(online_by_group.items()):
+                group_cols[i % len(group_cols)].metric(group_name, len(members))
+            with st.expander("Show online users"):
+                st.dataframe(pd.DataFrame([
+                    {"Group": group_name, "User": username, "Section": section, "Last Seen": last_seen}
+                    for group_name, members in online_by_group.items()
+                    for username, section, last_seen in members
+                ]), use_container_width=True)
+        else:
+            st.info("No users online right now")
+        st.markdown("---")
+
         if st.session_state.username.lower() in ["taha kirri", "malikay"]:
             st.subheader("🚨 System Killswitch")
             current = is_killswitch_enabled()
@@ -4118,7 +7706,26 @@ else:
                         st.error(f"Error during deletion: {str(e)}")
                 else:
                     st.warning("Please confirm the deletion by checking the checkbox.")
-        
+
+        st.write("### Chat Archive")
+        hot_count, archived_count, archived_bytes = get_chat_archive_stats()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Live messages", hot_count)
+        col2.metric("Archived messages", archived_count)
+        col3.metric("Archive size", f"{archived_bytes / 1024:.1f} KB")
+        with st.form("chat_archive_form"):
+            retention_days = st.number_input(
+                "Keep messages in the live chat for (days)",
+                min_value=1,
+                value=CHAT_RETENTION_DAYS
+            )
+            if st.form_submit_button("Archive Older Messages"):
+                try:
+                    archived = archive_old_group_messages(int(retention_days))
+                    st.success(f"Archived {archived} message(s).")
+                except Exception as e:
+                    st.error(f"Error archiving messages: {str(e)}")
+
         st.markdown("---")
         st.subheader("📝 Dropdown Options Management")
         
@@ -4204,13 +7811,9 @@ else:
                 # --- Break Templates Selection for Agents ---
                 selected_templates = []
                 if role == "agent":
-                    # Load templates from templates.json
-                    templates = []
-                    try:
-                        with open("templates.json", "r") as f:
-                            templates = list(json.load(f).keys())
-                    except Exception:
-                        st.warning("No break templates found. Please add templates.json.")
+                    templates = get_template_names()
+                    if not templates:
+                        st.warning("No break templates found. Please create one in Break Schedule Management.")
                     if templates:
                         selected_templates = st.multiselect(
                             "Select break templates agent can book from:",
@@ -4357,12 +7960,9 @@ else:
             if st.session_state.role == "admin":
                 st.subheader("Agent Break Template Assignments")
                 agent_templates = get_all_users(include_templates=True)
-                templates_list = []
-                try:
-                    with open("templates.json", "r") as f:
-                        templates_list = list(json.load(f).keys())
-                except Exception:
-                    st.warning("No break templates found. Please add templates.json.")
+                templates_list = get_template_names()
+                if not templates_list:
+                    st.warning("No break templates found. Please create one in Break Schedule Management.")
 
                 # --- Refactored: Single agent dropdown ---
                 agent_choices = [(u[1], u[3]) for u in agent_templates if u[2] == "agent"]
@@ -4402,23 +8002,10 @@ else:
                             group_name = st.text_input("New Group Name (required)", key=f"new_group_name_{username}")
 
                         if st.button(f"Save for {username}", key=f"save_templates_{username}"):
-                            def update_agent_templates_and_group(username, templates, group_name):
-                                conn = sqlite3.connect("data/requests.db")
-                                try:
-                                    cursor = conn.cursor()
-                                    templates_str = ','.join(templates)
-                                    cursor.execute(
-                                        "UPDATE users SET break_templates = ?, group_name = ? WHERE username = ?",
-                                        (templates_str, group_name, username)
-                                    )
-                                    conn.commit()
-                                    return True
-                                finally:
-                                    conn.close()
                             if group_choice == "Create new group" and not group_name:
                                 st.error("Please enter a new group name.")
                             else:
-                                update_agent_templates_and_group(username, new_templates, group_name)
+                                set_agent_templates(username, new_templates, group_name)
                                 st.success(f"Templates and group updated for {username}!")
                                 st.rerun()
 
@@ -4470,6 +8057,37 @@ else:
             else:
                 st.info("No QA users found")
 
+        st.markdown("---")
+        st.subheader("🧪 Performance Diagnostics")
+        st.caption("Timing benchmarks against the old code paths run from the test suite: python -m pytest --benchmarks -s")
+
+        st.write("### Write Rate Limiting")
+        st.caption("Writes dropped as duplicates (coalesced) or refused because a per-user or global bucket was empty, since server start.")
+        st.dataframe(pd.DataFrame(get_write_rate_limiter().stats()), use_container_width=True)
+
+        st.write("### Background Jobs")
+        st.caption("Maintenance runs on a scheduler thread started once per server process, never during a page rerun. Times are Casablanca time.")
+        scheduler = get_job_scheduler()
+        st.dataframe(pd.DataFrame(scheduler.status()), use_container_width=True, hide_index=True)
+        scheduler_stats = scheduler.stats()
+        if not scheduler_stats["thread_alive"]:
+            st.error("The scheduler thread is not running.")
+        elif scheduler_stats["last_loop_error"]:
+            st.warning(f"Scheduler loop errors: {scheduler_stats['loop_errors']} (last: {scheduler_stats['last_loop_error']})")
+        col1, col2 = st.columns([3, 1])
+        job_to_run = col1.selectbox("Job", list(scheduler.jobs), key="job_to_run", label_visibility="collapsed")
+        if col2.button("Run now", key="run_job_now"):
+            scheduler.request_run(job_to_run)
+            st.success(f"{job_to_run} queued; its result shows here after the next refresh.")
+
+        with st.expander("Break template registry"):
+            st.caption("Templates, limits and activations are shared by all sessions; a template's slots are re-read and recompiled only when its version stamp changes.")
+            st.json(get_break_registry().stats())
+
+        with st.expander("Floor cap checks"):
+            st.caption("Per-minute occupancy kept in a max segment tree per date and scope, shared by booking transactions.")
+            st.json(get_floor_cap_index().stats())
+
 
     elif st.session_state.current_section == "breaks":
         if st.session_state.role == "admin":
@@ -4586,7 +8204,7 @@ def handle_message_check():
     if not st.session_state.authenticated:
         return {"new_messages": False, "messages": []}
 
-    current_time = datetime.now()
+    current_time = casablanca_now()
     if 'last_message_check' not in st.session_state:
         st.session_state.last_message_check = current_time
 
@@ -4622,16 +8240,14 @@ def convert_to_casablanca_date(date_str):
     """Convert a date string to Casablanca timezone"""
     try:
         dt = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-        morocco_tz = pytz.timezone('Africa/Casablanca')
-        return pytz.UTC.localize(dt).astimezone(morocco_tz).date()
+        return pytz.UTC.localize(dt).astimezone(CASABLANCA_TZ).date()
     except:
         return None
 
 def get_date_range_casablanca(date):
     """Get start and end of day in Casablanca time"""
-    morocco_tz = pytz.timezone('Africa/Casablanca')
-    start = morocco_tz.localize(datetime.combine(date, time.min))
-    end = morocco_tz.localize(datetime.combine(date, time.max))
+    start = CASABLANCA_TZ.localize(datetime.combine(date, time.min))
+    end = CASABLANCA_TZ.localize(datetime.combine(date, time.max))
     return start, end
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+"""Shared fixtures.
+
+USA FORM.py is a Streamlit script, so importing it would render the whole
+page. The suite loads only its top-level definitions (imports, constants,
+functions and classes) into a fresh module for each test, with the working
+directory set to a temporary folder so data/requests.db is a throwaway
+database.
+"""
+import ast
+import random
+import types
+from pathlib import Path
+
+import pytest
+import streamlit as st
+
+APP_PATH = Path(__file__).resolve().parent.parent / "USA FORM.py"
+DEFINITIONS = (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef, ast.Assign, ast.AnnAssign)
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmarks", action="store_true", help="also run the timing benchmarks")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="timing benchmark; run with --benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def load_app():
+    """Execute the definitions in USA FORM.py and return them as a module"""
+    tree = ast.parse(APP_PATH.read_text(encoding="utf-8"), filename=str(APP_PATH))
+    tree.body = [node for node in tree.body if isinstance(node, DEFINITIONS)]
+    module = types.ModuleType("usa_form")
+    module.__file__ = str(APP_PATH)
+    exec(compile(tree, str(APP_PATH), "exec"), module.__dict__)
+    return module
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The app's functions over a freshly migrated database in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    module = load_app()
+    module.prepare_database()
+    yield module
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+
+@pytest.fixture
+def floor(app):
+    """Build a synthetic floor: [(agent, {break_type: slot})] on the default template"""
+
+    def build(agent_count, seed=0):
+        rng = random.Random(seed)
+        slots = app.template_slot_lists(app.DEFAULT_BREAK_TEMPLATE)
+        return [
+            (f"agent{i:04d}", {break_type: rng.choice(options) for break_type, options in slots.items()})
+            for i in range(agent_count)
+        ]
+
+    return build
+
+
+@pytest.fixture
+def report():
+    """Print benchmark rows as a small table; shown with pytest -s"""
+
+    def show(title, rows):
+        print(f"\n{title}")
+        for row in rows:
+            print("  " + ", ".join(f"{key}: {value}" for key, value in row.items()))
+
+    return show
@@ -0,0 +1,180 @@
+import random
+import sqlite3
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pytest
+
+DATE = "2000-01-01"
+LIMITS = {"lunch": 10, "early_tea": 10, "late_tea": 10}
+
+
+def at(hh_mm, day=1):
+    return datetime(2000, 1, day, int(hh_mm[:2]), int(hh_mm[3:]))
+
+
+@pytest.fixture
+def booked(app):
+    app.book_agent_breaks(DATE, "ann", "Default Template",
+                          {"lunch": "19:30", "early_tea": "16:00", "late_tea": "23:15"}, LIMITS)
+    return app
+
+
+def test_punches_follow_the_booking(booked):
+    app = booked
+    assert app.punch_break("ann", "lunch", "end", at("19:31")) == "not started"
+    assert app.punch_break("bob", "lunch", "start", at("19:31")) == "not booked"
+    assert app.punch_break("ann", "lunch", "start", at("19:35")) == "ok"
+    assert app.punch_break("ann", "early_tea", "start", at("19:40")) == "another break is still running"
+    assert app.punch_break("ann", "lunch", "end", at("20:10")) == "ok"
+    assert app.punch_break("ann", "lunch", "start", at("20:11")) == "already taken"
+    assert app.get_agent_punches(DATE, "ann") == {"lunch": {"start": app.shift_minutes("19:35"),
+                                                            "end": app.shift_minutes("20:10")}}
+
+
+def test_break_ending_after_midnight_closes_on_its_booking_day(app):
+    app.book_agent_breaks(DATE, "ann", "Default Template", {"late_tea": "23:50"}, LIMITS)
+    assert app.punch_break("ann", "late_tea", "start", at("23:50")) == "ok"
+    assert app.punch_break("ann", "late_tea", "end", at("00:05", day=2)) == "ok"
+    punches = app.get_agent_punches(DATE, "ann")
+    assert punches == {"late_tea": {"start": app.shift_minutes("23:50"), "end": app.shift_minutes("00:05")}}
+    frame = app.get_live_adherence(DATE)
+    assert frame["Ended"].tolist() == [app.shift_minutes("00:05")]
+    assert not frame["Late Start"].iloc[0] and not frame["Running"].iloc[0]
+
+
+def test_punch_log_is_append_only(booked):
+    booked.punch_break("ann", "lunch", "start", at("19:35"))
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        with pytest.raises(sqlite3.DatabaseError):
+            conn.execute("DELETE FROM break_punches")
+        with pytest.raises(sqlite3.DatabaseError):
+            conn.execute("UPDATE break_punches SET minute = 0")
+    finally:
+        conn.close()
+
+
+def test_adherence_flags_late_starts_overruns_and_the_last_hour(booked):
+    app = booked
+    app.punch_break("ann", "lunch", "start", at("19:35"))
+    app.punch_break("ann", "lunch", "end", at("20:10"))
+    app.punch_break("ann", "late_tea", "start", at("23:15"))
+    frame = app.get_live_adherence(DATE, app.shift_minutes("23:40")).set_index("Break")
+    lunch, tea = frame.loc[app.BREAK_TYPE_LABELS["lunch"]], frame.loc[app.BREAK_TYPE_LABELS["late_tea"]]
+    assert (lunch["Late Minutes"], lunch["Late Start"]) == (5, True)
+    assert (lunch["Overrun Minutes"], lunch["Overrun"]) == (5, True)
+    assert not lunch["Last Hour"]
+    assert tea["Running"] and tea["Overrun"] and tea["Last Hour"] and not tea["Late Start"]
+    summary = app.summarize_adherence(frame.reset_index()).iloc[0]
+    assert (summary["Breaks"], summary["Late Starts"], summary["Overruns"]) == (2, 1, 2)
+
+
+def test_tracker_only_reads_new_punches(booked):
+    app = booked
+    app.punch_break("ann", "lunch", "start", at("19:35"))
+    app.get_live_adherence(DATE)
+    app.punch_break("ann", "lunch", "end", at("20:00"))
+    frame = app.get_live_adherence(DATE)
+    assert app.get_adherence_tracker(DATE).events == 2
+    assert frame["Ended"].tolist() == [app.shift_minutes("20:00")]
+
+
+def test_archived_day_still_flags_late_starts(booked):
+    app = booked
+    app.punch_break("ann", "lunch", "start", at("19:40"))
+    app.punch_break("ann", "lunch", "end", at("20:10"))
+    with app.use_clock(app.FakeClock(at("12:05", day=2))):
+        assert app.roll_over_break_day({"date": None})["archived_rows"] == 3
+    assert app.get_bookings_for_date(DATE)["ann"]["lunch"]["time"] == "19:30"
+
+    frame = app.get_live_adherence(DATE)
+    assert frame["Booked"].tolist() == [app.shift_minutes("19:30")]
+    assert frame["Late Start"].tolist() == [True]
+    assert app.summarize_adherence(frame)["Late Starts"].tolist() == [1]
+
+
+def synthetic_punches(app, agent_count, seed):
+    rng = random.Random(seed)
+    slots = app.template_slot_lists(app.DEFAULT_BREAK_TEMPLATE)
+    events = []
+    for i in range(agent_count):
+        for break_type in app.BREAK_TYPES:
+            slot = rng.choice(slots[break_type])
+            start = app.shift_minutes(slot) + max(0, int(rng.gauss(1, 3)))
+            end = start + app.BREAK_DURATIONS[break_type] + max(0, int(rng.gauss(0, 2)))
+            events.append((start, f"agent{i:04d}", break_type, "start", slot))
+            events.append((end, f"agent{i:04d}", break_type, "end", slot))
+    events.sort()
+    return events
+
+
+def recompute(app, events):
+    """Adherence from scratch over every punch so far: (late starts, overruns)"""
+    late = overruns = 0
+    breaks = {}
+    for minute, agent, break_type, event, slot in events:
+        breaks.setdefault((agent, break_type), {"slot": slot})[event] = minute
+    for (agent, break_type), entry in breaks.items():
+        if "start" in entry:
+            late += entry["start"] - app.shift_minutes(entry["slot"]) > app.LATE_START_GRACE
+        if "end" in entry:
+            overruns += entry["end"] - entry["start"] > app.BREAK_DURATIONS[break_type] + app.OVERRUN_GRACE
+    return late, overruns
+
+
+@pytest.mark.benchmark
+def test_benchmark_break_adherence(app, report, agent_count=1000, refreshes=60):
+    """A floor punching three breaks each, arriving over 60 refreshes: recompute the day versus the tracker"""
+    events = synthetic_punches(app, agent_count, seed=13)
+    batches = np.array_split(np.arange(len(events)), refreshes)
+
+    start = perf_counter()
+    expected = [recompute(app, events[:batch[-1] + 1]) for batch in batches]
+    recompute_ms = (perf_counter() - start) * 1000 / refreshes
+
+    tracker = app.AdherenceTracker("benchmark")
+    found = []
+    start = perf_counter()
+    for batch in batches:
+        for k in batch:
+            minute, agent, break_type, event, slot = events[k]
+            tracker.apply(agent, break_type, event, minute, slot)
+        frame = tracker.frame(minute)
+        found.append((int(frame["Late Start"].sum()), int(frame["Overrun"].sum())))
+    tracker_ms = (perf_counter() - start) * 1000 / refreshes
+
+    # Mid-day the tracker also counts breaks still running past their length, so
+    # overruns only agree once every break has ended
+    assert [late for late, _ in found] == [late for late, _ in expected]
+    assert all(live >= ended for (_, live), (_, ended) in zip(found, expected))
+    assert found[-1] == expected[-1]
+    report("Break adherence refresh cost", [
+        {"Method": "Recompute the day", "Per refresh (ms)": round(recompute_ms, 2)},
+        {"Method": "Incremental tracker", "Per refresh (ms)": round(tracker_ms, 2),
+         "Late starts": found[-1][0], "Overruns": found[-1][1]}
+    ])
+
+
+def test_archived_tracker_matches_the_recompute(app):
+    """The same synthetic day read back from the punch log with its bookings only in the archive"""
+    events = synthetic_punches(app, 200, seed=13)
+    bookings = {(agent, break_type): slot for _, agent, break_type, _, slot in events}
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        conn.execute(
+            "INSERT INTO break_bookings_archive (date, booking_count, payload) VALUES (?, ?, ?)",
+            (DATE, len(bookings), app.compress_archive_payload(
+                [[agent, break_type, slot, "Default Template", None] for (agent, break_type), slot in bookings.items()]
+            ))
+        )
+        conn.executemany(
+            "INSERT INTO break_punches (date, agent, break_type, event, minute, punched_at) VALUES (?, ?, ?, ?, ?, '')",
+            [(DATE, agent, break_type, event, minute) for minute, agent, break_type, event, _ in events]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    frame = app.get_live_adherence(DATE)
+    assert (int(frame["Late Start"].sum()), int(frame["Overrun"].sum())) == recompute(app, events)
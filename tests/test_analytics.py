@@ -0,0 +1,97 @@
+import itertools
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+TEMPLATE = {"lunch_breaks": ["19:30"], "tea_breaks": {"early": ["16:00"], "late": ["22:00"]}}
+# 2000-01-03 is a Monday
+COLUMNS = {
+    "date": ["2000-01-03", "2000-01-03", "2000-01-04"],
+    "agent": ["ann", "bob", "ann"],
+    "break_type": ["lunch", "lunch", "lunch"],
+    "slot": ["19:30", "19:30", "19:30"],
+    "template": ["T", "T", "Retired"],
+    "booked_at": ["2000-01-03 12:00:00", "2000-01-03 12:10:00", "2000-01-04 12:00:00"],
+}
+
+
+@pytest.fixture
+def analytics(app):
+    compiled = {"T": app.compile_template("T", TEMPLATE, {"lunch": {"19:30": 2}})}
+    frame = app.booking_history_frame(COLUMNS, {"ann": "G"})
+    return app, frame, app.compute_break_analytics(frame, compiled)
+
+
+def test_fill_rate_and_time_to_fill(analytics):
+    app, _, result = analytics
+    assert (result["bookings"], result["days"]) == (3, 2)
+    label = "T · " + app.BREAK_TYPE_LABELS["lunch"] + " 19:30"
+    retired = "Retired · " + app.BREAK_TYPE_LABELS["lunch"] + " 19:30"
+    # A template nobody has any more falls back to the default limit
+    assert result["fill_rate"].loc[label, "Mon"] == 1.0
+    assert result["fill_rate"].loc[retired, "Tue"] == 1 / app.DEFAULT_SLOT_LIMITS["lunch"]
+    assert result["time_to_fill"].loc[label, "Mon"] == 10
+    assert result["fill_order"].loc[label, "Days Filled"] == 1
+    assert retired not in result["time_to_fill"].index
+
+
+def test_agent_counts_and_template_changes(analytics):
+    _, _, result = analytics
+    assert result["by_template"].loc[pd.Timestamp("2000-01-03"), "T"] == 2
+    assert result["by_group"].loc[pd.Timestamp("2000-01-03")].to_dict() == {"G": 1, "No group": 1}
+    changes = result["template_changes"]
+    assert changes.loc["ann"].tolist() == [2, 1, 2]
+    assert changes.loc["bob"].tolist() == [1, 0, 1]
+
+
+def test_empty_history_has_no_analytics(app):
+    frame = app.booking_history_frame({name: [] for name in COLUMNS}, {})
+    assert app.compute_break_analytics(frame, {}) is None
+
+
+def test_cached_analytics_follow_new_bookings(app):
+    limits = {"lunch": 5, "early_tea": 5, "late_tea": 5}
+    app.book_agent_breaks("2000-01-03", "ann", "Default Template", {"lunch": "19:30"}, limits)
+    first = app.get_break_analytics()
+    assert app.get_break_analytics() is first
+    app.book_agent_breaks("2000-01-03", "bob", "Default Template", {"lunch": "19:30"}, limits)
+    assert app.get_break_analytics()["bookings"] == 2
+
+
+@pytest.mark.benchmark
+def test_benchmark_break_analytics(app, report, agent_count=500, days=90):
+    """Time the columnar extract and the analytics over a synthetic booking history"""
+    rng = np.random.default_rng(17)
+    compiled = {"Default Template": app.compile_template("Default Template", app.DEFAULT_BREAK_TEMPLATE)}
+    slots = app.template_slot_lists(app.DEFAULT_BREAK_TEMPLATE)
+    dates = pd.date_range("2024-01-01", periods=days).strftime("%Y-%m-%d")
+    columns = {name: [] for name in COLUMNS}
+    offsets = rng.integers(0, 4 * 3600, size=agent_count * days)
+    for k, (date, agent) in enumerate(itertools.product(dates, range(agent_count))):
+        for break_type in app.BREAK_TYPES:
+            columns["date"].append(date)
+            columns["agent"].append(f"agent{agent:04d}")
+            columns["break_type"].append(break_type)
+            columns["slot"].append(slots[break_type][int(rng.integers(len(slots[break_type])))])
+            columns["template"].append("Default Template")
+            columns["booked_at"].append(f"{date} {12 + offsets[k] // 3600:02d}:{offsets[k] // 60 % 60:02d}:{offsets[k] % 60:02d}")
+
+    start = perf_counter()
+    frame = app.booking_history_frame(columns, {})
+    extract_ms = (perf_counter() - start) * 1000
+    start = perf_counter()
+    result = app.compute_break_analytics(frame, compiled)
+    compute_ms = (perf_counter() - start) * 1000
+
+    assert (result["bookings"], result["days"]) == (agent_count * days * len(app.BREAK_TYPES), days)
+    assert result["template_changes"]["Template Changes"].sum() == 0
+    assert ((result["fill_rate"] > 0) & (result["fill_rate"] <= 1)).all().all()
+    report("Break analytics compute time", [{
+        "Bookings": result["bookings"],
+        "Days": result["days"],
+        "Columnar extract (ms)": round(extract_ms, 1),
+        "All analytics (ms)": round(compute_ms, 1),
+        "Frame memory (MB)": round(frame.memory_usage(deep=True).sum() / 1e6, 1)
+    }])
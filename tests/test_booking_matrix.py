@@ -0,0 +1,156 @@
+import json
+import random
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import pytest
+
+ROWS = [
+    ("ann", "lunch", "19:30", "Template A", "2000-01-01 12:00:05"),
+    ("ann", "early_tea", "16:00", "Template A", "2000-01-01 12:00:05"),
+    ("bob", "lunch", "19:30", "Template B", "2000-01-01 12:01:00"),
+    ("bob", "late_tea", "23:15", "Template B", "2000-01-01 12:01:00"),
+    ("cat", "lunch", "20:00", None, None),
+]
+
+
+def overlaps(app, bookings):
+    """Brute force: does any pair of this agent's breaks overlap?"""
+    spans = [app.break_interval(break_type, slot) for break_type, slot in bookings.items()]
+    return any(a[0] < b[1] and b[0] < a[1] for n, a in enumerate(spans) for b in spans[n + 1:])
+
+
+def deep_sizeof(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def test_matrix_returns_the_same_bookings_as_the_dict(app):
+    matrix = app.BookingMatrix.from_rows("2000-01-01", ROWS)
+    expected = app._booking_rows_to_dict(ROWS)
+    expected["cat"]["lunch"]["template"] = "Default Template"
+    assert len(matrix) == 3
+    assert {agent: matrix.agent_bookings(agent) for agent in matrix.agents} == expected
+    assert matrix.agent_bookings("nobody") == {}
+
+
+def test_matrix_occupancy_counts_each_slot(app):
+    matrix = app.BookingMatrix.from_rows("2000-01-01", ROWS)
+    assert matrix.occupancy() == Counter((break_type, slot) for _, break_type, slot, _, _ in ROWS)
+    assert matrix.occupancy("Template B") == {("lunch", "19:30"): 1, ("late_tea", "23:15"): 1}
+    assert matrix.occupancy("No such template") == {}
+
+
+def test_conflicts_wrap_past_midnight(app):
+    rows = [
+        # 23:50-00:20 lunch overlaps the 00:05 tea on the other side of midnight
+        ("wraps", "lunch", "23:50", None, None),
+        ("wraps", "late_tea", "00:05", None, None),
+        # 23:30-00:00 lunch only touches the 00:00 tea
+        ("touches", "lunch", "23:30", None, None),
+        ("touches", "late_tea", "00:00", None, None),
+        # Far apart on the clock face but not in the shift
+        ("apart", "early_tea", "15:00", None, None),
+        ("apart", "late_tea", "14:50", None, None),
+    ]
+    matrix = app.BookingMatrix.from_rows("2000-01-01", rows)
+    flagged = dict(zip(matrix.agents, matrix.conflicting_agents()))
+    assert flagged == {"wraps": True, "touches": False, "apart": False}
+    assert app.check_break_conflicts({"lunch": "23:50", "late_tea": "00:05"})
+    assert app.check_break_conflicts({"lunch": "23:30", "late_tea": "00:00"}) is None
+
+
+def test_conflict_mask_matches_pairwise_check_at_every_hour(app):
+    rng = random.Random(3)
+    times = [f"{h:02d}:{m:02d}" for h in range(24) for m in (0, 5, 10, 20, 30, 45, 50, 55)]
+    rows = []
+    for i in range(500):
+        for break_type in app.BREAK_TYPES:
+            if rng.random() < 0.9:
+                rows.append((f"agent{i:04d}", break_type, rng.choice(times), None, None))
+    matrix = app.BookingMatrix.from_rows("2000-01-01", rows)
+    by_agent = {}
+    for agent, break_type, slot, _, _ in rows:
+        by_agent.setdefault(agent, {})[break_type] = slot
+    expected = [overlaps(app, by_agent[agent]) for agent in matrix.agents]
+    assert matrix.conflicting_agents().tolist() == expected
+
+
+@pytest.mark.benchmark
+def test_benchmark_booking_matrix(app, report, agent_count=1000, days=30):
+    """Nested-dict bookings, round-tripped through JSON as the old all_bookings.json loader did, versus BookingMatrix"""
+    rng = random.Random(11)
+    options = app.template_slot_lists(app.DEFAULT_BREAK_TEMPLATE)
+    start_day = datetime(2000, 1, 1)
+    rows_by_day = {}
+    for d in range(days):
+        date = (start_day + timedelta(days=d)).strftime("%Y-%m-%d")
+        rows = []
+        for i in range(agent_count):
+            booked_at = f"{date} {12 + i % 3:02d}:{i % 60:02d}:{(i * 7) % 60:02d}"
+            template = f"Template {i % 4}"
+            for break_type, slots in options.items():
+                rows.append((f"agent{i:04d}", break_type, rng.choice(slots), template, booked_at))
+        rows_by_day[date] = rows
+
+    nested = json.loads(json.dumps({date: app._booking_rows_to_dict(rows) for date, rows in rows_by_day.items()}))
+    start = perf_counter()
+    matrices = {date: app.BookingMatrix.from_rows(date, rows) for date, rows in rows_by_day.items()}
+    build_ms = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    dict_counts = {}
+    for date, agents in nested.items():
+        counts = {}
+        for bookings in agents.values():
+            for break_type, entry in bookings.items():
+                key = (break_type, entry["time"])
+                counts[key] = counts.get(key, 0) + 1
+        dict_counts[date] = counts
+    dict_occupancy_ms = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    matrix_counts = {date: matrix.occupancy() for date, matrix in matrices.items()}
+    matrix_occupancy_ms = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    dict_conflicts = sum(
+        overlaps(app, {break_type: entry["time"] for break_type, entry in bookings.items()})
+        for agents in nested.values() for bookings in agents.values()
+    )
+    dict_conflict_ms = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    matrix_conflicts = sum(int(matrix.conflicting_agents().sum()) for matrix in matrices.values())
+    matrix_conflict_ms = (perf_counter() - start) * 1000
+
+    dict_bytes = deep_sizeof(nested)
+    matrix_bytes = sum(matrix.nbytes() for matrix in matrices.values())
+    assert matrix_counts == dict_counts
+    assert matrix_conflicts == dict_conflicts
+    assert matrix_bytes < dict_bytes
+    report("Booking matrix memory and latency", [
+        {
+            "Representation": "Nested dicts",
+            "Memory (KB)": round(dict_bytes / 1024, 1),
+            "Occupancy, all days (ms)": round(dict_occupancy_ms, 2),
+            "Conflict check, all days (ms)": round(dict_conflict_ms, 2),
+        },
+        {
+            "Representation": "BookingMatrix",
+            "Memory (KB)": round(matrix_bytes / 1024, 1),
+            "Build (ms)": round(build_ms, 2),
+            "Occupancy, all days (ms)": round(matrix_occupancy_ms, 2),
+            "Conflict check, all days (ms)": round(matrix_conflict_ms, 2),
+        }
+    ])
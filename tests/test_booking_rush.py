@@ -0,0 +1,188 @@
+import random
+import sqlite3
+import threading
+from time import perf_counter
+
+import pytest
+
+DATE = "2000-01-01"
+
+
+def stored_bookings(break_type=None):
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        if break_type is None:
+            return conn.execute("SELECT agent, break_type, slot FROM break_bookings").fetchall()
+        return conn.execute("SELECT agent, slot FROM break_bookings WHERE break_type = ?", (break_type,)).fetchall()
+    finally:
+        conn.close()
+
+
+def counter_drift():
+    """Slot counters that disagree with the bookings they count"""
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        return conn.execute("""
+            SELECT COUNT(*) FROM break_slot_occupancy o
+            WHERE o.booked != (SELECT COUNT(*) FROM break_bookings b
+                               WHERE b.date = o.date AND b.break_type = o.break_type AND b.slot = o.slot)
+        """).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+
+def test_racing_agents_never_oversell_the_last_seats(app):
+    limit = 5
+    barrier = threading.Barrier(40)
+    results = []
+
+    def book(agent):
+        barrier.wait()
+        status, _ = app.book_agent_breaks(DATE, agent, "Default Template", {"lunch": "19:30"}, {"lunch": limit})
+        results.append(status)
+
+    workers = [threading.Thread(target=book, args=(f"agent{i:02d}",)) for i in range(40)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert results.count("booked") == limit
+    assert results.count("full") == 40 - limit
+    assert len(stored_bookings("lunch")) == limit
+    assert counter_drift() == 0
+
+
+def test_full_slot_rolls_back_the_whole_booking(app):
+    limits = {"lunch": 1, "early_tea": 5}
+    assert app.book_agent_breaks(DATE, "ann", "Default Template", {"lunch": "19:30"}, limits) == ("booked", None)
+    status = app.book_agent_breaks(DATE, "bob", "Default Template", {"early_tea": "16:00", "lunch": "19:30"}, limits)
+    assert status == ("full", "lunch")
+    assert stored_bookings() == [("ann", "lunch", "19:30")]
+    assert counter_drift() == 0
+
+
+def test_second_booking_for_the_same_break_reports_exists(app):
+    limits = {"lunch": 5}
+    app.book_agent_breaks(DATE, "ann", "Default Template", {"lunch": "19:30"}, limits)
+    assert app.book_agent_breaks(DATE, "ann", "Default Template", {"lunch": "20:00"}, limits) == ("exists", None)
+    assert counter_drift() == 0
+
+
+def test_admission_queue_runs_one_booking_at_a_time(app):
+    queue = app.BookingAdmissionQueue()
+    inside = []
+    overlap = []
+
+    def work():
+        inside.append(1)
+        overlap.append(len(inside))
+        threading.Event().wait(0.001)
+        inside.pop()
+
+    workers = [threading.Thread(target=queue.admit, args=(work,)) for _ in range(20)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert max(overlap) == 1
+    assert queue.admitted == 20
+    assert queue.waiting() == 0
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("use_queue", [True, False], ids=["queue", "direct"])
+def test_benchmark_booking_rush(app, report, use_queue, agent_count=300, window_seconds=10, max_attempts=3):
+    """Agents confirm breaks within a few seconds of each other.
+
+    Limits seat about 80% of the floor and agents favour the earliest slots, as
+    they do at shift start. An agent told a slot just filled retries the next one.
+    """
+    rng = random.Random(7)
+    slots = {
+        "lunch": app.DEFAULT_BREAK_TEMPLATE["lunch_breaks"],
+        "early_tea": app.DEFAULT_BREAK_TEMPLATE["tea_breaks"]["early"],
+        "late_tea": app.DEFAULT_BREAK_TEMPLATE["tea_breaks"]["late"]
+    }
+    limits = {
+        break_type: max(1, -(-agent_count * 4 // (5 * len(options))))
+        for break_type, options in slots.items()
+    }
+    plans = []
+    for i in range(agent_count):
+        selections = {
+            break_type: options[min(int(rng.expovariate(1.0)), len(options) - 1)]
+            for break_type, options in slots.items()
+        }
+        plans.append((i * window_seconds / agent_count, f"agent{i:04d}", selections))
+
+    queue = app.BookingAdmissionQueue()
+    results = {}
+    latencies = []
+    result_lock = threading.Lock()
+
+    def attempt(delay, agent, selections):
+        pause = delay - (perf_counter() - started)
+        if pause > 0:
+            threading.Event().wait(pause)
+        selections = dict(selections)
+        for _ in range(max_attempts):
+            began = perf_counter()
+            try:
+                if use_queue:
+                    status, full_type = queue.admit(app.book_agent_breaks, DATE, agent, "Default Template",
+                                                    selections, limits)
+                else:
+                    status, full_type = app.book_agent_breaks(DATE, agent, "Default Template", selections, limits)
+            except sqlite3.OperationalError:
+                status = "error"
+            with result_lock:
+                latencies.append(perf_counter() - began)
+            if status != "full":
+                break
+            options = slots[full_type]
+            selections[full_type] = options[(options.index(selections[full_type]) + 1) % len(options)]
+        with result_lock:
+            results[agent] = status
+
+    workers = [threading.Thread(target=attempt, args=plan, daemon=True) for plan in plans]
+    started = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = perf_counter() - started
+
+    rows = stored_bookings()
+    per_slot = {}
+    for _, break_type, slot in rows:
+        per_slot[(break_type, slot)] = per_slot.get((break_type, slot), 0) + 1
+    overbooked = sum(max(0, booked - limits[break_type]) for (break_type, _), booked in per_slot.items())
+    confirmed = {agent for agent, status in results.items() if status == "booked"}
+    lost = confirmed ^ {agent for agent, _, _ in rows}
+    statuses = list(results.values())
+
+    assert overbooked == 0
+    assert not lost
+    assert counter_drift() == 0
+    if use_queue:
+        assert statuses.count("error") == 0
+    report("Shift-start booking rush", [{
+        "Mode": "Admission queue" if use_queue else "Direct",
+        "Agents": agent_count,
+        "Booked": statuses.count("booked"),
+        "Slot full": statuses.count("full"),
+        "Errors": statuses.count("error"),
+        "Attempts": len(latencies),
+        "Throughput (req/s)": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50 latency (ms)": round(percentile(latencies, 50) * 1000, 1),
+        "p99 latency (ms)": round(percentile(latencies, 99) * 1000, 1),
+        "Peak queue depth": queue.peak_waiting if use_queue else None
+    }])
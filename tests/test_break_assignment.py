@@ -0,0 +1,154 @@
+import copy
+import random
+import sqlite3
+from time import perf_counter
+
+import numpy as np
+import pytest
+
+DATE = "2000-01-01"
+# Lunch and late tea straddle midnight, so only some combinations are conflict-free
+WRAP_TEMPLATE = {
+    "lunch_breaks": ["23:30", "23:50"],
+    "tea_breaks": {"early": ["18:00"], "late": ["00:00", "00:05"]}
+}
+
+
+def stored_bookings():
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        return conn.execute("SELECT agent, break_type, slot FROM break_bookings ORDER BY agent, break_type").fetchall()
+    finally:
+        conn.close()
+
+
+def conflicting(app, assignment):
+    columns = {b: i for i, b in enumerate(app.BREAK_TYPES)}
+    starts = np.zeros((len(assignment), len(app.BREAK_TYPES)), dtype=np.int32)
+    booked = np.zeros_like(starts, dtype=bool)
+    for row, (_, picked) in enumerate(assignment.values()):
+        for break_type, slot in picked.items():
+            starts[row, columns[break_type]] = app.shift_minutes(slot)
+            booked[row, columns[break_type]] = True
+    return int(app.booking_conflict_mask(starts, booked).sum())
+
+
+def seats_over_limit(assignment, limits):
+    seats = {}
+    for name, picked in assignment.values():
+        for break_type, slot in picked.items():
+            seats[(name, break_type, slot)] = seats.get((name, break_type, slot), 0) + 1
+    return sum(max(0, n - limits[name][b][slot]) for (name, b, slot), n in seats.items())
+
+
+def test_solver_never_picks_breaks_that_overlap_across_midnight(app):
+    agents = [(f"agent{i}", "Wrap") for i in range(6)]
+    limits = {"Wrap": {"lunch": {"23:30": 3, "23:50": 3}, "early_tea": {"18:00": 6}, "late_tea": {"00:00": 3, "00:05": 3}}}
+    solved = app.solve_break_assignment(agents, {"Wrap": WRAP_TEMPLATE}, limits)
+    picks = [picked for _, picked in solved["assignment"].values()]
+    # 23:50 lunch runs to 00:20 and clashes with both teas, so only 23:30 + 00:00/00:05 fit
+    assert {p["lunch"] for p in picks} == {"23:30"}
+    assert len(picks) == 3
+    assert [agent for agent, _ in solved["unassigned"]] == ["agent3", "agent4", "agent5"]
+    assert conflicting(app, solved["assignment"]) == 0
+
+
+def test_solver_respects_limits_and_existing_occupancy(app):
+    templates = {"Default Template": app.DEFAULT_BREAK_TEMPLATE}
+    slots = app.template_slot_lists(app.DEFAULT_BREAK_TEMPLATE)
+    limits = {"Default Template": {b: {slot: 2 for slot in options} for b, options in slots.items()}}
+    occupancy = {("Default Template", "lunch", slot): 2 for slot in slots["lunch"][:-1]}
+    agents = [(f"agent{i}", "Default Template") for i in range(4)]
+    solved = app.solve_break_assignment(agents, templates, limits, occupancy=occupancy)
+    assert [picked["lunch"] for _, picked in solved["assignment"].values()] == [slots["lunch"][-1]] * 2
+    assert len(solved["unassigned"]) == 2
+    assert solved["peak"] >= solved["lower_bound"]
+
+
+def test_solver_reports_each_scope_against_its_own_absence(app):
+    for agent, group in (("ann", "G"), ("xav", "H"), ("yan", "H"), ("zed", "H")):
+        app.add_user(agent, "Passw0rd!", "agent", group)
+    limits = {"lunch": 5, "early_tea": 5, "late_tea": 5}
+    for agent in ("ann", "xav", "yan", "zed"):
+        app.book_agent_breaks(DATE, agent, "Default Template", {"lunch": "19:30"}, limits)
+    floor, group = app.get_floor_absence(DATE, app.FLOOR_SCOPE), app.get_floor_absence(DATE, "G")
+    assert (floor.max(), group.max()) == (4, 1)
+
+    templates = {"Default Template": {"lunch_breaks": ["19:30"], "tea_breaks": {"early": ["16:00"], "late": ["22:00"]}}}
+    slot_limits = {"Default Template": {"lunch": {"19:30": 9}, "early_tea": {"16:00": 9}, "late_tea": {"22:00": 9}}}
+    solved = app.solve_break_assignment([("bob", "Default Template"), ("cat", "Default Template")], templates, slot_limits,
+                                        scope_absence={app.FLOOR_SCOPE: floor, "G": group})
+    # Both new agents take the only lunch, on top of each scope's own bookings
+    assert solved["peaks"] == {app.FLOOR_SCOPE: 6, "G": 3}
+    assert app.solve_break_assignment([], templates, slot_limits)["peaks"] == {}
+
+
+def test_apply_writes_every_booking_or_none(app):
+    assignment = {
+        "ann": ("Default Template", {"lunch": "19:30", "early_tea": "16:00"}),
+        "bob": ("Default Template", {"lunch": "19:30", "early_tea": "16:15"}),
+    }
+    # Room for one lunch at 19:30 only: bob's seat is refused and ann's is rolled back with it
+    status = app.apply_break_assignment(DATE, assignment, limit_for=lambda t, b, s: 1)
+    assert status == ("full", ("bob", "lunch", "19:30"))
+    assert stored_bookings() == []
+
+    assert app.apply_break_assignment(DATE, assignment, limit_for=lambda t, b, s: 2) == ("booked", None)
+    assert len(stored_bookings()) == 4
+    assert app.apply_break_assignment(DATE, {"ann": assignment["ann"]}, limit_for=lambda t, b, s: 5) == ("exists", None)
+    assert len(stored_bookings()) == 4
+
+
+def test_apply_counts_seats_booked_since_the_preview(app):
+    limits = {"lunch": 2, "early_tea": 5, "late_tea": 5}
+    for agent in ("early1", "early2"):
+        app.book_agent_breaks(DATE, agent, "Default Template", {"lunch": "19:30"}, limits)
+    assignment = {"ann": ("Default Template", {"lunch": "19:30"})}
+    status = app.apply_break_assignment(DATE, assignment, limit_for=lambda t, b, s: limits[b])
+    assert status == ("full", ("ann", "lunch", "19:30"))
+    assert [agent for agent, _, _ in stored_bookings()] == ["early1", "early2"]
+
+
+@pytest.mark.benchmark
+def test_benchmark_break_solver(app, report, agent_count=1000):
+    """A roster on two templates with limits seating about 60% more than needed; a quarter state a lunch wish"""
+    late_template = {
+        "lunch_breaks": ["19:45", "20:15", "20:45", "21:15"],
+        "tea_breaks": {"early": ["16:30", "16:45", "17:00", "17:15", "17:45"], "late": ["22:00", "22:15", "22:45"]}
+    }
+    templates = {"Default Template": copy.deepcopy(app.DEFAULT_BREAK_TEMPLATE), "Late Template": late_template}
+    rng = random.Random(5)
+    agents = [(f"agent{i:04d}", "Default Template" if i % 3 else "Late Template") for i in range(agent_count)]
+    limits = {}
+    for name, template in templates.items():
+        users = sum(1 for _, assigned in agents if assigned == name)
+        limits[name] = {
+            break_type: {slot: -(-users * 16 // (10 * len(slots))) for slot in slots}
+            for break_type, slots in app.template_slot_lists(template).items()
+        }
+    preferences = {
+        agent: {"lunch": rng.choice(app.template_slot_lists(templates[name])["lunch"])}
+        for agent, name in agents[::4]
+    }
+
+    start = perf_counter()
+    solved = app.solve_break_assignment(agents, templates, limits, preferences=preferences)
+    solve_ms = (perf_counter() - start) * 1000
+    first_come = app.solve_break_assignment(agents, templates, limits, first_come=True)
+    granted = sum(
+        1 for agent, wish in preferences.items()
+        if agent in solved["assignment"] and solved["assignment"][agent][1].get("lunch") == wish["lunch"]
+    )
+
+    assert len(solved["assignment"]) == agent_count
+    assert conflicting(app, solved["assignment"]) == 0
+    assert seats_over_limit(solved["assignment"], limits) == 0
+    assert solved["lower_bound"] <= solved["peak"] <= first_come["peak"]
+    report("Bulk break assignment solver", [{
+        "Agents": agent_count,
+        "Solve time (ms)": round(solve_ms, 1),
+        "Peak absence": solved["peak"],
+        "Lower bound": solved["lower_bound"],
+        "First-come peak": first_come["peak"],
+        "Lunch preferences granted": f"{granted}/{len(preferences)}"
+    }])
@@ -0,0 +1,149 @@
+import copy
+import sqlite3
+from time import perf_counter
+
+import pytest
+
+TRACKED = ("break_templates", "template_slots")
+
+
+@pytest.fixture
+def writes(app):
+    """Count rows written to the registry tables, whichever connection writes them"""
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        conn.execute("CREATE TABLE registry_writes (n INTEGER)")
+        for table in TRACKED:
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(f"""
+                    CREATE TRIGGER count_{table}_{event.lower()} AFTER {event} ON {table}
+                    BEGIN INSERT INTO registry_writes VALUES (1); END
+                """)
+        conn.commit()
+    finally:
+        conn.close()
+
+    def count():
+        conn = sqlite3.connect("data/requests.db")
+        try:
+            return conn.execute("SELECT COUNT(*) FROM registry_writes").fetchone()[0]
+        finally:
+            conn.close()
+
+    return count
+
+
+def stored(app, name):
+    registry = app.get_break_registry()
+    registry.refresh()
+    templates, limits, _ = registry.views()
+    return copy.deepcopy(templates[name]), copy.deepcopy(limits[name]), registry.versions()[name]
+
+
+def test_saving_an_unchanged_template_writes_nothing(app, writes):
+    template, limits, version = stored(app, "Default Template")
+    before = writes()
+    assert app.update_break_template("Default Template", template, limits, version) == "unchanged"
+    assert writes() == before
+    assert stored(app, "Default Template")[2] == version
+
+
+def test_saving_one_limit_rewrites_only_that_slot(app, writes):
+    template, limits, version = stored(app, "Default Template")
+    limits["lunch"]["19:30"] += 1
+    before = writes()
+    assert app.update_break_template("Default Template", template, limits, version) == "saved"
+    # One slot row plus the template's version stamp
+    assert writes() - before == 2
+    _, saved_limits, saved_version = stored(app, "Default Template")
+    assert saved_limits == limits and saved_version > version
+
+    template["lunch_breaks"].remove("19:30")
+    assert app.update_break_template("Default Template", template, limits, saved_version) == "saved"
+    assert "19:30" not in stored(app, "Default Template")[1]["lunch"]
+
+
+def test_activation_only_moves_the_version_when_it_changes(app, writes):
+    _, _, version = stored(app, "Default Template")
+    before = writes()
+    app.set_template_active("Default Template", True)
+    assert writes() == before and stored(app, "Default Template")[2] == version
+    app.set_template_active("Default Template", False)
+    assert stored(app, "Default Template")[2] > version
+    assert app.get_break_registry().views()[2] == []
+
+
+def test_registry_rereads_only_templates_whose_version_moved(app):
+    app.create_break_template("Late Template")
+    registry = app.get_break_registry()
+    registry.refresh()
+    stats = registry.stats()
+    registry.refresh()
+    assert registry.stats()["Unchanged refreshes"] == stats["Unchanged refreshes"] + 1
+    assert registry.stats()["Templates recompiled"] == stats["Templates recompiled"]
+
+    # Saved by another process: only that template is re-read and recompiled
+    template, limits, version = stored(app, "Late Template")
+    limits["early_tea"]["16:00"] = 9
+    app.update_break_template("Late Template", template, limits, version)
+    recompiled = registry.stats()["Templates recompiled"]
+    registry.refresh()
+    assert registry.views()[1]["Late Template"]["early_tea"]["16:00"] == 9
+    assert registry.stats()["Templates recompiled"] == recompiled + 1
+
+
+def legacy_save(app, name, template, limits):
+    """The old save path: every slot deleted and inserted again and the version bumped"""
+    compiled = app.compile_template(name, template, limits)
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        cursor = conn.cursor()
+        template_id = cursor.execute("SELECT id FROM break_templates WHERE name = ?", (name,)).fetchone()[0]
+        cursor.execute("UPDATE break_templates SET version = version + 1 WHERE id = ?", (template_id,))
+        cursor.execute("DELETE FROM template_slots WHERE template_id = ?", (template_id,))
+        cursor.executemany(
+            "INSERT INTO template_slots (template_id, break_type, minute, slot_limit) VALUES (?, ?, ?, ?)",
+            [(template_id, b, int(m), int(n)) for b in app.BREAK_TYPES
+             for m, n in zip(compiled.minutes[b], compiled.limits[b])]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.mark.benchmark
+def test_benchmark_registry_writes(app, writes, report, page_views=20, template_count=5):
+    """Rows written per admin page view that saves every template; one view in the middle edits a single limit"""
+    names = ["Default Template"] + [f"Template {i}" for i in range(1, template_count)]
+    for name in names[1:]:
+        app.create_break_template(name)
+    state = {name: stored(app, name)[:2] for name in names}
+    edit_view = page_views // 2
+
+    def run(save):
+        per_view = []
+        for view in range(page_views):
+            if view == edit_view:
+                state[names[0]][1]["lunch"]["19:30"] += 1
+            before = writes()
+            start = perf_counter()
+            for name in names:
+                save(name, *state[name])
+            per_view.append((writes() - before, (perf_counter() - start) * 1000))
+        state[names[0]][1]["lunch"]["19:30"] -= 1
+        save(names[0], *state[names[0]])
+        return per_view
+
+    legacy = run(lambda name, template, limits: legacy_save(app, name, template, limits))
+    tracked = run(app.update_break_template)
+
+    slots = sum(len(times) for template, _ in state.values() for times in template["tea_breaks"].values())
+    slots += sum(len(template["lunch_breaks"]) for template, _ in state.values())
+    assert all(rows == 2 * slots + template_count for rows, _ in legacy)
+    assert [rows for rows, _ in tracked] == [2 if view == edit_view else 0 for view in range(page_views)]
+    report("Break registry writes per admin page view", [
+        {"Save path": "Rewrite every slot", "Rows per view": legacy[0][0],
+         "Per view (ms)": round(sum(ms for _, ms in legacy) / page_views, 2)},
+        {"Save path": "Changed slots only", "Rows per unchanged view": tracked[0][0], "Rows on the edit": tracked[edit_view][0],
+         "Per view (ms)": round(sum(ms for _, ms in tracked) / page_views, 2)}
+    ])
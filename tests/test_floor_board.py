@@ -0,0 +1,104 @@
+import random
+from datetime import datetime
+from time import perf_counter
+
+import pytest
+
+DATE = "2000-01-01"
+
+
+def random_floor(app, agent_count, seed):
+    rng = random.Random(seed)
+    slots = app.template_slot_lists(app.DEFAULT_BREAK_TEMPLATE)
+    slots["late_tea"] = slots["late_tea"] + ["23:50", "00:05"]
+    return [
+        (f"agent{i:04d}", break_type, rng.choice(slots[break_type]), "Default Template", None)
+        for i in range(agent_count) for break_type in app.BREAK_TYPES
+    ]
+
+
+def scan(app, rows, minute):
+    """Rescan every booking: (agents away, agents starting within the horizon)"""
+    away, soon = set(), set()
+    for agent, break_type, slot, _, _ in rows:
+        begin, end = app.break_interval(break_type, slot)
+        if begin <= minute < end:
+            away.add((agent, break_type))
+        elif minute < begin <= minute + app.FLOOR_BOARD_HORIZON:
+            soon.add((agent, break_type))
+    return away, soon
+
+
+def test_timeline_matches_a_rescan_at_every_minute(app):
+    rows = random_floor(app, 200, seed=3)
+    timeline = app.FloorTimeline(DATE, rows)
+    for minute in range(app.ASSIGNMENT_TIMELINE_MINUTES):
+        away, soon = scan(app, rows, minute)
+        assert {(r[2], r[3]) for r in timeline.on_break(minute)} == away
+        assert {(r[2], r[3]) for r in timeline.upcoming(minute)} == soon
+        assert timeline.away_at(minute) == len(away)
+
+
+def test_timeline_peak_and_empty_day(app):
+    rows = [
+        ("ann", "lunch", "19:30", "T", None),
+        ("bob", "early_tea", "19:45", "T", None),
+        ("cat", "late_tea", "22:00", "T", None),
+    ]
+    timeline = app.FloorTimeline(DATE, rows)
+    assert timeline.peak() == (2, app.shift_minutes("19:45"))
+    assert app.FloorTimeline(DATE, []).peak() == (0, None)
+
+
+def test_floor_timeline_is_rebuilt_when_a_booking_lands(app):
+    limits = {"lunch": 5, "early_tea": 5, "late_tea": 5}
+    app.book_agent_breaks(DATE, "ann", "Default Template", {"lunch": "19:30"}, limits)
+    first = app.get_floor_timeline(DATE)
+    assert app.get_floor_timeline(DATE) is first
+    app.book_agent_breaks(DATE, "bob", "Default Template", {"lunch": "19:30"}, limits)
+    second = app.get_floor_timeline(DATE)
+    assert second is not first
+    assert second.away_at(app.shift_minutes("19:40")) == 2
+
+
+def test_booking_date_rolls_over_at_the_cutoff(app):
+    assert app.booking_date(datetime(2000, 1, 2, 0, 30)) == "2000-01-01"
+    assert app.booking_date(datetime(2000, 1, 2, 11, 58)) == "2000-01-01"
+    assert app.booking_date(datetime(2000, 1, 2, 11, 59)) == "2000-01-02"
+    assert app.booking_date(datetime(2000, 1, 2, 23, 50)) == "2000-01-02"
+    with app.use_clock(app.FakeClock(datetime(2000, 1, 3, 1, 0))):
+        assert app.booking_date() == "2000-01-02"
+
+
+def test_break_starts_after_midnight_belong_to_the_next_calendar_day(app):
+    assert app.break_start_at("2000-01-01", "23:50") == datetime(2000, 1, 1, 23, 50)
+    assert app.break_start_at("2000-01-01", "00:05") == datetime(2000, 1, 2, 0, 5)
+    assert app.break_start_at("2000-01-01", "12:00") == datetime(2000, 1, 1, 12, 0)
+
+
+@pytest.mark.benchmark
+def test_benchmark_floor_board(app, report, agent_count=1000, refreshes=240):
+    """Who is away now and who starts next, by rescanning every booking versus the timeline"""
+    rows = random_floor(app, agent_count, seed=3)
+    rng = random.Random(3)
+    minutes = [rng.randrange(0, 12 * 60) for _ in range(refreshes)]
+
+    start = perf_counter()
+    scanned = [scan(app, rows, minute) for minute in minutes]
+    scan_ms = (perf_counter() - start) * 1000 / refreshes
+
+    start = perf_counter()
+    timeline = app.FloorTimeline("benchmark", rows)
+    build_ms = (perf_counter() - start) * 1000
+    start = perf_counter()
+    answers = [(timeline.on_break(minute), timeline.upcoming(minute), timeline.away_at(minute)) for minute in minutes]
+    query_ms = (perf_counter() - start) * 1000 / refreshes
+
+    for (away, soon), (current, upcoming, headcount) in zip(scanned, answers):
+        assert {(r[2], r[3]) for r in current} == away
+        assert {(r[2], r[3]) for r in upcoming} == soon
+        assert headcount == len(away)
+    report("Live floor board refresh cost", [
+        {"Method": "Rescan every booking", "Per refresh (ms)": round(scan_ms, 3)},
+        {"Method": "Interval index + prefix sums", "Build (ms)": round(build_ms, 2), "Per refresh (ms)": round(query_ms, 3)}
+    ])
@@ -0,0 +1,125 @@
+import random
+import sqlite3
+from time import perf_counter
+
+import numpy as np
+import pytest
+
+DATE = "2000-01-01"
+LIMITS = {"lunch": 50, "early_tea": 50, "late_tea": 50}
+PASSWORD = "Passw0rd!"
+
+
+def set_caps(caps):
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        conn.executemany("INSERT INTO break_floor_caps (scope, max_away) VALUES (?, ?)", caps.items())
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def stored_agents():
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        return sorted({row[0] for row in conn.execute("SELECT agent FROM break_bookings")})
+    finally:
+        conn.close()
+
+
+def test_segment_tree_matches_a_plain_array(app):
+    rng = random.Random(41)
+    size = app.ASSIGNMENT_TIMELINE_MINUTES
+    tree, plain = app.MaxSegmentTree(size), np.zeros(size, dtype=np.int64)
+    for _ in range(2000):
+        lo = rng.randrange(size)
+        hi = rng.randrange(lo + 1, min(size, lo + 90) + 1)
+        if rng.random() < 0.6:
+            delta = rng.choice([1, 1, 1, -1])
+            tree.add(lo, hi, delta)
+            plain[lo:hi] += delta
+        else:
+            assert tree.max(lo, hi) == plain[lo:hi].max()
+
+
+def test_booking_is_refused_once_the_floor_cap_is_reached(app):
+    set_caps({app.FLOOR_SCOPE: 2})
+    for agent in ("ann", "bob"):
+        assert app.book_agent_breaks(DATE, agent, "Default Template", {"lunch": "19:30"}, LIMITS) == ("booked", None)
+    # A 19:45 lunch overlaps the two 19:30 ones; the tea booked with it is refused too
+    status = app.book_agent_breaks(DATE, "cat", "Default Template", {"early_tea": "16:00", "lunch": "19:45"}, LIMITS)
+    assert status == ("cap", "lunch")
+    assert stored_agents() == ["ann", "bob"]
+    assert app.book_agent_breaks(DATE, "cat", "Default Template", {"lunch": "20:00"}, LIMITS) == ("booked", None)
+    assert stored_agents() == ["ann", "bob", "cat"]
+
+
+def test_group_cap_only_counts_the_group(app):
+    for agent, group in (("ann", "G"), ("bob", "G"), ("cat", "H")):
+        app.add_user(agent, PASSWORD, "agent", group)
+    set_caps({"G": 1})
+    assert app.book_agent_breaks(DATE, "ann", "Default Template", {"lunch": "19:30"}, LIMITS) == ("booked", None)
+    assert app.book_agent_breaks(DATE, "cat", "Default Template", {"lunch": "19:30"}, LIMITS) == ("booked", None)
+    assert app.book_agent_breaks(DATE, "bob", "Default Template", {"lunch": "19:30"}, LIMITS) == ("cap", "lunch")
+
+
+def test_cancelled_booking_frees_its_cap_seat(app):
+    set_caps({app.FLOOR_SCOPE: 1})
+    app.book_agent_breaks(DATE, "ann", "Default Template", {"lunch": "19:30"}, LIMITS)
+    assert app.book_agent_breaks(DATE, "bob", "Default Template", {"lunch": "19:30"}, LIMITS) == ("cap", "lunch")
+    app.delete_agent_bookings(DATE, "ann")
+    assert app.book_agent_breaks(DATE, "bob", "Default Template", {"lunch": "19:30"}, LIMITS) == ("booked", None)
+
+
+def test_bulk_apply_refuses_an_assignment_over_the_cap(app):
+    for agent in ("ann", "bob", "cat"):
+        app.add_user(agent, PASSWORD, "agent", "G")
+    set_caps({"G": 2})
+    app.book_agent_breaks(DATE, "ann", "Default Template", {"lunch": "19:30"}, LIMITS)
+    assignment = {
+        "bob": ("Default Template", {"lunch": "19:30"}),
+        "cat": ("Default Template", {"lunch": "19:30"}),
+    }
+    status = app.apply_break_assignment(DATE, assignment, limit_for=lambda t, b, s: 50)
+    assert status == ("cap", ("cat", "G", 2))
+    assert stored_agents() == ["ann"]
+
+
+@pytest.mark.benchmark
+def test_benchmark_floor_cap_checks(app, report, agent_count=1000, cap=60):
+    """Book a floor one agent at a time under a cap: rescan per check versus the segment tree"""
+    rng = random.Random(9)
+    slots = app.template_slot_lists(app.DEFAULT_BREAK_TEMPLATE)
+    requests = []
+    while len(requests) < agent_count:
+        # The booking page refuses overlapping selections before they reach the cap check
+        picked = {break_type: rng.choice(slots[break_type]) for break_type in app.BREAK_TYPES}
+        if app.check_break_conflicts(picked) is None:
+            requests.append([app.break_interval(break_type, slot) for break_type, slot in picked.items()])
+
+    start = perf_counter()
+    booked, scan_accepted = [], []
+    for n, spans in enumerate(requests):
+        away = np.zeros(app.ASSIGNMENT_TIMELINE_MINUTES, dtype=np.int32)
+        for begin, end in booked:
+            away[begin:end] += 1
+        if all(away[begin:end].max() < cap for begin, end in spans):
+            booked.extend(spans)
+            scan_accepted.append(n)
+    scan_ms = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    occupancy, tree_accepted = app.FloorOccupancy(), []
+    for n, spans in enumerate(requests):
+        if all(occupancy.peak_in(begin, end) < cap for begin, end in spans):
+            for begin, end in spans:
+                occupancy.add(begin, end)
+            tree_accepted.append(n)
+    tree_ms = (perf_counter() - start) * 1000
+
+    assert tree_accepted == scan_accepted
+    assert max(occupancy.away_at(m) for m in range(app.ASSIGNMENT_TIMELINE_MINUTES)) <= cap
+    report("Floor cap checks", [
+        {"Method": "Rescan bookings", "Accepted": len(scan_accepted), "Total (ms)": round(scan_ms, 1)},
+        {"Method": "Segment tree", "Accepted": len(tree_accepted), "Total (ms)": round(tree_ms, 1)}
+    ])
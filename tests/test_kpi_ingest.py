@@ -0,0 +1,77 @@
+import io
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def export(rows, seed, sep="\t"):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Agent": [f"agent{i:05d}" for i in range(rows)],
+        "Group": rng.choice(["US-A", "US-B", "US-C"], rows),
+        "Calls": rng.integers(0, 120, rows),
+        "AHT (s)": rng.normal(420, 60, rows).round(1),
+        "Hold (s)": rng.normal(35, 10, rows).round(1)
+    }).to_csv(index=False, sep=sep)
+
+
+@pytest.mark.parametrize("sep", ["\t", ",", ";", "|"])
+def test_chunked_ingest_equals_a_single_parse(app, monkeypatch, sep):
+    monkeypatch.setattr(app, "KPI_CHUNK_ROWS", 700)
+    text = export(5000, seed=37, sep=sep)
+    expected = pd.read_csv(io.StringIO(text), sep=sep)
+    pd.testing.assert_frame_equal(app.ingest_kpi_table(text), expected, check_dtype=False)
+    upload = io.BytesIO(("\ufeff" + text).encode("utf-8"))
+    fractions = []
+    pd.testing.assert_frame_equal(app.ingest_kpi_table(upload, progress=fractions.append), expected, check_dtype=False)
+    assert len(fractions) == 8 and fractions == sorted(fractions) and fractions[-1] == 1.0
+
+
+def test_columns_mixing_numbers_and_text_become_text(app, monkeypatch):
+    monkeypatch.setattr(app, "KPI_CHUNK_ROWS", 2)
+    df = app.ingest_kpi_table("Agent,Calls,Note\nann,3,\nbob,5,\ncat,x,late\n")
+    assert df["Calls"].tolist() == ["3", "5", "x"]
+    assert df["Note"].isna().tolist() == [True, True, False]
+
+
+def test_empty_and_oversized_tables_are_refused(app, monkeypatch):
+    with pytest.raises(ValueError, match="empty"):
+        app.ingest_kpi_table("  \n")
+    with pytest.raises(ValueError, match="no rows"):
+        app.ingest_kpi_table("Agent,Calls\n")
+    monkeypatch.setattr(app, "KPI_UPLOAD_MAX_ROWS", 10)
+    with pytest.raises(ValueError, match="more than 10 rows"):
+        app.ingest_kpi_table(export(11, seed=1))
+    monkeypatch.setattr(app, "KPI_UPLOAD_MAX_BYTES", 100)
+    with pytest.raises(ValueError, match="MB"):
+        app.ingest_kpi_table(export(10, seed=1))
+
+
+@pytest.mark.benchmark
+def test_benchmark_kpi_ingest(app, report, rows=60000):
+    """Save path for a full-day AHT export: python-engine sniff plus CSV round trip versus chunked ingestion"""
+    text = export(rows, seed=37)
+
+    start = perf_counter()
+    legacy = pd.read_csv(io.StringIO(text), sep=None, engine="python")
+    legacy_parse_ms = (perf_counter() - start) * 1000
+    start = perf_counter()
+    stored = legacy.to_csv(index=False)
+    legacy_store_ms = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    df = app.ingest_kpi_table(text)
+    parse_ms = (perf_counter() - start) * 1000
+    start = perf_counter()
+    blob = app.encode_kpi_table(df)
+    store_ms = (perf_counter() - start) * 1000
+
+    pd.testing.assert_frame_equal(df, legacy, check_dtype=False)
+    report("Live KPI ingestion", [
+        {"Path": "Python-engine sniff + to_csv", "Rows": len(legacy), "Parse (ms)": round(legacy_parse_ms, 1),
+         "Serialize (ms)": round(legacy_store_ms, 1), "Stored (KB)": round(len(stored.encode()) / 1024, 1)},
+        {"Path": "Sampled sniff + C-engine chunks + columnar blob", "Rows": len(df), "Parse (ms)": round(parse_ms, 1),
+         "Serialize (ms)": round(store_ms, 1), "Stored (KB)": round(len(blob) / 1024, 1)}
+    ])
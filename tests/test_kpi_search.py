@@ -0,0 +1,92 @@
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def row_apply(df, query):
+    """The old search: every cell of every row as text"""
+    return df[df.apply(lambda row: row.astype(str).str.contains(query, case=False, na=False).any(), axis=1)]
+
+
+@pytest.fixture
+def table(app):
+    df = pd.DataFrame({
+        "Agent": pd.Series(["Ann", "Anna", "agent1", "agent10", "agent100", None], dtype="str"),
+        "Group": pd.Series(["US-A", "US-B", "US-A", "US-C", "US-B", "US-A"], dtype="str"),
+        "Calls": [12, 120, 3, 7, 0, 1],
+    })
+    app.add_hold_table("admin", df)
+    return app, app.get_latest_hold_table()[0], df
+
+
+def test_search_is_case_insensitive_and_matches_substrings(table):
+    app, table_id, df = table
+    assert app.search_hold_table(table_id, "ann")["Agent"].tolist() == ["Ann", "Anna"]
+    assert app.search_hold_table(table_id, "AGENT1")["Agent"].tolist() == ["agent1", "agent10", "agent100"]
+    assert app.search_hold_table(table_id, "12")["Calls"].tolist() == [12, 120]
+    assert len(app.search_hold_table(table_id, "  ")) == len(df)
+    assert app.search_hold_table(table_id, "nan").empty
+
+
+def test_own_rows_need_the_exact_name(table):
+    app, table_id, _ = table
+    assert app.find_own_kpi_rows(table_id, "ann")["Agent"].tolist() == ["Ann"]
+    assert app.find_own_kpi_rows(table_id, " agent1 ")["Agent"].tolist() == ["agent1"]
+    assert app.find_own_kpi_rows(table_id, "agent").empty
+
+
+def test_cleared_table_searches_come_back_empty(table):
+    app, table_id, _ = table
+    app.clear_hold_tables()
+    app.load_hold_table.clear()
+    assert app.search_hold_table(table_id, "ann").empty
+    assert app.find_own_kpi_rows(table_id, "ann").empty
+
+
+def test_index_matches_row_wise_apply(app):
+    rng = np.random.default_rng(29)
+    df = pd.DataFrame({"Agent": [f"agent{i}" for i in range(300)], "Calls": rng.integers(0, 120, 300)})
+    index = app.KpiSearchIndex(df)
+    for query in ("agent1", "agent2", "gent3", "7", "99", "zzz"):
+        assert df.index[index.search(query)].tolist() == row_apply(df, query).index.tolist()
+
+
+@pytest.mark.benchmark
+def test_benchmark_kpi_search(app, report, rows=2000, queries=20):
+    """Search box cost per keystroke: row-wise apply versus the prebuilt search index"""
+    rng = np.random.default_rng(29)
+    df = pd.DataFrame({
+        "Agent": [f"agent{i}" for i in range(rows)],
+        "Group": rng.choice(["US-A", "US-B", "US-C"], rows),
+        "Calls": rng.integers(0, 120, rows),
+        "AHT (s)": rng.normal(420, 60, rows).round(1)
+    })
+    # Unpadded names overlap by prefix (agent1 is inside agent10 and agent100),
+    # so a full name must still return every row containing it
+    names = [f"agent{int(i)}" for i in rng.integers(1, rows // 10, queries)]
+    partials = [name[:-1] for name in names]
+    numbers = [str(int(i)) for i in rng.integers(0, 120, queries)]
+
+    start = perf_counter()
+    index = app.KpiSearchIndex(df)
+    build_ms = (perf_counter() - start) * 1000
+
+    results = []
+    for label, batch in [("Full agent name", names), ("Partial text", partials), ("Number", numbers)]:
+        start = perf_counter()
+        expected = [row_apply(df, query).index.tolist() for query in batch]
+        apply_ms = (perf_counter() - start) * 1000 / len(batch)
+        start = perf_counter()
+        found = [df.index[index.search(query)].tolist() for query in batch]
+        index_ms = (perf_counter() - start) * 1000 / len(batch)
+        assert found == expected
+        results.append({"Query": label, "Row-wise apply (ms)": round(apply_ms, 2),
+                        "Search index (ms)": round(index_ms, 3), "Index build, once (ms)": round(build_ms, 2)})
+    start = perf_counter()
+    own = [index.find_rows(name).tolist() for name in names]
+    own_ms = (perf_counter() - start) * 1000 / len(names)
+    assert own == [[int(name[5:])] for name in names]
+    results.append({"Query": "Own row by exact name", "Search index (ms)": round(own_ms, 4)})
+    report("Live KPI search latency", results)
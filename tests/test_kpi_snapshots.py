@@ -0,0 +1,119 @@
+import sqlite3
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def uploads(agent_count, count, seed):
+    """A first AHT table and count - 1 re-pastes with about 5% of agents changed each time"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Agent": pd.Series([f"agent{i:04d}" for i in range(agent_count)], dtype="str"),
+        "Group": pd.Series(rng.choice(["US-A", "US-B", "US-C"], agent_count), dtype="str"),
+        "Calls": rng.integers(0, 20, agent_count),
+        "AHT (s)": rng.normal(420, 60, agent_count).round(1),
+        "Hold (s)": rng.normal(35, 10, agent_count).round(1)
+    })
+    tables = [df]
+    for _ in range(count - 1):
+        df = df.copy()
+        changed = rng.choice(agent_count, max(1, agent_count // 20), replace=False)
+        df.loc[changed, "Calls"] += rng.integers(1, 5, len(changed))
+        df.loc[changed, "AHT (s)"] = rng.normal(420, 60, len(changed)).round(1)
+        df.loc[changed, "Hold (s)"] = rng.normal(35, 10, len(changed)).round(1)
+        tables.append(df)
+    return tables
+
+
+def stored_chain():
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        return conn.execute("SELECT id, base_id FROM hold_tables ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_every_snapshot_decodes_to_its_upload(app):
+    tables = uploads(200, app.KPI_SNAPSHOT_KEYFRAME_EVERY + 3, seed=31)
+    for df in tables:
+        app.add_hold_table("admin", df)
+    app.load_hold_table.clear()
+    snapshots = app.get_hold_table_snapshots()
+    assert len(snapshots) == len(tables)
+    for (table_id, _, _), df in zip(snapshots, tables):
+        pd.testing.assert_frame_equal(app.load_hold_table(table_id), df)
+
+    # Deltas against the previous snapshot, with a full keyframe to bound the chain
+    bases = [base_id for _, base_id in stored_chain()]
+    keyframes = [n for n, base_id in enumerate(bases) if base_id is None]
+    assert keyframes == [0, app.KPI_SNAPSHOT_KEYFRAME_EVERY]
+    assert all(bases[n] == snapshots[n - 1][0] for n in range(len(bases)) if n not in keyframes)
+
+
+def test_delta_handles_added_columns_and_new_rows(app):
+    first = pd.DataFrame({"Agent": pd.Series(["ann", "bob"], dtype="str"), "Calls": [1, 2]})
+    second = pd.DataFrame({"Agent": pd.Series(["ann", "bob", "cat"], dtype="str"), "Calls": [1, 2, 3],
+                           "Note": pd.Series([None, "late", None], dtype="str")})
+    app.add_hold_table("admin", first)
+    app.add_hold_table("admin", second)
+    app.load_hold_table.clear()
+    pd.testing.assert_frame_equal(app.load_hold_table(app.get_latest_hold_table()[0]), second)
+
+
+def test_trend_lines_up_each_agent_across_snapshots(app):
+    tables = uploads(5, 3, seed=31)
+    for df in tables:
+        app.add_hold_table("admin", df)
+    snapshots = [(table_id, f"0{n}:00") for n, (table_id, _, _) in enumerate(app.get_hold_table_snapshots())]
+    trend = app.kpi_trend(snapshots, "AHT (s)")
+    assert trend.shape == (3, 5)
+    assert trend["agent0002"].tolist() == [df.loc[2, "AHT (s)"] for df in tables]
+    assert app.kpi_trend(snapshots, "AHT (s)", agents=["agent0001"]).columns.tolist() == ["agent0001"]
+    assert app.kpi_trend(snapshots, "No such metric").empty
+
+
+@pytest.mark.benchmark
+def test_benchmark_kpi_snapshots(app, report, agent_count=1000, count=12):
+    """Snapshot store size and query cost for a day of AHT re-pastes"""
+    tables = uploads(agent_count, count, seed=31)
+    full_blobs = [app.encode_kpi_table(df) for df in tables]
+    stored = []
+    for n, df in enumerate(tables):
+        keyframe = n % app.KPI_SNAPSHOT_KEYFRAME_EVERY == 0
+        stored.append((None if keyframe else n - 1, app.encode_kpi_table(df, None if keyframe else tables[n - 1])))
+
+    decoded = {}
+
+    def load(snapshot):
+        if snapshot not in decoded:
+            base_id, blob = stored[snapshot]
+            decoded[snapshot] = app.decode_kpi_table(blob, load(base_id) if base_id is not None else None)
+        return decoded[snapshot]
+
+    start = perf_counter()
+    for snapshot in range(count):
+        load(snapshot)
+    replay_ms = (perf_counter() - start) * 1000
+    start = perf_counter()
+    app.decode_kpi_table(stored[-1][1], decoded[count - 2])
+    latest_ms = (perf_counter() - start) * 1000
+    start = perf_counter()
+    trend = app.kpi_trend([(snapshot, f"{snapshot:02d}:00") for snapshot in range(count)], "AHT (s)", load=load)
+    trend_ms = (perf_counter() - start) * 1000
+
+    for n, df in enumerate(tables):
+        pd.testing.assert_frame_equal(decoded[n], df)
+    assert trend.shape == (count, agent_count)
+    delta_bytes = sum(len(blob) for _, blob in stored)
+    full_bytes = sum(len(blob) for blob in full_blobs)
+    assert delta_bytes < full_bytes
+    report("Live KPI snapshot store", [{
+        "Snapshots": count,
+        "Full copies (KB)": round(full_bytes / 1024, 1),
+        "Delta store (KB)": round(delta_bytes / 1024, 1),
+        "Decode all (ms)": round(replay_ms, 1),
+        "Decode latest from cached base (ms)": round(latest_ms, 2),
+        "AHT trend, all agents (ms)": round(trend_ms, 1)
+    }])
@@ -0,0 +1,85 @@
+import io
+import sqlite3
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def kpi_frame(rows, seed, width=4):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Agent": [f"agent{i:0{width}d}" for i in range(rows)],
+        "Group": rng.choice(["US-A", "US-B", "US-C"], rows),
+        "Calls": rng.integers(0, 120, rows),
+        "AHT (s)": rng.normal(420, 60, rows).round(1),
+        "Hold (s)": rng.normal(35, 10, rows).round(1),
+    })
+
+
+def test_blob_round_trips_text_numbers_and_missing_cells(app):
+    df = pd.DataFrame({
+        "Agent": pd.Series(["ann", "bob", None], dtype="str"),
+        "Calls": [3, 0, 7],
+        "AHT (s)": [401.5, np.nan, 388.0],
+        "On target": [True, False, True],
+        "Note": pd.Series(["", "late", None], dtype="str"),
+    })
+    decoded = app.decode_kpi_table(app.encode_kpi_table(df))
+    pd.testing.assert_frame_equal(decoded, df)
+    assert decoded["Agent"].isna().tolist() == [False, False, True]
+    assert decoded["Note"].tolist()[:2] == ["", "late"]
+
+
+def test_stored_table_is_decoded_once_and_shared(app):
+    df = kpi_frame(50, seed=23)
+    app.add_hold_table("admin", df)
+    table_id = app.get_latest_hold_table()[0]
+    loaded = app.load_hold_table(table_id)
+    pd.testing.assert_frame_equal(loaded, df)
+    assert app.load_hold_table(table_id) is loaded
+    assert app.load_hold_table(table_id + 1) is None
+
+
+def test_tables_saved_as_csv_text_still_load(app):
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        conn.execute("INSERT INTO hold_tables (uploader, table_data, timestamp) VALUES ('admin', ?, '')",
+                     ("Agent,Calls\nann,3\nbob,5\n",))
+        conn.commit()
+    finally:
+        conn.close()
+    loaded = app.load_hold_table(app.get_latest_hold_table()[0])
+    assert loaded.to_dict("list") == {"Agent": ["ann", "bob"], "Calls": [3, 5]}
+
+
+@pytest.mark.benchmark
+def test_benchmark_kpi_table(app, report, rows=2000, views=50):
+    """Cost of serving the KPI table: CSV text parsed on every view versus a blob decoded once per process"""
+    df = kpi_frame(rows, seed=23)
+    df["Status"] = pd.Series(np.random.default_rng(23).choice(["On target", "Over", None], rows), dtype="str")
+    csv_text = df.to_csv(index=False)
+
+    start = perf_counter()
+    blob = app.encode_kpi_table(df)
+    encode_ms = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    for _ in range(views):
+        parsed = pd.read_csv(io.StringIO(csv_text))
+    csv_ms = (perf_counter() - start) * 1000 / views
+
+    start = perf_counter()
+    decoded = app.decode_kpi_table(blob)
+    decode_ms = (perf_counter() - start) * 1000
+
+    pd.testing.assert_frame_equal(decoded, df)
+    assert len(parsed) == rows
+    assert len(blob) < len(csv_text.encode())
+    report("Live KPI table serving cost", [
+        {"Storage": "CSV text", "Stored (KB)": round(len(csv_text.encode()) / 1024, 1),
+         "At upload (ms)": 0.0, "Per process (ms)": 0.0, "Per view (ms)": round(csv_ms, 2)},
+        {"Storage": "Columnar blob + shared cache", "Stored (KB)": round(len(blob) / 1024, 1),
+         "At upload (ms)": round(encode_ms, 2), "Per process (ms)": round(decode_ms, 2), "Per view (ms)": 0.0}
+    ])
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+LEGACY = {"2000-01-01": {
+    "ann": {"lunch": "19:30"},
+    "bob": {"early_tea": {"time": "16:00", "template": "Late Template", "booked_at": "2000-01-01 12:00:00"}},
+}}
+
+
+@pytest.fixture
+def script_dir(app, tmp_path, monkeypatch):
+    """A script directory other than the working directory, as when streamlit runs from elsewhere"""
+    directory = tmp_path / "app"
+    directory.mkdir()
+    monkeypatch.setattr(app, "__file__", str(directory / "USA FORM.py"))
+    return directory
+
+
+def test_legacy_bookings_next_to_the_script_are_migrated(app, script_dir):
+    (script_dir / "all_bookings.json").write_text(json.dumps(LEGACY), encoding="utf-8")
+    assert app.migrate_booking_data() == 2
+    bookings = app.get_bookings_for_date("2000-01-01")
+    assert bookings["ann"]["lunch"]["time"] == "19:30"
+    assert bookings["bob"]["early_tea"]["template"] == "Late Template"
+    assert (script_dir / "all_bookings.json.migrated").exists()
+    assert not (script_dir / "all_bookings.json").exists()
+    assert app.migrate_booking_data() == 0
+
+
+def test_unreadable_legacy_bookings_raise_and_stay_in_place(app, script_dir):
+    (script_dir / "all_bookings.json").write_text("{not json", encoding="utf-8")
+    with pytest.raises(ValueError, match="all_bookings.json"):
+        app.migrate_booking_data()
+    assert (script_dir / "all_bookings.json").exists()
@@ -0,0 +1,84 @@
+import sqlite3
+from time import perf_counter
+
+import pytest
+
+
+def presence_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT username, section, last_seen FROM user_presence ORDER BY username").fetchall()
+    finally:
+        conn.close()
+
+
+def test_heartbeats_coalesce_to_latest_per_user_and_section(app, tmp_path):
+    now = [0.0]
+    tracker = app.PresenceTracker(clock=lambda: now[0])
+    tracker.heartbeat("ann", "breaks", "US", "2000-01-01 10:00:00")
+    tracker.heartbeat("ann", "breaks", "US", "2000-01-01 10:00:30")
+    tracker.heartbeat("bob", "chat", "US", "2000-01-01 10:00:10")
+    assert tracker.flush() == 2
+    assert presence_rows(tmp_path / "data" / "requests.db") == [
+        ("ann", "breaks", "2000-01-01 10:00:30"),
+        ("bob", "chat", "2000-01-01 10:00:10"),
+    ]
+    assert tracker.flush_count == 1
+
+
+def test_heartbeat_flushes_once_the_interval_has_passed(app):
+    now = [0.0]
+    tracker = app.PresenceTracker(clock=lambda: now[0])
+    tracker.heartbeat("ann", "breaks", "US", "2000-01-01 10:00:00")
+    assert tracker.flush_count == 0
+    now[0] = app.PRESENCE_FLUSH_INTERVAL
+    tracker.heartbeat("bob", "breaks", "US", "2000-01-01 10:00:05")
+    assert tracker.flush_count == 1
+    assert tracker.pending() == {}
+
+
+def test_failed_flush_keeps_the_batch_for_the_next_one(app, tmp_path):
+    broken = tmp_path / "no_tables.db"
+    tracker = app.PresenceTracker(connect=lambda: sqlite3.connect(broken), clock=lambda: 0.0)
+    tracker.heartbeat("ann", "breaks", "US", "2000-01-01 10:00:00")
+    assert tracker.flush() == 0
+    assert ("ann", "breaks") in tracker.pending()
+
+
+@pytest.mark.benchmark
+def test_benchmark_presence_writes(app, tmp_path, report):
+    """Sessions heartbeating on their rerun timers for 5 simulated minutes: heartbeats versus batched writes"""
+    simulated_seconds = 300
+    results = []
+    for sessions in (10, 50, 150, 300):
+        db_path = tmp_path / f"presence_{sessions}.db"
+        setup = sqlite3.connect(db_path)
+        setup.execute(app.PRESENCE_TABLE_SQL)
+        setup.close()
+        now = [0.0]
+        tracker = app.PresenceTracker(connect=lambda: sqlite3.connect(db_path), clock=lambda: now[0])
+        # One admin (15 s rerun) for every 20 agents (60 s rerun), starts staggered
+        periods = [15 if i % 20 == 0 else 60 for i in range(sessions)]
+        next_run = [(i * 7) % p for i, p in enumerate(periods)]
+        start = perf_counter()
+        for second in range(simulated_seconds):
+            now[0] = float(second)
+            seen_at = f"2000-01-01 00:{second // 60:02d}:{second % 60:02d}"
+            for i, period in enumerate(periods):
+                if next_run[i] <= second:
+                    tracker.heartbeat(f"user{i}", "breaks", "bench", seen_at)
+                    next_run[i] += period
+        tracker.flush()
+        elapsed = perf_counter() - start
+        minutes = simulated_seconds / 60
+
+        assert len(presence_rows(db_path)) == sessions
+        assert tracker.flush_count <= simulated_seconds / app.PRESENCE_FLUSH_INTERVAL + 1
+        results.append({
+            "Sessions": sessions,
+            "Heartbeats": tracker.heartbeat_count,
+            "Unbatched writes/min": round(tracker.heartbeat_count / minutes, 1),
+            "Batched writes/min": round(tracker.flush_count / minutes, 1),
+            "Wall time (ms)": round(elapsed * 1000, 1)
+        })
+    report("Presence heartbeat write rate", results)
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+START = datetime(2000, 1, 1, 12, 0)
+
+
+def scheduler_with(app, name, func):
+    scheduler = app.JobScheduler()
+    scheduler.register(name, "0 5 * * *", func)
+    return scheduler
+
+
+def test_scheduler_follows_the_swapped_module_clock(app):
+    scheduler = scheduler_with(app, "job", lambda: None)
+    fake = app.FakeClock(START)
+    with app.use_clock(fake):
+        scheduler._sync_jobs(scheduler.now())
+        assert scheduler.now() == START
+        assert scheduler._due["job"] == datetime(2000, 1, 2, 5, 0)
+        fake.advance(hours=17)
+        assert scheduler.run_job("job") == "ok"
+    assert scheduler.now().year > 2000
+
+
+def test_lease_expires_on_the_scheduler_clock(app):
+    fake = app.FakeClock(START)
+    seen = []
+    other = scheduler_with(app, "job", lambda: seen.append("other"))
+
+    def hold_the_lease():
+        seen.append(other.run_job("job", force=True))
+        # A holder that never finishes loses the lease once the clock passes it
+        fake.advance(seconds=app.SCHEDULER_LEASE_SECONDS + 1)
+        seen.append(other.run_job("job", force=True))
+
+    holder = scheduler_with(app, "job", hold_the_lease)
+    with app.use_clock(fake):
+        holder._sync_jobs(holder.now())
+        other._sync_jobs(other.now())
+        assert holder.run_job("job", force=True) == "ok"
+    assert seen == [None, "other", "ok"]
@@ -0,0 +1,113 @@
+import sqlite3
+from datetime import datetime, time, timedelta
+from time import perf_counter
+
+import pytest
+
+YESTERDAY, TODAY = "2000-01-01", "2000-01-02"
+START, END = datetime(2000, 1, 2, 11, 30), datetime(2000, 1, 3, 1, 0)
+
+
+def query(sql, params=()):
+    conn = sqlite3.connect("data/requests.db")
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def replay_shift(app, plans):
+    """Replay a day minute by minute on a FakeClock.
+
+    Starts at 11:30 with yesterday's floor still booked, crosses the 11:59
+    rollover (called every minute, as reruns do), has every agent book just
+    after it, then steps to 01:00 counting the 5-minute, 1-minute and on-time
+    break reminders as they fall due. Nothing waits on wall time.
+    """
+    limits = {break_type: len(plans) for break_type in app.BREAK_TYPES}
+    fake = app.FakeClock(START)
+    marker = {"date": None}
+    rollovers, booked, reminders_due, fired = [], {}, {}, 0
+    with app.use_clock(fake):
+        for agent, selections in plans:
+            app.book_agent_breaks(YESTERDAY, agent, "Default Template", selections, limits)
+        while fake.now() < END:
+            now = fake.now()
+            summary = app.roll_over_break_day(marker)
+            if summary:
+                rollovers.append((now, summary))
+            # Agents book in the first minutes after the new day opens
+            if rollovers and len(booked) < len(plans):
+                for agent, selections in plans[len(booked):len(booked) + len(plans) // 10 + 1]:
+                    status, _ = app.book_agent_breaks(TODAY, agent, "Default Template", selections, limits)
+                    assert status == "booked"
+                    booked[agent] = now
+                    for slot in selections.values():
+                        break_at = datetime.combine(now.date(), time()) + timedelta(minutes=app.parse_break_time(slot))
+                        if break_at < now:
+                            break_at += timedelta(days=1)
+                        for lead in (5, 1, 0):
+                            reminders_due.setdefault(break_at - timedelta(minutes=lead), []).append(agent)
+            fired += len(reminders_due.pop(now, []))
+            fake.advance(minutes=1)
+    return rollovers, booked, fired
+
+
+def test_replay_rolls_over_once_and_fires_every_reminder(app, floor):
+    plans = floor(40, seed=19)
+    rollovers, booked, fired = replay_shift(app, plans)
+
+    assert [(at.strftime("%H:%M"), s["archived_rows"]) for at, s in rollovers] == [("11:59", 40 * len(app.BREAK_TYPES))]
+    assert len(booked) == 40
+    assert fired == 40 * len(app.BREAK_TYPES) * 3
+    stamped = dict(query("SELECT agent, MIN(booked_at) FROM break_bookings WHERE date = ? GROUP BY agent", (TODAY,)))
+    assert stamped == {agent: at.strftime("%Y-%m-%d %H:%M:%S") for agent, at in booked.items()}
+
+
+def test_rollover_is_idempotent(app, floor):
+    plans = floor(20, seed=19)
+    replay_shift(app, plans)
+    archive = query("SELECT date, booking_count, payload FROM break_bookings_archive")
+    live = query("SELECT agent, break_type, slot FROM break_bookings ORDER BY agent, break_type")
+
+    # The same marker, a fresh marker from another session, and the next morning before the cutoff
+    for marker, now in (({"date": TODAY}, END), ({"date": None}, END), ({"date": None}, datetime(2000, 1, 3, 11, 0))):
+        with app.use_clock(app.FakeClock(now)):
+            assert app.roll_over_break_day(marker) is None
+    assert query("SELECT date, booking_count, payload FROM break_bookings_archive") == archive
+    assert query("SELECT agent, break_type, slot FROM break_bookings ORDER BY agent, break_type") == live
+    assert query("SELECT date FROM break_day_rollovers") == [(TODAY,)]
+    assert archive[0][:2] == (YESTERDAY, 20 * len(app.BREAK_TYPES))
+
+
+def test_rollover_only_clears_todays_bookings_made_before_the_cutoff(app):
+    limits = {break_type: 5 for break_type in app.BREAK_TYPES}
+    for agent, now in (("early", datetime(2000, 1, 2, 10, 0)), ("ontime", datetime(2000, 1, 2, 11, 59))):
+        with app.use_clock(app.FakeClock(now)):
+            app.book_agent_breaks(TODAY, agent, "Default Template", {"lunch": "19:30"}, limits)
+    with app.use_clock(app.FakeClock(datetime(2000, 1, 2, 12, 0))):
+        assert app.roll_over_break_day({"date": None})["purged_rows"] == 1
+    assert query("SELECT agent FROM break_bookings") == [("ontime",)]
+    assert query("SELECT date, template, break_type, slot, booked FROM break_slot_occupancy") == [
+        (TODAY, "Default Template", "lunch", "19:30", 1)
+    ]
+
+
+@pytest.mark.benchmark
+def test_benchmark_shift_replay(app, floor, report, agent_count=300):
+    """A day from 11:30 to 01:00 on a fake clock, without waiting on wall time"""
+    plans = floor(agent_count, seed=19)
+    start = perf_counter()
+    rollovers, booked, fired = replay_shift(app, plans)
+    wall_ms = (perf_counter() - start) * 1000
+    steps = int((END - START).total_seconds() // 60)
+
+    assert len(rollovers) == 1 and len(booked) == agent_count
+    assert fired == agent_count * len(app.BREAK_TYPES) * 3
+    report("Simulated shift replay", [{
+        "Simulated minutes": steps,
+        "Wall time (ms)": round(wall_ms, 1),
+        "Speed-up": f"{steps * 60000 / wall_ms:,.0f}x",
+        "Agents booked": len(booked),
+        "Reminders fired": fired
+    }])